@@ -0,0 +1,61 @@
+import contextlib
+import gc
+import multiprocessing
+import os
+from OutputSink import CaptureSink
+from ShellEmulator import ShellEmulator
+
+
+# Образ, загруженный до создания пула: процессы-обработчики получают его
+# через fork и делят страницы памяти с родителем до первой записи
+_shared_vfs = None
+
+
+def collect_scripts(paths):
+    """Разворачивает директории в отсортированный список скриптов *.txt"""
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            scripts.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                  if name.endswith('.txt') and os.path.isfile(os.path.join(path, name))))
+        else:
+            scripts.append(path)
+    return scripts
+
+
+def run_script(script_path):
+    """Выполняет один скрипт над общим образом; возвращает (скрипт, код выхода, вывод)"""
+    output = CaptureSink()
+    status = 0
+    with contextlib.redirect_stdout(output):
+        try:
+            shell = ShellEmulator(_shared_vfs.vfs_path, script_path, vfs=_shared_vfs, output=output)
+            if not shell.run():
+                status = 1
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print(f"ОШИБКА: {e}")
+            status = 1
+    return script_path, status, output.getvalue()
+
+
+def run_batch(vfs, script_paths, jobs=None):
+    """Выполняет скрипты параллельно над одним загруженным образом VFS
+
+    Каждый скрипт выполняется в свежем процессе, порожденном fork от
+    родителя (maxtasksperchild=1), поэтому изменения, сделанные одним
+    скриптом, не видны другим. Результаты возвращаются в порядке script_paths.
+    """
+    global _shared_vfs
+    _shared_vfs = vfs
+    # Объекты дерева не должны попадать в сборку мусора в потомках,
+    # иначе она будет трогать их страницы и разрушать их общее использование
+    gc.freeze()
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(jobs or os.cpu_count(), maxtasksperchild=1) as pool:
+            return pool.map(run_script, script_paths, chunksize=1)
+    finally:
+        gc.unfreeze()
+        _shared_vfs = None
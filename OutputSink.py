@@ -0,0 +1,103 @@
+import codecs
+import io
+import sys
+
+
+BUFFER_SIZE = 64 * 1024
+
+
+def terminal_bytes(text, encoding='utf-8'):
+    """Байты вывода для терминала или сокета: суррогаты surrogateescape из
+    прочитанных файлов снова становятся исходными байтами"""
+    return text.encode(encoding, 'surrogateescape')
+
+
+class BufferedSink:
+    """Блочно-буферизованный вывод эмулятора в текстовый поток
+
+    Строки копятся в списке и уходят в поток одной записью, когда набирается
+    buffer_size символов или при явном flush(). Байты на выходе те же, что
+    дал бы print() по строке, но системный вызов делается на блок, а не на строку.
+    """
+
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE):
+        self.stream = stream if stream is not None else sys.stdout
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self._drain()
+
+    def write_line(self, text=''):
+        """Аналог print(text): строка и перевод строки"""
+        self.write(f"{text}\n")
+
+    def write_lines(self, lines):
+        """Пишет строки, каждую с переводом строки"""
+        for line in lines:
+            self.write(f"{line}\n")
+
+    def write_chunks(self, chunks):
+        """Пишет куски байт (bytes/memoryview) прямо в двоичный буфер потока,
+        без декодирования в текст. Поток без буфера получает их текстом, байты
+        не в UTF-8 - суррогатами surrogateescape, как у decode_chunks"""
+        buffer = getattr(self.stream, 'buffer', None)
+        if buffer is not None and sum(len(chunk) for chunk in chunks) < self.buffer_size:
+            # Мелкое содержимое в UTF-8 идет вместе с текстом, чтобы не сбрасывать поток
+            try:
+                self.write(b''.join(chunks).decode('utf-8'))
+                return
+            except UnicodeDecodeError:
+                pass
+        if buffer is None:
+            decoder = codecs.getincrementaldecoder('utf-8')('surrogateescape')
+            for chunk in chunks:
+                self.write(decoder.decode(chunk))
+            self.write(decoder.decode(b'', True))
+            return
+
+        # Накопленный текст должен уйти в поток раньше байт
+        self._drain()
+        self.stream.flush()
+        for chunk in chunks:
+            buffer.write(chunk)
+
+    def _drain(self):
+        if self._parts:
+            text = ''.join(self._parts)
+            self._parts = []
+            self._size = 0
+            try:
+                self.stream.write(text)
+            except UnicodeEncodeError:
+                # Строки файлов с байтами не в UTF-8 (surrogateescape) уходят
+                # в поток теми же байтами, что и у cat
+                self.stream.flush()
+                self.stream.buffer.write(terminal_bytes(text, self.stream.encoding))
+
+    def flush(self):
+        """Отдает накопленное в поток и сбрасывает сам поток"""
+        self._drain()
+        self.stream.flush()
+
+
+class CaptureSink(BufferedSink):
+    """Вывод в память: для сеансов сервера, пакетного режима и проверок"""
+
+    def __init__(self):
+        super().__init__(io.StringIO(), sys.maxsize)
+
+    def getvalue(self):
+        self._drain()
+        return self.stream.getvalue()
+
+    def take(self):
+        """Возвращает накопленный вывод и очищает буфер"""
+        value = self.getvalue()
+        self.stream.seek(0)
+        self.stream.truncate()
+        return value
@@ -0,0 +1,151 @@
+import hashlib
+import io
+import json
+import os
+
+
+CACHE_DIR = '__scriptcache__'
+# Меняется при изменении формата инструкций, чтобы старый кэш не подхватывался
+FORMAT_VERSION = 4
+REDIRECTS = ('>', '>>')
+# Разделители слов и экранируемые в двойных кавычках символы - как у shlex (posix)
+WHITESPACE = ' \t\r\n'
+QUOTED_ESCAPES = ('\\', '"')
+
+
+def _tokens(line):
+    """Слова строки с учетом кавычек и '\\' как в shlex (posix), с его же
+    сообщениями об ошибках: список пар (слово, оператор ли). Оператором
+    считаются только '|', '>' и '>>' вне кавычек
+    """
+    tokens = []
+    # None - слова нет; '' - пустое слово из кавычек
+    word = None
+    quote = None
+    index = 0
+    while index < len(line):
+        char = line[index]
+        if quote == "'":
+            if char == "'":
+                quote = None
+            else:
+                word += char
+        elif quote == '"':
+            if char == '"':
+                quote = None
+            elif char == '\\' and line[index + 1:index + 2] in QUOTED_ESCAPES:
+                index += 1
+                word += line[index]
+            else:
+                word += char
+        elif char in '\'"':
+            quote = char
+            word = word or ''
+        elif char == '\\':
+            if index + 1 == len(line):
+                raise ValueError("No escaped character")
+            index += 1
+            word = (word or '') + line[index]
+        elif char in WHITESPACE or char in '|>':
+            if word is not None:
+                tokens.append((word, False))
+                word = None
+            if char == '>' and line.startswith('>>', index):
+                tokens.append(('>>', True))
+                index += 1
+            elif char not in WHITESPACE:
+                tokens.append((char, True))
+        else:
+            word = (word or '') + char
+        index += 1
+    if quote is not None:
+        raise ValueError("No closing quotation")
+    if word is not None:
+        tokens.append((word, False))
+    return tokens
+
+
+def split_command(line):
+    """Разбирает строку в конвейер: (список команд, перенаправление или None)
+
+    Команды разделяются '|', каждая - список слов с учетом кавычек; '|', '>'
+    и '>>' в кавычках или после '\\' - обычные символы слова.
+    Перенаправление - пара ['>' или '>>', путь]. ValueError при ошибке синтаксиса.
+    """
+    tokens = _tokens(line)
+
+    stages = [[]]
+    redirect = None
+    index = 0
+    while index < len(tokens):
+        token, operator = tokens[index]
+        if not operator:
+            stages[-1].append(token)
+        elif token == '|':
+            if not stages[-1] or redirect is not None:
+                raise ValueError("пустая команда в конвейере")
+            stages.append([])
+        else:
+            if redirect is not None:
+                raise ValueError("повторное перенаправление")
+            if index + 1 == len(tokens) or tokens[index + 1][1]:
+                raise ValueError(f"после '{token}' не указан файл")
+            redirect = [token, tokens[index + 1][0]]
+            index += 1
+        index += 1
+
+    if not stages[-1] and (len(stages) > 1 or redirect is not None):
+        raise ValueError("пустая команда в конвейере")
+    return stages, redirect
+
+
+def compile_script(text):
+    """Разбирает текст скрипта в список инструкций (строка, команды конвейера,
+    перенаправление, ошибка разбора)
+
+    Пустые строки и комментарии отбрасываются. Строка с синтаксической
+    ошибкой остается на своем месте с командами None, чтобы ошибка была
+    выдана при выполнении ровно на ней.
+    """
+    program = []
+    for line in io.StringIO(text, newline=None):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            program.append((line, *split_command(line), None))
+        except ValueError as e:
+            program.append((line, None, None, str(e)))
+    return program
+
+
+def cache_path(script_path, data):
+    """Путь к кэшу разобранного скрипта; ключ - хэш содержимого"""
+    digest = hashlib.sha256(b'%d:' % FORMAT_VERSION + data).hexdigest()
+    return os.path.join(os.path.dirname(os.path.abspath(script_path)), CACHE_DIR, digest + '.json')
+
+
+def load_script(script_path):
+    """Загружает скрипт: из кэша на диске, если содержимое не менялось, иначе разбирает и кэширует"""
+    with open(script_path, 'rb') as f:
+        data = f.read()
+    text = data.decode('utf-8')
+
+    path = cache_path(script_path, data)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [tuple(instruction) for instruction in json.load(f)]
+    except (OSError, ValueError):
+        pass
+
+    program = compile_script(text)
+    # Кэш - только ускорение: если каталог недоступен для записи, работаем без него
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(program, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+    return program
@@ -0,0 +1,88 @@
+import sys
+from bisect import bisect_left
+from itertools import islice
+
+
+# Больше вариантов на одно нажатие Tab не выдается: длинный список все равно не читают
+COMPLETION_LIMIT = 256
+# Границы слова: пробелы и символы конвейера, '/' остается внутри пути
+DELIMITERS = ' \t\n|><'
+
+
+class Completer:
+    """Дополнение по Tab в интерактивном режиме: имена команд и пути VFS
+
+    Имена детей директории берутся из ее отсортированного индекса
+    (DirectoryNode.names_with_prefix): начало диапазона ищется делением
+    пополам, поэтому задержка не зависит от размера директории. Индекс
+    строится при первом обращении и дальше поддерживается при изменениях VFS.
+    """
+
+    def __init__(self, shell, limit=COMPLETION_LIMIT):
+        self.shell = shell
+        self.limit = limit
+        self._readline = None
+        self._matches = []
+
+    def install(self):
+        """Подключает дополнение к input(); False, если readline недоступен
+        или ввод идет не с терминала"""
+        if not sys.stdin.isatty():
+            return False
+        try:
+            import readline
+        except ImportError:
+            return False
+
+        self._readline = readline
+        readline.set_completer(self.complete)
+        readline.set_completer_delims(DELIMITERS)
+        if 'libedit' in (readline.__doc__ or ''):
+            readline.parse_and_bind('bind ^I rl_complete')
+        else:
+            readline.parse_and_bind('tab: complete')
+        return True
+
+    def complete(self, text, state):
+        """Функция дополнения для readline: state-й вариант или None"""
+        if state == 0:
+            line = self._readline.get_line_buffer()
+            try:
+                self._matches = self.matches(line[:self._readline.get_begidx()], text)
+            except Exception:
+                # Исключения внутри completer readline молча проглатывает
+                self._matches = []
+        return self._matches[state] if state < len(self._matches) else None
+
+    def matches(self, before, text):
+        """Варианты для слова text; before - часть строки перед ним"""
+        before = before.rstrip()
+        if not before or before[-1] == '|':
+            return self.command_matches(text)
+        return self.path_matches(text)
+
+    def command_matches(self, text):
+        commands = sorted(self.shell.commands)
+        matches = []
+        for name in commands[bisect_left(commands, text):]:
+            if not name.startswith(text):
+                break
+            matches.append(name)
+        return matches
+
+    def path_matches(self, text):
+        """Дети директории из text, чьи имена начинаются с последней части text.
+        Директории дополняются '/', чтобы можно было продолжить путь"""
+        directory_part, slash, prefix = text.rpartition('/')
+        vfs = self.shell.vfs
+        if slash:
+            directory = vfs.resolve_path(self.shell.cwd, directory_part or '/')
+        else:
+            directory = self.shell.cwd
+        if directory is None or not directory.is_dir:
+            return []
+
+        head = directory_part + slash
+        get_child = directory.get_child
+        return [f"{head}{name}{'/' if get_child(name).is_dir else ''}"
+                for name in islice(directory.names_with_prefix(prefix), self.limit)]
@@ -1,177 +1,474 @@
-import shlex
+import ScriptCompiler
 import socket
 import getpass
 import os
 import sys
 import calendar
+import re
+import time
 from datetime import datetime
+from collections import deque
+from functools import partial
+from itertools import islice
 from VirtualFileSystem import VirtualFileSystem
+import VfsContent
+import VfsIndex
+from VfsNode import format_permissions
+from OutputSink import BufferedSink, CaptureSink
+from ShellProfiler import ShellProfiler, VfsCounters
+from ShellCompleter import Completer
+
+
+HOME_PATH = '/home/user'
+
+
+def iter_lines(text):
+    """Строки текста по одной, без построения списка"""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def child_label(label, name):
+    """Путь ребенка для вывода: к пути-аргументу команды добавляется имя"""
+    return f"{label.rstrip('/')}/{name}"
+
+
+def iter_directories(node, label, postorder=False):
+    """(путь для вывода, директория) для директорий поддерева node по порядку имен,
+    без рекурсии. С postorder директория идет после своих поддиректорий, как в du"""
+    if not postorder:
+        yield label, node
+    stack = [(node, label, node.sorted_names())]
+    while stack:
+        directory, label, names = stack[-1]
+        for name in names:
+            child = directory.get_child(name)
+            if child.is_dir:
+                label = child_label(label, name)
+                if not postorder:
+                    yield label, child
+                stack.append((child, label, child.sorted_names()))
+                break
+        else:
+            stack.pop()
+            if postorder:
+                yield label, directory
 
 
 class ShellEmulator:
-    def __init__(self, vfs_path, script_path=None):
+    def __init__(self, vfs_path, script_path=None, persist=False, vfs=None, output=None, watch=False,
+                 atomic=False, shared=False):
         self.username = getpass.getuser()
         self.hostname = socket.gethostname()
-        self.vfs = VirtualFileSystem(vfs_path)
-        self.current_path = '/home/user'
+        # Весь вывод команд идет через буферизованный приемник, см. OutputSink
+        self.out = output if output is not None else BufferedSink()
+        # Уже загруженный образ можно передать через vfs, чтобы не читать его заново
+        self.vfs = vfs if vfs is not None else VirtualFileSystem(vfs_path, journal=persist)
+        self.cwd = None
+        self.current_path = HOME_PATH
+        self.go_home()
+        # С watch образ перечитывается перед командой, если файл на диске изменился
+        self.image_stamp = self.vfs.image_stamp() if watch else None
         self.running = True
         self.script_path = script_path
         self.script_mode = script_path is not None
-        self.script_lines = []
+        # С atomic ошибка в скрипте отменяет все его изменения VFS
+        self.atomic = atomic
+        # Образ общий с другими сеансами (сервер): журнал отмены образа один на
+        # всех, поэтому транзакции сеанса затронули бы чужие изменения
+        self.shared = shared
+        self.script_program = []
         self.script_index = 0
+        # Источник строк для команд, читающих stdin; None - настоящий stdin через input()
+        self.stdin_lines = None
+        # ShellProfiler при включенном профилировании (stats on, --profile), иначе None
+        self.profiler = None
+        self.commands = {
+            'exit': self.exit_command,
+            'ls': self.ls_command,
+            'cd': self.cd_command,
+            'pwd': self.pwd_command,
+            'cat': self.cat_command,
+            'echo': self.echo_command,
+            'mkdir': self.mkdir_command,
+            'touch': self.touch_command,
+            'rev': self.rev_command,
+            'cal': self.cal_command,
+            'rmdir': self.rmdir_command,
+            'chmod': self.chmod_command,
+            'stats': self.stats_command,
+            'find': self.find_command,
+            'grep': self.grep_command,
+            'head': self.head_command,
+            'tail': self.tail_command,
+            'du': self.du_command,
+            'tree': self.tree_command,
+            'rm': self.rm_command,
+            'mv': self.mv_command,
+            'cp': self.cp_command,
+            'reload': self.reload_command,
+            'begin': self.begin_command,
+            'savepoint': self.savepoint_command,
+            'rollback': self.rollback_command,
+            'commit': self.commit_command,
+        }
+        # Потоковые варианты команд для конвейеров: (аргументы, строки на входе или None)
+        # -> генератор строк. Остальные команды в конвейере выполняются с перехватом вывода
+        self.stages = {
+            'cat': self.cat_stage,
+            'echo': self.echo_stage,
+            'rev': self.rev_stage,
+            'grep': self.grep_stage,
+            'head': self.head_stage,
+            'tail': self.tail_stage,
+        }
 
         if self.script_mode:
             self.load_script()
 
     def load_script(self):
-        """Загружает скрипт из файла"""
+        """Загружает скрипт из файла, разобранный заранее (с кэшем на диске)"""
         try:
-            with open(self.script_path, 'r', encoding='utf-8') as f:
-                self.script_lines = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+            self.script_program = [self.bind_instruction(*instruction)
+                                   for instruction in ScriptCompiler.load_script(self.script_path)]
         except Exception as e:
-            print(f"ОШИБКА ЗАГРУЗКИ СКРИПТА: {e}")
+            self.out.write_line(f"ОШИБКА ЗАГРУЗКИ СКРИПТА: {e}")
+            self.out.flush()
             sys.exit(1)
 
+    def go_home(self):
+        """Переходит в домашнюю директорию (в корень, если ее нет в образе)"""
+        home = self.vfs.resolve_path('/', HOME_PATH)
+        self.set_cwd(home if home is not None and home.is_dir else self.vfs.root)
+
+    def set_cwd(self, node):
+        """Делает узел текущей директорией; путь строится по ссылкам на родителей"""
+        self.cwd = node
+        self.current_path = self.vfs.get_path(node)
+
+    def bind_instruction(self, line, stages, redirect, error):
+        """Превращает разобранную строку скрипта в (строка, обработчик, команда, аргументы, ошибка)
+
+        Одиночная команда связывается прямо с обработчиком из commands,
+        конвейер и перенаправление - с run_pipeline.
+        """
+        if not stages or not stages[0]:
+            return line, None, None, None, error
+        if len(stages) == 1 and redirect is None:
+            command = stages[0][0]
+            return line, self.commands.get(command), command, stages[0][1:], None
+
+        label = ' | '.join(stage[0] for stage in stages)
+        if redirect is not None:
+            label += f" {redirect[0]}"
+        return line, self.run_pipeline, label, (stages, redirect), None
+
     def get_prompt(self):
         """Формирует приглашение к вводу"""
-        if self.current_path.startswith('/home/user'):
-            display_path = '~' + self.current_path[len('/home/user'):]
+        if self.current_path.startswith(HOME_PATH):
+            display_path = '~' + self.current_path[len(HOME_PATH):]
         else:
             display_path = self.current_path
 
         return f"{self.username}@{self.hostname}:{display_path}$ "
 
     def parse_command(self, command_line):
-        """Парсит командную строку с учетом кавычек"""
+        """Парсит командную строку с учетом кавычек: (команды конвейера, перенаправление)"""
         try:
-            return shlex.split(command_line)
+            return ScriptCompiler.split_command(command_line)
         except ValueError as e:
-            print(f"Ошибка парсинга: {e}")
+            self.out.write_line(f"Ошибка парсинга: {e}")
             return None
 
-    def execute_command(self, command_parts):
-        """Выполняет команду с остановкой при ошибке в скриптовом режиме"""
-        if not command_parts:
+    def execute_command(self, stages, redirect=None):
+        """Выполняет команду или конвейер с остановкой при ошибке в скриптовом режиме"""
+        _, handler, command, args, _ = self.bind_instruction(None, stages, redirect, None)
+        if command is None:
             return True
+        return self.dispatch(handler, command, args)
+
+    def run_pipeline(self, pipeline):
+        """Выполняет конвейер: каждая команда - генератор строк, читающий строки
+        предыдущей, поэтому данные проходят по строке без накопления вывода"""
+        stages, redirect = pipeline
+        lines = None
+        for command, *args in stages:
+            stage = self.stages.get(command)
+            if stage is None:
+                if command not in self.commands:
+                    # Как у одиночной команды в dispatch: сообщение видно и в интерактивном режиме
+                    self.out.write_line(f"{command}: команда не найдена")
+                    raise RuntimeError(f"Неизвестная команда: {command}")
+                stage = partial(self.captured_stage, command)
+            lines = stage(args, lines)
 
-        command = command_parts[0]
-        args = command_parts[1:]
-
-        try:
-            if command == "exit":
-                self.running = False
-                print("Выход из эмулятора")
-                return False
-
-            elif command == "ls":
-                self.ls_command(args)
-
-            elif command == "cd":
-                self.cd_command(args)
-
-            elif command == "pwd":
-                print(self.current_path)
-
-            elif command == "cat":
-                self.cat_command(args)
-
-            elif command == "echo":
-                self.echo_command(args)
-
-            elif command == "mkdir":
-                self.mkdir_command(args)
+        if redirect is None:
+            self.out.write_lines(lines)
+            return
 
-            elif command == "touch":
-                self.touch_command(args)
+        operator, path = redirect
+        if not self.vfs.write_file(self.cwd, path, lines, append=operator == '>>'):
+            raise RuntimeError(f"Не удалось записать в файл '{path}'")
 
-            elif command == "rev":
-                self.rev_command(args)
+    def read_stdin(self):
+        """Строки стандартного ввода: stdin_lines сеанса или настоящий stdin"""
+        if self.stdin_lines is not None:
+            yield from self.stdin_lines
+            return
+        self.out.flush()
+        try:
+            while True:
+                yield input()
+        except EOFError:
+            pass
+
+    def captured_stage(self, command, args, lines):
+        """Команда без потокового варианта: вывод перехватывается целиком и
+        отдается по строкам, вход подается через stdin_lines"""
+        saved_out, saved_stdin = self.out, self.stdin_lines
+        self.out = CaptureSink()
+        if lines is not None:
+            self.stdin_lines = lines
+        try:
+            self.commands[command](args)
+            text = self.out.getvalue()
+        finally:
+            self.out, self.stdin_lines = saved_out, saved_stdin
+        if text:
+            yield from iter_lines(text[:-1] if text.endswith('\n') else text)
+
+    def cat_stage(self, args, lines):
+        if not args:
+            if lines is None:
+                lines = self.read_stdin()
+            yield from lines
+            return
+        for file_path in args:
+            yield from VfsContent.iter_text_lines(self.file_chunks(file_path))
 
-            elif command == "cal":
-                self.cal_command(args)
+    def head_stage(self, args, lines):
+        count, paths = self.parse_line_count(args)
+        if paths or lines is None:
+            yield from self.captured_stage('head', args, lines)
+            return
+        # islice перестает читать вход после count строк
+        yield from islice(lines, count)
 
-            elif command == "rmdir":
-                self.rmdir_command(args)
+    def tail_stage(self, args, lines):
+        count, paths = self.parse_line_count(args)
+        if paths or lines is None:
+            yield from self.captured_stage('tail', args, lines)
+            return
+        if count:
+            yield from deque(lines, maxlen=count)
 
-            elif command == "chmod":
-                self.chmod_command(args)
+    def echo_stage(self, args, lines):
+        yield ' '.join(args)
 
-            else:
-                print(f"{command}: команда не найдена")
+    def rev_stage(self, args, lines):
+        if args:
+            lines = args
+        elif lines is None:
+            lines = self.read_stdin()
+        for line in lines:
+            yield line[::-1]
+
+    def grep_stage(self, args, lines):
+        """grep по строкам предыдущей команды; с путем - обычный поиск по VFS"""
+        if lines is None or len(args) != 1:
+            yield from self.captured_stage('grep', args, lines)
+            return
+        try:
+            regex = re.compile(args[0])
+        except re.error as e:
+            raise RuntimeError(f"Неверное регулярное выражение: {e}")
+        for line in lines:
+            if regex.search(line):
+                yield line
+
+    def enable_profiling(self):
+        """Включает сбор времени команд и счетчиков VFS"""
+        if self.profiler is None:
+            self.vfs.counters = VfsCounters()
+            self.profiler = ShellProfiler(self.vfs.counters)
+
+    def disable_profiling(self):
+        self.profiler = None
+        self.vfs.counters = None
+
+    def dispatch(self, handler, command, args):
+        """Вызывает обработчик команды из таблицы commands"""
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        failed = handler is None
+        try:
+            if handler is None:
+                self.out.write_line(f"{command}: команда не найдена")
                 if self.script_mode:
                     raise RuntimeError(f"Неизвестная команда: {command}")
+            elif handler(args) is False:
+                return False
 
             return True
 
         except Exception as e:
+            failed = True
             if self.script_mode:
-                print(f"ОШИБКА В СКРИПТЕ: {e}")
+                self.out.write_line(f"ОШИБКА В СКРИПТЕ: {e}")
                 raise  # Пробрасываем ошибку выше для остановки скрипта
             return True
 
+        finally:
+            # Граница команды: записи журнала не ждут следующего изменения дольше срока пачки
+            self.vfs.poll_journal()
+            if profiler is not None:
+                profiler.record(command, time.perf_counter() - start, failed)
+
+    def exit_command(self, args):
+        """Команда exit"""
+        self.running = False
+        self.out.write_line("Выход из эмулятора")
+        return False
+
+    def pwd_command(self, args):
+        """Команда pwd"""
+        self.out.write_line(self.current_path)
+
     def ls_command(self, args):
-        """Команда ls"""
+        """Команда ls [-R] [-n N] [--offset K] [путь] - содержимое директории по страницам;
+        с -R - и всех поддиректорий"""
+        limit = None
+        offset = 0
+        recursive = False
+        paths = []
+        args = iter(args)
+        for arg in args:
+            if arg == '-R':
+                recursive = True
+            elif arg in ('-n', '--offset'):
+                value = next(args, '')
+                if not value.isdigit():
+                    raise RuntimeError(f"'{arg}': ожидается неотрицательное число")
+                if arg == '-n':
+                    limit = int(value)
+                else:
+                    offset = int(value)
+            else:
+                paths.append(arg)
+
         target_path = self.current_path
-        if args:
-            target_path = args[0]
+        if paths:
+            target_path = paths[0]
 
-        node = self.vfs.resolve_path(self.current_path, target_path)
+        node = self.vfs.resolve_path(self.cwd, target_path)
         if not node:
             raise RuntimeError(f"Нет доступа к '{target_path}': Нет такого файла или каталога")
 
-        if node['type'] != 'directory':
+        if not node.is_dir:
             raise RuntimeError(f"'{target_path}': Не директория")
 
-        files = list(node['content'].keys())
-        for file in sorted(files):
-            file_type = node['content'][file]['type']
-            permissions = node['content'][file].get('permissions', '644')
-            indicator = '/' if file_type == 'directory' else ''
-            print(f"{permissions} {file}{indicator}")
+        stop = None if limit is None else offset + limit
+        if not recursive:
+            self.write_listing(node, offset, stop)
+            return
+
+        for index, (label, directory) in enumerate(iter_directories(node, target_path)):
+            if index:
+                self.out.write_line()
+            self.out.write_line(f"{label}:")
+            self.write_listing(directory, offset, stop)
+
+    def write_listing(self, node, offset, stop):
+        get_child = node.get_child
+        self.out.write_lines(f"{format_permissions(child)} {file}{'/' if child.is_dir else ''}"
+                             for file, child in ((name, get_child(name))
+                                                 for name in node.sorted_names(offset, stop)))
 
     def cd_command(self, args):
         """Команда cd"""
         if not args:
-            self.current_path = "/home/user"
+            self.go_home()
             return
 
         if len(args) > 1:
             raise RuntimeError("Слишком много аргументов")
 
         target_path = args[0]
-        new_node = self.vfs.resolve_path(self.current_path, target_path)
+        new_node = self.vfs.resolve_path(self.cwd, target_path)
 
         if not new_node:
             raise RuntimeError(f"'{target_path}': Нет такой директории")
 
-        if new_node['type'] != 'directory':
+        if not new_node.is_dir:
             raise RuntimeError(f"'{target_path}': Не директория")
 
-        # Обновляем путь
-        if target_path.startswith('/'):
-            self.current_path = target_path
-        else:
-            if self.current_path == '/':
-                self.current_path = '/' + target_path
-            else:
-                self.current_path = self.current_path + '/' + target_path
+        self.set_cwd(new_node)
 
-        self.normalize_path()
+    def file_chunks(self, file_path):
+        chunks = self.vfs.get_file_chunks(self.cwd, file_path)
+        if chunks is None:
+            raise RuntimeError(f"'{file_path}': Нет такого файла")
+        return chunks
 
     def cat_command(self, args):
-        """Команда cat"""
+        """Команда cat - байты файла выводятся кусками, без декодирования"""
         if not args:
             raise RuntimeError("Отсутствуют аргументы")
 
         for file_path in args:
-            content = self.vfs.get_file_content(self.current_path, file_path)
-            if content is None:
-                raise RuntimeError(f"'{file_path}': Нет такого файла")
-            print(content)
+            self.out.write_chunks(self.file_chunks(file_path))
+            self.out.write("\n")
+
+    def parse_line_count(self, args):
+        """Разбирает [-n N] [файлы...] для head/tail: (N, файлы)"""
+        count = 10
+        paths = []
+        args = iter(args)
+        for arg in args:
+            if arg == '-n':
+                value = next(args, '')
+                if not value.isdigit():
+                    raise RuntimeError("'-n': ожидается неотрицательное число")
+                count = int(value)
+            else:
+                paths.append(arg)
+        return count, paths
+
+    def head_command(self, args):
+        """Команда head [-n N] <файл>... - первые N строк; читаются только нужные куски"""
+        self.print_lines_of(args, VfsContent.head, 'head')
+
+    def tail_command(self, args):
+        """Команда tail [-n N] <файл>... - последние N строк; куски читаются с конца"""
+        self.print_lines_of(args, VfsContent.tail, 'tail')
+
+    def print_lines_of(self, args, select, command):
+        count, paths = self.parse_line_count(args)
+        if not paths:
+            if self.stdin_lines is None:
+                raise RuntimeError(f"Использование: {command} [-n N] <файл>...")
+            stage = self.head_stage if command == 'head' else self.tail_stage
+            self.out.write_lines(stage(args, self.stdin_lines))
+            return
+
+        for file_path in paths:
+            chunks = self.file_chunks(file_path)
+            if len(paths) > 1:
+                self.out.write_line(f"==> {file_path} <==")
+            if count:
+                self.out.write_chunks(select(chunks, count))
+                self.out.write("\n")
 
     def echo_command(self, args):
         """Команда echo"""
-        print(' '.join(args))
+        self.out.write_line(' '.join(args))
 
     def mkdir_command(self, args):
         """Команда mkdir"""
@@ -179,7 +476,7 @@ class ShellEmulator:
             raise RuntimeError("Отсутствуют аргументы")
 
         for dir_path in args:
-            success = self.vfs.create_directory(self.current_path, dir_path)
+            success = self.vfs.create_directory(self.cwd, dir_path)
             if not success:
                 raise RuntimeError(f"Не удалось создать директорию '{dir_path}'")
 
@@ -189,7 +486,7 @@ class ShellEmulator:
             raise RuntimeError("Отсутствуют аргументы")
 
         for file_path in args:
-            success = self.vfs.create_file(self.current_path, file_path)
+            success = self.vfs.create_file(self.cwd, file_path)
             if not success:
                 raise RuntimeError(f"Не удалось создать файл '{file_path}'")
 
@@ -197,16 +494,20 @@ class ShellEmulator:
         """Команда rev - переворачивает строки"""
         if not args:
             # Читаем из stdin
+            if self.stdin_lines is not None:
+                self.out.write_lines(line[::-1] for line in self.stdin_lines)
+                return
+            self.out.flush()
             try:
                 while True:
                     line = input()
-                    print(line[::-1])
+                    self.out.write_line(line[::-1])
+                    self.out.flush()
             except EOFError:
                 pass
         else:
             # Обрабатываем аргументы
-            for arg in args:
-                print(arg[::-1])
+            self.out.write_lines(arg[::-1] for arg in args)
 
     def cal_command(self, args):
         """Команда cal - отображает календарь"""
@@ -220,7 +521,7 @@ class ShellEmulator:
                 year = int(args[0])
                 if year < 1 or year > 9999:
                     raise ValueError("Год должен быть в диапазоне 1-9999")
-                print(calendar.calendar(year))
+                self.out.write_line(calendar.calendar(year))
             except ValueError as e:
                 raise RuntimeError(f"Неверный год: {e}")
 
@@ -233,13 +534,13 @@ class ShellEmulator:
                     raise ValueError("Месяц должен быть в диапазоне 1-12")
                 if year < 1 or year > 9999:
                     raise ValueError("Год должен быть в диапазоне 1-9999")
-                print(calendar.month(year, month))
+                self.out.write_line(calendar.month(year, month))
             except ValueError as e:
                 raise RuntimeError(f"Неверные параметры: {e}")
 
         elif len(args) == 0:
             # Текущий месяц
-            print(calendar.month(year, month))
+            self.out.write_line(calendar.month(year, month))
 
         else:
             raise RuntimeError("Неверное количество аргументов. Использование: cal [месяц] [год]")
@@ -250,70 +551,389 @@ class ShellEmulator:
             raise RuntimeError("Отсутствуют аргументы")
 
         for dir_path in args:
-            success = self.vfs.remove_directory(self.current_path, dir_path)
+            success = self.vfs.remove_directory(self.cwd, dir_path)
             if not success:
                 raise RuntimeError(f"Не удалось удалить директорию '{dir_path}'")
 
     def chmod_command(self, args):
-        """Команда chmod - изменяет права доступа"""
+        """Команда chmod [-R] <права> <файл>... - изменяет права доступа (с -R - всему поддереву)"""
+        flags, args = self.split_flags(args, 'R')
         if len(args) < 2:
-            raise RuntimeError("Недостаточно аргументов. Использование: chmod <права> <файл>")
+            raise RuntimeError("Недостаточно аргументов. Использование: chmod [-R] <права> <файл>")
 
         mode = args[0]
         targets = args[1:]
 
         for target_path in targets:
-            success = self.vfs.change_permissions(self.current_path, target_path, mode)
+            success = self.vfs.change_permissions(self.cwd, target_path, mode, recursive='R' in flags)
             if not success:
                 raise RuntimeError(f"Не удалось изменить права доступа для '{target_path}'")
 
-    def normalize_path(self):
-        """Нормализует путь"""
-        self.current_path = self.current_path.replace('//', '/')
-        if self.current_path.endswith('/') and len(self.current_path) > 1:
-            self.current_path = self.current_path[:-1]
+    def split_flags(self, args, flags):
+        """Отделяет флаги вида -r/-rf от путей: (множество букв флагов, пути)"""
+        found = set()
+        paths = []
+        for arg in args:
+            if len(arg) > 1 and arg.startswith('-'):
+                unknown = set(arg[1:]) - set(flags)
+                if unknown:
+                    raise RuntimeError(f"Неизвестный флаг '-{''.join(sorted(unknown))}'")
+                found.update(arg[1:])
+            else:
+                paths.append(arg)
+        return found, paths
+
+    def refresh_cwd(self):
+        """После удаления или переноса: текущая директория могла уйти из дерева или сменить путь"""
+        # Удаленный узел сохраняет ссылку parent, поэтому проверяется каждое звено
+        node = self.cwd
+        while node.parent is not None and node.parent.get_child(node.name) is node:
+            node = node.parent
+        if node is self.vfs.root:
+            self.set_cwd(self.cwd)
+        else:
+            self.go_home()
+
+    def rm_command(self, args):
+        """Команда rm [-r] [-f] <путь>... - удаляет файлы, с -r и директории; поддерево
+        отцепляется сразу, память освобождается позже"""
+        flags, paths = self.split_flags(args, 'rRf')
+        if not paths:
+            raise RuntimeError("Отсутствуют аргументы")
+        recursive = 'r' in flags or 'R' in flags
+
+        try:
+            for path in paths:
+                node = self.vfs.resolve_path(self.cwd, path)
+                if node is None:
+                    if 'f' in flags:
+                        continue
+                    raise RuntimeError(f"'{path}': Нет такого файла или каталога")
+                if node.parent is None:
+                    raise RuntimeError("Нельзя удалить корневую директорию")
+                if node.is_dir and not recursive:
+                    raise RuntimeError(f"'{path}': Это директория (используйте rm -r)")
+                if not self.vfs.remove(self.cwd, path, recursive):
+                    raise RuntimeError(f"Не удалось удалить '{path}'")
+        finally:
+            self.refresh_cwd()
+
+    def mv_command(self, args):
+        """Команда mv <источник>... <назначение> - перенос или переименование за O(1)"""
+        if len(args) < 2:
+            raise RuntimeError("Использование: mv <источник>... <назначение>")
+        *sources, target = args
+        self.check_targets(sources, target)
+
+        try:
+            for source in sources:
+                if not self.vfs.move(self.cwd, source, target):
+                    raise RuntimeError(f"Не удалось переместить '{source}' в '{target}'")
+        finally:
+            self.refresh_cwd()
+
+    def cp_command(self, args):
+        """Команда cp [-r] <источник>... <назначение> - копирование; содержимое файлов
+        копии разделяется с оригиналом до первой записи"""
+        flags, paths = self.split_flags(args, 'rR')
+        if len(paths) < 2:
+            raise RuntimeError("Использование: cp [-r] <источник>... <назначение>")
+        *sources, target = paths
+        self.check_targets(sources, target)
+
+        for source in sources:
+            node = self.vfs.resolve_path(self.cwd, source)
+            if node is None:
+                raise RuntimeError(f"'{source}': Нет такого файла или каталога")
+            if node.is_dir and not flags:
+                raise RuntimeError(f"'{source}': Это директория (используйте cp -r)")
+            if not self.vfs.copy(self.cwd, source, target, recursive=True):
+                raise RuntimeError(f"Не удалось скопировать '{source}' в '{target}'")
+
+    def check_targets(self, sources, target):
+        """Несколько источников можно перенести или скопировать только в директорию"""
+        if len(sources) > 1:
+            node = self.vfs.resolve_path(self.cwd, target)
+            if node is None or not node.is_dir:
+                raise RuntimeError(f"'{target}': Не директория")
+
+    def reload_command(self, args):
+        """Команда reload - применяет к дереву изменения образа на диске; текущая
+        директория сохраняется, если она осталась в образе"""
+        if args:
+            raise RuntimeError("Использование: reload")
+        added, removed, changed = self.vfs.reload()
+        self.refresh_cwd()
+        self.out.write_line(f"Образ перезагружен: добавлено {added}, удалено {removed}, изменено {changed}")
+
+    def begin_command(self, args):
+        """Команда begin - начинает транзакцию (внутри открытой - вложенную)"""
+        if args:
+            raise RuntimeError("Использование: begin")
+        self._check_transactions()
+        self.vfs.begin()
+
+    def savepoint_command(self, args):
+        """Команда savepoint <имя> - точка сохранения в текущей транзакции"""
+        if len(args) != 1:
+            raise RuntimeError("Использование: savepoint <имя>")
+        self._check_transactions()
+        self.vfs.savepoint(args[0])
+
+    def rollback_command(self, args):
+        """Команда rollback [имя] - отменяет изменения до точки сохранения или всю транзакцию"""
+        if len(args) > 1:
+            raise RuntimeError("Использование: rollback [имя]")
+        self._check_transactions()
+        try:
+            undone = self.vfs.rollback(args[0] if args else None)
+        finally:
+            self.refresh_cwd()
+        self.out.write_line(f"Отменено изменений: {undone}")
+
+    def commit_command(self, args):
+        """Команда commit - закрывает текущую транзакцию"""
+        if args:
+            raise RuntimeError("Использование: commit")
+        self._check_transactions()
+        self.vfs.commit()
+
+    def _check_transactions(self):
+        if self.shared:
+            # Сеанс сервера интерактивный, ошибки команд в нем не печатаются
+            message = "Транзакции недоступны в сеансе сервера: образ общий для всех сеансов"
+            self.out.write_line(message)
+            raise RuntimeError(message)
+
+    def poll_image(self):
+        """С watch: перезагружает образ, если его файл изменился с прошлой проверки"""
+        if self.image_stamp is None:
+            return
+        stamp = self.vfs.image_stamp()
+        if stamp is None or stamp == self.image_stamp:
+            return
+        # Запоминается и при ошибке: недописанный образ перечитается при следующем изменении
+        self.image_stamp = stamp
+        try:
+            self.reload_command([])
+        except Exception as e:
+            self.out.write_line(f"Ошибка перезагрузки образа: {e}")
+
+    def display_path(self, start_arg, start, path):
+        """Путь найденного узла в виде, начинающемся с аргумента команды, как в find"""
+        relative = path[len(self.vfs.get_path(start)):].lstrip('/')
+        if not relative:
+            return start_arg
+        prefix = start_arg.rstrip('/') if start_arg != '/' else ''
+        return f"{prefix}/{relative}"
+
+    def find_command(self, args):
+        """Команда find [путь] [-name шаблон] [-type f|d] [-perm [-|/]права] [-maxdepth N] -
+        поиск по индексу имен и таблице метаданных"""
+        options = {'-name': None, '-type': None, '-perm': None, '-maxdepth': None}
+        paths = []
+        args = iter(args)
+        for arg in args:
+            if arg in options:
+                options[arg] = next(args, None)
+                if options[arg] is None:
+                    raise RuntimeError(f"'{arg}': не указано значение")
+            else:
+                paths.append(arg)
+        if len(paths) > 1:
+            raise RuntimeError("Использование: find [путь] [-name шаблон] [-type f|d] [-perm права] [-maxdepth N]")
+        if options['-type'] not in (None, 'f', 'd'):
+            raise RuntimeError(f"'-type': неизвестный тип '{options['-type']}' (f или d)")
+        if options['-perm'] is not None and VfsIndex.permission_test(options['-perm']) is None:
+            raise RuntimeError(f"'-perm': неверные права '{options['-perm']}'")
+        maxdepth = options['-maxdepth']
+        if maxdepth is not None:
+            if not maxdepth.isdigit():
+                raise RuntimeError("'-maxdepth': ожидается неотрицательное число")
+            maxdepth = int(maxdepth)
+
+        start_arg = paths[0] if paths else '.'
+        start = self.vfs.resolve_path(self.cwd, start_arg)
+        if not start:
+            raise RuntimeError(f"'{start_arg}': Нет такого файла или каталога")
+
+        self.out.write_lines(self.display_path(start_arg, start, path)
+                             for path, _ in VfsIndex.find(self.vfs, start, options['-name'], options['-type'],
+                                                          options['-perm'], maxdepth))
+
+    def grep_command(self, args):
+        """Команда grep <выражение> [путь] - поиск строк с отбором файлов по индексу триграмм"""
+        if not args or len(args) > 2:
+            raise RuntimeError("Использование: grep <выражение> [путь]")
+
+        start_arg = args[1] if len(args) > 1 else '.'
+        start = self.vfs.resolve_path(self.cwd, start_arg)
+        if not start:
+            raise RuntimeError(f"'{start_arg}': Нет такого файла или каталога")
+
+        try:
+            matches = VfsIndex.grep(self.vfs, start, args[0])
+        except re.error as e:
+            raise RuntimeError(f"Неверное регулярное выражение: {e}")
+
+        if start.is_dir:
+            self.out.write_lines(f"{self.display_path(start_arg, start, path)}:{line}"
+                                 for path, line in matches)
+        else:
+            self.out.write_lines(line for _, line in matches)
+
+    def du_command(self, args):
+        """Команда du [-s] [путь...] - размер в байтах каждой директории поддерева
+        (с -s - только итог). Размеры берутся из индекса размеров, без обхода файлов"""
+        summarize = '-s' in args
+        paths = [arg for arg in args if arg != '-s'] or ['.']
+        sizes = self.vfs.get_size_index()
+
+        for path in paths:
+            node = self.vfs.resolve_path(self.cwd, path)
+            if not node:
+                raise RuntimeError(f"'{path}': Нет такого файла или каталога")
+            if summarize or not node.is_dir:
+                self.out.write_line(f"{sizes.get(node)[0]}\t{path}")
+            else:
+                self.out.write_lines(f"{sizes.get(directory)[0]}\t{label}"
+                                     for label, directory in iter_directories(node, path, postorder=True))
+
+    def tree_command(self, args):
+        """Команда tree [путь] - поддерево с отступами и итогом по числу директорий и файлов"""
+        if len(args) > 1:
+            raise RuntimeError("Использование: tree [путь]")
+
+        path = args[0] if args else '.'
+        node = self.vfs.resolve_path(self.cwd, path)
+        if not node:
+            raise RuntimeError(f"'{path}': Нет такого файла или каталога")
+
+        self.out.write_line(path)
+        if node.is_dir:
+            self.out.write_lines(self.tree_lines(node))
+        _, files, dirs = self.vfs.get_size_index().get(node)
+        self.out.write_line()
+        self.out.write_line(f"директорий: {dirs}, файлов: {files}")
+
+    def tree_lines(self, node):
+        """Строки tree без рекурсии: на стеке для каждой открытой директории
+        отступ, итератор имен и следующее имя (чтобы знать, последнее ли текущее)"""
+        names = node.sorted_names()
+        stack = [('', node, names, next(names, None))]
+        while stack:
+            indent, directory, names, name = stack[-1]
+            if name is None:
+                stack.pop()
+                continue
+            following = next(names, None)
+            stack[-1] = (indent, directory, names, following)
+            last = following is None
+            yield f"{indent}{'└── ' if last else '├── '}{name}"
+
+            child = directory.get_child(name)
+            if child.is_dir:
+                child_names = child.sorted_names()
+                stack.append((indent + ('    ' if last else '│   '), child, child_names, next(child_names, None)))
+
+    def stats_command(self, args):
+        """Команда stats - время команд и счетчики VFS (stats [on|off|reset])"""
+        if len(args) > 1:
+            raise RuntimeError("Использование: stats [on|off|reset]")
+
+        action = args[0] if args else None
+        if action == 'on':
+            self.enable_profiling()
+        elif action == 'off':
+            self.disable_profiling()
+        elif action == 'reset':
+            if self.profiler is not None:
+                self.disable_profiling()
+                self.enable_profiling()
+        elif action is not None:
+            raise RuntimeError(f"Неизвестный аргумент '{action}'. Использование: stats [on|off|reset]")
+        elif self.profiler is None:
+            self.out.write_line("Сбор статистики выключен: включите его через 'stats on' или --profile")
+        else:
+            self.out.write_lines(self.profiler.format_lines())
 
     def run_script_mode(self):
-        """Режим выполнения скрипта с остановкой при ошибках"""
-        for i, line in enumerate(self.script_lines, 1):
+        """Режим выполнения скрипта с остановкой при ошибках; с atomic скрипт
+        выполняется в транзакции, и ошибка отменяет все его изменения"""
+        if not self.atomic:
+            return self.run_script()
+
+        vfs = self.vfs
+        depth = vfs.transaction_depth()
+        vfs.begin()
+        try:
+            result = self.run_script()
+        except Exception:
+            # Транзакции, открытые самим скриптом, откатываются вместе с ней
+            undone = 0
+            while vfs.transaction_depth() > depth:
+                undone += vfs.rollback()
+            self.refresh_cwd()
+            self.out.write_line(f"Изменения скрипта отменены: {undone}")
+            raise
+        while vfs.transaction_depth() > depth:
+            vfs.commit()
+        return result
+
+    def run_script(self):
+        """Выполняет строки скрипта по очереди до ошибки или exit"""
+        out = self.out
+        for line, handler, command, args, error in self.script_program:
+            self.poll_image()
             prompt = self.get_prompt()
-            print(f"{prompt}{line}")
+            out.write(f"{prompt}{line}\n")
 
-            command_parts = self.parse_command(line)
-            if command_parts is None:
+            if error is not None:
+                out.write_line(f"Ошибка парсинга: {error}")
                 raise RuntimeError("Синтаксическая ошибка в команде")
 
-            should_continue = self.execute_command(command_parts)
+            should_continue = command is None or self.dispatch(handler, command, args)
             if not should_continue:
                 return True  # Нормальное завершение по exit
-            print()  # Пустая строка для читаемости
+            out.write("\n")  # Пустая строка для читаемости
 
         return True
 
     def run_interactive_mode(self):
         """Интерактивный режим"""
         self.terminal_start()
+        # Tab дополняет команды и пути, если ввод идет с терминала и есть readline
+        Completer(self).install()
 
         while self.running:
             try:
-                command_line = input(self.get_prompt()).strip()
-                if not command_line:
-                    continue
-
-                command_parts = self.parse_command(command_line)
-                if command_parts is None:
-                    continue
-
-                self.execute_command(command_parts)
-                print()
+                self.out.flush()
+                # Ввода можно ждать сколько угодно: журнал сбрасывается до него
+                self.vfs.sync()
+                line = input(self.get_prompt())
+                self.poll_image()
+                self.execute_line(line)
 
             except KeyboardInterrupt:
-                print("\nДля выхода введите 'exit'")
+                self.out.write_line("\nДля выхода введите 'exit'")
             except EOFError:
-                print("\nВыход из эмулятора")
+                self.out.write_line("\nВыход из эмулятора")
                 break
             except Exception as e:
-                print(f"Ошибка: {e}")
+                self.out.write_line(f"Ошибка: {e}")
+
+    def execute_line(self, command_line):
+        """Выполняет одну введенную строку как в интерактивном режиме"""
+        command_line = command_line.strip()
+        if not command_line:
+            return
+
+        parsed = self.parse_command(command_line)
+        if parsed is None:
+            return
+
+        self.execute_command(*parsed)
+        self.out.write_line()
 
     def terminal_start(self):
         """Приветственное сообщение"""
@@ -328,12 +948,15 @@ class ShellEmulator:
                 "Для выхода введите 'exit'\n"
                 + "-" * 50
         )
-        print(welcome_text)
+        self.out.write_line(welcome_text)
 
     def run(self):
         """Основной метод запуска"""
-        if self.script_mode:
-            return self.run_script_mode()
-        else:
-            self.run_interactive_mode()
-            return True
\ No newline at end of file
+        try:
+            if self.script_mode:
+                return self.run_script_mode()
+            else:
+                self.run_interactive_mode()
+                return True
+        finally:
+            self.out.flush()
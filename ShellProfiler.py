@@ -0,0 +1,101 @@
+import json
+
+
+class VfsCounters:
+    """Счетчики VFS: поиски путей, попадания в кэш путей, пройденные узлы,
+    декодированные байты содержимого"""
+    __slots__ = ('lookups', 'cache_hits', 'nodes_walked', 'bytes_decoded')
+
+    def __init__(self):
+        self.lookups = 0
+        self.cache_hits = 0
+        self.nodes_walked = 0
+        self.bytes_decoded = 0
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class CommandTiming:
+    """Время одной команды: число вызовов, ошибок и гистограмма задержек
+
+    Корзина i гистограммы считает вызовы длительностью меньше 2**i мкс,
+    поэтому процентили оцениваются сверху с точностью до степени двойки.
+    """
+    __slots__ = ('calls', 'errors', 'total', 'max', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = []
+
+    def record(self, seconds, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        if bucket >= len(self.histogram):
+            self.histogram.extend([0] * (bucket + 1 - len(self.histogram)))
+        self.histogram[bucket] += 1
+
+    def percentile(self, fraction):
+        """Верхняя граница корзины, в которую попадает доля fraction вызовов, в секундах"""
+        rank = fraction * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_seconds': self.total,
+            'max_seconds': self.max,
+            'p50_seconds': self.percentile(0.5),
+            'p99_seconds': self.percentile(0.99),
+            'histogram_us': {f"<{2 ** bucket}": count for bucket, count in enumerate(self.histogram) if count},
+        }
+
+
+class ShellProfiler:
+    """Статистика выполнения команд эмулятора и счетчики его VFS"""
+
+    def __init__(self, counters):
+        self.counters = counters
+        self.commands = {}
+
+    def record(self, command, seconds, failed):
+        timing = self.commands.get(command)
+        if timing is None:
+            timing = self.commands[command] = CommandTiming()
+        timing.record(seconds, failed)
+
+    def to_dict(self):
+        return {
+            'commands': {command: timing.to_dict() for command, timing in sorted(self.commands.items())},
+            'vfs': self.counters.to_dict(),
+        }
+
+    def dump(self, path):
+        """Записывает статистику в JSON-файл"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+    def format_lines(self):
+        """Строки таблицы для команды stats"""
+        yield (f"{'Команда':<10} {'Вызовов':>8} {'Ошибок':>7} {'Всего, мс':>10} "
+               f"{'p50, мкс':>9} {'p99, мкс':>9} {'Макс, мкс':>10}")
+        for command, timing in sorted(self.commands.items()):
+            yield (f"{command:<10} {timing.calls:>8} {timing.errors:>7} {timing.total * 1e3:>10.2f} "
+                   f"{timing.percentile(0.5) * 1e6:>9.0f} {timing.percentile(0.99) * 1e6:>9.0f} "
+                   f"{timing.max * 1e6:>10.0f}")
+        counters = self.counters
+        yield (f"VFS: поисков путей {counters.lookups} (из кэша {counters.cache_hits}), "
+               f"пройдено узлов {counters.nodes_walked}, декодировано байт {counters.bytes_decoded}")
@@ -0,0 +1,62 @@
+import asyncio
+import contextlib
+import os
+from OutputSink import CaptureSink, terminal_bytes
+from ShellEmulator import ShellEmulator
+
+
+class ShellServer:
+    """Сервер сеансов эмулятора на asyncio поверх Unix- или TCP-сокета
+
+    Все сеансы работают с одним загруженным образом VFS, у каждого
+    соединения свой ShellEmulator: текущая директория, приглашение и
+    состояние команд и свой приемник вывода в памяти: после каждой
+    строки накопленный вывод отправляется в соединение одной записью.
+    Транзакции (begin/rollback) в сеансах недоступны: журнал отмены у
+    образа один и откатил бы изменения других сеансов.
+    """
+
+    def __init__(self, vfs):
+        self.vfs = vfs
+        self.sessions = 0
+
+    async def handle_session(self, reader, writer):
+        """Один сеанс: приветствие, затем цикл строка -> вывод -> приглашение"""
+        self.sessions += 1
+        output = CaptureSink()
+        shell = ShellEmulator(self.vfs.vfs_path, vfs=self.vfs, output=output, shared=True)
+        shell.stdin_lines = []
+        try:
+            shell.terminal_start()
+            writer.write(terminal_bytes(output.take() + shell.get_prompt()))
+            await writer.drain()
+
+            while shell.running:
+                line = await reader.readline()
+                if not line:
+                    break
+                shell.execute_line(line.decode('utf-8', 'replace'))
+                text = output.take()
+                if shell.running:
+                    text += shell.get_prompt()
+                writer.write(terminal_bytes(text))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def serve(self, unix_path=None, host='127.0.0.1', port=None):
+        """Принимает соединения, пока процесс не будет остановлен"""
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            server = await asyncio.start_unix_server(self.handle_session, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_session, host, port)
+
+        async with server:
+            await server.serve_forever()
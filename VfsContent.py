@@ -0,0 +1,235 @@
+import base64
+import binascii
+import codecs
+import hashlib
+
+
+# Кратно 3, чтобы кусок base64 длины CHUNK_SIZE // 3 * 4 декодировался ровно в один кусок
+CHUNK_SIZE = 48 * 1024
+
+
+class ChunkedContent:
+    """Содержимое файла как последовательность кусков bytes не длиннее CHUNK_SIZE
+
+    Байты хранятся как есть, поэтому содержимое не в UTF-8 не теряется.
+    Куски неизменяемы: дописывание создает новый объект, разделяющий
+    старые куски, так что прежнее содержимое остается доступным наблюдателям.
+    """
+    __slots__ = ('chunks', 'size', '_digest')
+
+    def __init__(self, chunks=()):
+        self.chunks = list(chunks)
+        self.size = sum(len(chunk) for chunk in self.chunks)
+        self._digest = None
+
+    def __len__(self):
+        return self.size
+
+    def digest(self):
+        """Хэш содержимого (вычисляется один раз: куски неизменяемы)"""
+        if self._digest is None:
+            h = hashlib.blake2b(digest_size=20)
+            for chunk in self.chunks:
+                h.update(chunk)
+            self._digest = h.digest()
+        return self._digest
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(bytes(data[start:start + CHUNK_SIZE]) for start in range(0, len(data), CHUNK_SIZE))
+
+    @classmethod
+    def from_base64(cls, encoded):
+        """Декодирует base64 по кускам, не создавая промежуточной копии всего файла"""
+        step = CHUNK_SIZE // 3 * 4
+        try:
+            return cls(base64.b64decode(encoded[start:start + step], validate=True)
+                       for start in range(0, len(encoded), step))
+        except binascii.Error:
+            # Пробелы, переводы строк или ошибка в данных: декодируем целиком, как раньше
+            return cls.from_bytes(base64.b64decode(encoded))
+
+    def tobytes(self):
+        return b''.join(self.chunks)
+
+
+class BlobStore:
+    """Общее хранилище содержимого файлов с подсчетом ссылок
+
+    Одинаковое содержимое хранится одним объектом: intern() возвращает
+    уже известный объект с тем же содержимым и увеличивает счетчик,
+    release() уменьшает его и забывает блоб на нуле. Ключ - само значение
+    для str и bytes (хэш и сравнение Python) или хэш кусков для
+    ChunkedContent. Байты снимка (memoryview) лежат в mmap и не учитываются.
+    """
+
+    def __init__(self):
+        # ключ -> [содержимое, число ссылок, размер в байтах]
+        self._blobs = {}
+
+    @staticmethod
+    def _key(content):
+        if isinstance(content, ChunkedContent):
+            return content.digest()
+        if isinstance(content, (str, bytes)):
+            return content
+        return None
+
+    def intern(self, content):
+        key = self._key(content)
+        if key is None:
+            return content
+        entry = self._blobs.get(key)
+        if entry is None:
+            size = len(content.encode('utf-8')) if isinstance(content, str) else len(content)
+            entry = self._blobs[key] = [content, 0, size]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, content):
+        key = self._key(content)
+        entry = self._blobs.get(key) if key is not None else None
+        if entry is None or entry[0] is not content:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._blobs[key]
+
+    def refcount(self, content):
+        key = self._key(content)
+        entry = self._blobs.get(key) if key is not None else None
+        return entry[1] if entry is not None and entry[0] is content else 0
+
+    def stats(self):
+        """Число блобов и ссылок, байты с повторами и без, сэкономленные байты"""
+        references = sum(entry[1] for entry in self._blobs.values())
+        stored = sum(entry[2] for entry in self._blobs.values())
+        logical = sum(entry[1] * entry[2] for entry in self._blobs.values())
+        return {
+            'blobs': len(self._blobs),
+            'references': references,
+            'stored_bytes': stored,
+            'logical_bytes': logical,
+            'bytes_saved': logical - stored,
+            'dedup_ratio': logical / stored if stored else 1.0,
+        }
+
+
+class ChunkWriter:
+    """Собирает ChunkedContent из потока байт, не держа все содержимое одной строкой"""
+
+    def __init__(self, content=None):
+        self.chunks = list(content.chunks) if content is not None else []
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= CHUNK_SIZE:
+            whole = len(self._buffer) // CHUNK_SIZE * CHUNK_SIZE
+            self.chunks.extend(bytes(self._buffer[start:start + CHUNK_SIZE])
+                               for start in range(0, whole, CHUNK_SIZE))
+            del self._buffer[:whole]
+
+    def close(self):
+        if self._buffer:
+            self.chunks.append(bytes(self._buffer))
+            self._buffer = bytearray()
+        return ChunkedContent(self.chunks)
+
+
+def content_size(content):
+    """Размер содержимого файла в байтах, без декодирования base64"""
+    if isinstance(content, str):
+        return len(content) if content.isascii() else len(content.encode('utf-8'))
+    if isinstance(content, bytes):
+        # base64 без пробелов: 3 байта на 4 символа минус дополнение '='
+        return len(content) // 4 * 3 - content[-2:].count(b'=')
+    return len(content)
+
+
+def content_digest(content):
+    """Хэш содержимого для сравнения деревьев: одинаковые байты дают один хэш
+    в любой форме хранения, кроме еще не декодированного base64 - он
+    хэшируется как есть, без декодирования"""
+    if isinstance(content, ChunkedContent):
+        return content.digest()
+    if isinstance(content, str):
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=20).digest()
+    if isinstance(content, bytes):
+        return b'b64' + hashlib.blake2b(content, digest_size=20).digest()
+    return hashlib.blake2b(content, digest_size=20).digest()
+
+
+def split_view(view):
+    """Режет memoryview на куски без копирования"""
+    return [view[start:start + CHUNK_SIZE] for start in range(0, len(view), CHUNK_SIZE)]
+
+
+def decode_chunks(chunks):
+    """Текст кусков; байты не в UTF-8 становятся суррогатами (surrogateescape),
+    и encode('utf-8', 'surrogateescape') возвращает ровно исходные байты"""
+    decoder = codecs.getincrementaldecoder('utf-8')('surrogateescape')
+    return ''.join(decoder.decode(chunk) for chunk in chunks) + decoder.decode(b'', True)
+
+
+def iter_text_lines(chunks):
+    """Строки текста по одной, с декодированием по кускам, как decode_chunks"""
+    decoder = codecs.getincrementaldecoder('utf-8')('surrogateescape')
+    tail = ''
+    for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        yield from lines
+    yield tail + decoder.decode(b'', True)
+
+
+def _searchable(chunk):
+    return chunk if isinstance(chunk, bytes) else bytes(chunk)
+
+
+def _ends_with_newline(pieces):
+    return bool(pieces) and bytes(pieces[-1][-1:]) == b'\n'
+
+
+def head(chunks, count):
+    """Куски первых count строк без перевода строки после последней из них;
+    перевод строки в конце файла завершает последнюю строку, а не начинает
+    новую (как в coreutils). Читаются только куски, в которых эти строки лежат"""
+    pieces = []
+    for chunk in chunks:
+        data = _searchable(chunk)
+        position = -1
+        while count:
+            position = data.find(b'\n', position + 1)
+            if position == -1:
+                break
+            count -= 1
+        if not count:
+            pieces.append(chunk[:position])
+            return pieces
+        pieces.append(chunk)
+    if _ends_with_newline(pieces):
+        pieces[-1] = pieces[-1][:-1]
+    return pieces
+
+
+def tail(chunks, count):
+    """Куски последних count строк без перевода строки в конце, как head;
+    куски читаются с конца и только нужные"""
+    if _ends_with_newline(chunks):
+        chunks = chunks[:-1] + [chunks[-1][:-1]]
+    pieces = []
+    for chunk in reversed(chunks):
+        data = _searchable(chunk)
+        position = len(data)
+        while count:
+            position = data.rfind(b'\n', 0, position)
+            if position == -1:
+                break
+            count -= 1
+        if position != -1 and not count:
+            pieces.append(chunk[position + 1:])
+            break
+        pieces.append(chunk)
+    pieces.reverse()
+    return pieces
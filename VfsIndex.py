@@ -0,0 +1,570 @@
+import fnmatch
+import hashlib
+import re
+from array import array
+from itertools import compress
+from VfsContent import content_digest, content_size
+from VfsListener import MutationListener
+from VfsNode import parse_permissions, walk
+
+
+# Символы, после которых предыдущий литерал регулярного выражения необязателен
+OPTIONAL_SUFFIXES = '*?'
+REGEX_SPECIAL = '.^$*+?{}[]\\|()'
+
+# Код строки таблицы метаданных: 9 бит прав и бит директории; REMOVED - удаленный узел
+DIR_CODE = 0o1000
+REMOVED = 0o2000
+
+
+def is_under(node, start):
+    """Лежит ли node в поддереве start (включая сам start)"""
+    while node is not None:
+        if node is start:
+            return True
+        node = node.parent
+    return False
+
+
+def is_linked_under(node, start):
+    """is_under для узлов из индексов: узел удаленного поддерева сохраняет
+    ссылку parent, пока индексы его не забыли, но родитель его уже не содержит"""
+    while node is not start:
+        parent = node.parent
+        if parent is None or parent.get_child(node.name) is not node:
+            return False
+        node = parent
+    return True
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def required_literals(pattern):
+    """Подстроки, которые обязана содержать любая строка, подходящая под
+    регулярное выражение pattern. Разбор консервативный: при альтернативе и
+    конструкциях '(?' (флаги вроде (?i), просмотр вперед и назад и т.п.)
+    возвращается пустой список - полный перебор, содержимое групп и классов
+    пропускается"""
+    if '|' in pattern or '(?' in pattern:
+        return []
+
+    literals = []
+    current = []
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            # Экранированный символ прерывает литерал: \d, \w и т.п. не буквальны
+            literals.append(''.join(current))
+            current = []
+            i += 2
+            continue
+        if char == '[':
+            # Класс символов пропускается целиком
+            i = _class_end(pattern, i)
+            literals.append(''.join(current))
+            current = []
+            continue
+        if char == '{':
+            # {m,n} делает предыдущий символ необязательным
+            if current:
+                current.pop()
+            end = pattern.find('}', i + 1)
+            i = len(pattern) if end == -1 else end + 1
+            literals.append(''.join(current))
+            current = []
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char in REGEX_SPECIAL or depth:
+            if char in OPTIONAL_SUFFIXES and current:
+                current.pop()
+            literals.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    literals.append(''.join(current))
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+def _class_end(pattern, start):
+    """Позиция за ']', закрывающей класс символов, открытый в start: '^' в
+    начале класса и ']' сразу за ним - члены класса, как и экранированные символы"""
+    i = start + 1
+    if i < len(pattern) and pattern[i] == '^':
+        i += 1
+    if i < len(pattern) and pattern[i] == ']':
+        i += 1
+    while i < len(pattern):
+        if pattern[i] == '\\':
+            i += 2
+        elif pattern[i] == ']':
+            return i + 1
+        else:
+            i += 1
+    return len(pattern)
+
+
+class NameIndex(MutationListener):
+    """Глобальный индекс имя -> узлы для find -name"""
+
+    def __init__(self, root):
+        self.nodes = {}
+        for node in walk(root):
+            if node.parent is not None:
+                self._add(node)
+
+    def _add(self, node):
+        nodes = self.nodes.get(node.name)
+        if nodes is None:
+            nodes = self.nodes[node.name] = set()
+        nodes.add(node)
+
+    def on_attach(self, parent, node):
+        for child in walk(node):
+            self._add(child)
+
+    def on_release(self, node):
+        nodes = self.nodes.get(node.name)
+        if nodes is not None:
+            nodes.discard(node)
+            if not nodes:
+                del self.nodes[node.name]
+
+    def on_move(self, node, old_parent, old_name):
+        # Имена потомков не меняются, перекладывается только сам узел
+        if old_name != node.name:
+            nodes = self.nodes.get(old_name)
+            if nodes is not None:
+                nodes.discard(node)
+                if not nodes:
+                    del self.nodes[old_name]
+            self._add(node)
+
+    def match(self, pattern):
+        """Узлы, чье имя подходит под glob-шаблон"""
+        if not any(char in pattern for char in '*?['):
+            return set(self.nodes.get(pattern, ()))
+        found = set()
+        for name in fnmatch.filter(self.nodes, pattern):
+            found.update(self.nodes[name])
+        return found
+
+
+class TrigramIndex(MutationListener):
+    """Индекс триграмм по декодированному содержимому файлов для grep
+
+    Файлы, добавленные после построения, копятся в pending и
+    индексируются при следующем запросе. Индекс только отбирает
+    кандидатов: совпадение все равно проверяется по тексту.
+    """
+
+    def __init__(self, vfs):
+        self.vfs = vfs
+        self.trigrams = {}
+        self.files = set()
+        self.pending = {node for node in walk(vfs.root) if not node.is_dir}
+
+    def _index(self, node):
+        for trigram in trigrams(self.vfs.read_content(node)):
+            files = self.trigrams.get(trigram)
+            if files is None:
+                files = self.trigrams[trigram] = set()
+            files.add(node)
+        self.files.add(node)
+
+    def _unindex(self, node, text=None):
+        for trigram in trigrams(self.vfs.read_content(node) if text is None else text):
+            files = self.trigrams.get(trigram)
+            if files is not None:
+                files.discard(node)
+                if not files:
+                    del self.trigrams[trigram]
+        self.files.discard(node)
+
+    def on_attach(self, parent, node):
+        self.pending.update(child for child in walk(node) if not child.is_dir)
+
+    def on_release(self, node):
+        if node in self.pending:
+            self.pending.discard(node)
+        elif node in self.files:
+            self._unindex(node)
+
+    def on_write(self, node, old_content):
+        if node in self.files:
+            self._unindex(node, self.vfs.content_text(old_content))
+        self.pending.add(node)
+
+    def candidates(self, pattern):
+        """Файлы, которые могут содержать совпадение с регулярным выражением"""
+        while self.pending:
+            self._index(self.pending.pop())
+
+        required = set()
+        for literal in required_literals(pattern):
+            required |= trigrams(literal)
+        if not required:
+            return set(self.files)
+
+        # Пересечение начинается с самого редкого триграмма
+        postings = sorted((self.trigrams.get(trigram, ()) for trigram in required), key=len)
+        found = set(postings[0])
+        for files in postings[1:]:
+            if not found:
+                break
+            found &= files
+        return found
+
+
+class SizeIndex(MutationListener):
+    """Суммарный размер файлов, число файлов и поддиректорий для каждой директории
+
+    Строится одним обходом при первом du/tree; дальше каждое изменение
+    поднимается от родителя к корню по ссылкам parent, то есть стоит O(глубины).
+    """
+
+    def __init__(self, root):
+        # директория -> [байт, файлов, директорий] во всем поддереве (без нее самой)
+        self.totals = {}
+        self._add_subtree(root)
+
+    def _add_subtree(self, node):
+        """Считает итоги директорий поддерева node снизу вверх"""
+        if not node.is_dir:
+            return
+        for directory in reversed([child for child in walk(node) if child.is_dir]):
+            size = files = dirs = 0
+            for child in directory.children.values():
+                if child.is_dir:
+                    totals = self.totals[child]
+                    size += totals[0]
+                    files += totals[1]
+                    dirs += totals[2] + 1
+                else:
+                    size += content_size(child.content)
+                    files += 1
+            self.totals[directory] = [size, files, dirs]
+
+    def get(self, node):
+        """(байт, файлов, директорий) в поддереве node; для файла - его размер"""
+        if not node.is_dir:
+            return content_size(node.content), 0, 0
+        return tuple(self.totals[node])
+
+    def _propagate(self, directory, size, files, dirs):
+        while directory is not None:
+            totals = self.totals.get(directory)
+            if totals is None:
+                return
+            totals[0] += size
+            totals[1] += files
+            totals[2] += dirs
+            directory = directory.parent
+
+    def _subtree(self, node):
+        """Вклад поддерева node в итоги его предков"""
+        size, files, dirs = self.get(node)
+        if node.is_dir:
+            return size, files, dirs + 1
+        return size, 1, 0
+
+    def on_attach(self, parent, node):
+        self._add_subtree(node)
+        self._propagate(parent, *self._subtree(node))
+
+    def on_detach(self, parent, node):
+        size, files, dirs = self._subtree(node)
+        self._propagate(parent, -size, -files, -dirs)
+
+    def on_release(self, node):
+        self.totals.pop(node, None)
+
+    def on_move(self, node, old_parent, old_name):
+        size, files, dirs = self._subtree(node)
+        self._propagate(old_parent, -size, -files, -dirs)
+        self._propagate(node.parent, size, files, dirs)
+
+    def on_write(self, node, old_content):
+        self._propagate(node.parent, content_size(node.content) - content_size(old_content), 0, 0)
+
+
+def file_digest(node):
+    """Хэш файла: права и содержимое"""
+    return hashlib.blake2b(b'f%03o' % node.permissions + content_digest(node.content), digest_size=20).digest()
+
+
+def directory_digest(directory, child_digest):
+    """Хэш Меркла директории: права и пары (имя, хэш) детей в порядке имен;
+    child_digest дает хэш поддиректории"""
+    h = hashlib.blake2b(b'd%03o' % directory.permissions, digest_size=20)
+    children = directory.children
+    for name in sorted(children):
+        child = children[name]
+        h.update(name.encode('utf-8') + b'/')
+        h.update(child_digest(child) if child.is_dir else file_digest(child))
+    return h.digest()
+
+
+def tree_digests(root):
+    """Хэши всех директорий дерева, снизу вверх за один обход"""
+    digests = {}
+    for directory in reversed([node for node in walk(root) if node.is_dir]):
+        digests[directory] = directory_digest(directory, digests.__getitem__)
+    return digests
+
+
+class DigestIndex(MutationListener):
+    """Хэши Меркла директорий живого дерева для reload
+
+    Хэш считается при первом запросе и запоминается вместе с хэшами всех
+    поддиректорий. Изменение сбрасывает хэши от родителя к корню, то есть
+    O(глубины); при следующем запросе пересчитываются только сброшенные
+    директории, поэтому сравнение с новым образом не обходит неизмененные
+    поддеревья.
+    """
+
+    def __init__(self):
+        self.digests = {}
+
+    def digest(self, node):
+        digest = self.digests.get(node)
+        if digest is not None:
+            return digest
+        # У директории с хэшем хэши есть и у всех ее поддиректорий: туда не заходим
+        pending = []
+        stack = [node]
+        while stack:
+            directory = stack.pop()
+            pending.append(directory)
+            stack.extend(child for child in directory.children.values()
+                         if child.is_dir and child not in self.digests)
+        for directory in reversed(pending):
+            self.digests[directory] = directory_digest(directory, self.digests.__getitem__)
+        return self.digests[node]
+
+    def _invalidate(self, directory):
+        while directory is not None and self.digests.pop(directory, None) is not None:
+            directory = directory.parent
+
+    def on_attach(self, parent, node):
+        self._invalidate(parent)
+
+    def on_detach(self, parent, node):
+        self._invalidate(parent)
+
+    def on_release(self, node):
+        self.digests.pop(node, None)
+
+    def on_move(self, node, old_parent, old_name):
+        self._invalidate(old_parent)
+        self._invalidate(node.parent)
+
+    def on_chmod(self, node, old_permissions):
+        self._invalidate(node if node.is_dir else node.parent)
+
+    def on_chmod_tree(self, node, nodes, old_permissions):
+        self._invalidate(node if node.is_dir else node.parent)
+        for child in nodes:
+            self.digests.pop(child, None)
+
+    def on_write(self, node, old_content):
+        self._invalidate(node.parent)
+
+
+def permission_test(spec):
+    """Проверка прав в стиле find -perm: '644' - ровно такие права, '-022' - есть
+    все эти биты, '/111' - есть хотя бы один. None, если формат неверный"""
+    prefix = spec[:1] if spec[:1] in ('-', '/') else ''
+    bits = parse_permissions(spec[len(prefix):])
+    if bits is None:
+        return None
+    if prefix == '-':
+        return lambda permissions: permissions & bits == bits
+    if prefix == '/':
+        return lambda permissions: permissions & bits != 0
+    return lambda permissions: permissions == bits
+
+
+def match_table(kind=None, perm=None):
+    """Байт на каждый код строки MetaTable: 1, если узел с таким кодом подходит
+    под тип ('f' или 'd') и проверку прав perm (строка как у find -perm)"""
+    test = permission_test(perm) if perm is not None else None
+    return bytes(code != REMOVED
+                 and (kind is None or (kind == 'd') == bool(code & DIR_CODE))
+                 and (test is None or test(code & 0o777))
+                 for code in range(REMOVED + 1))
+
+
+LIVE = match_table()
+
+
+def mode_code(node):
+    return node.permissions | (DIR_CODE if node.is_dir else 0)
+
+
+class MetaTable(MutationListener):
+    """Метаданные узлов в параллельных массивах, строки в порядке обхода в глубину
+
+    На узел - код (права и бит директории), глубина и конец поддерева, так что
+    поддерево - непрерывный диапазон строк. Строится первым find -type/-perm;
+    find и chmod -R проходят диапазон срезами array и встроенными map/compress, без обхода
+    узлов. chmod и удаление обновляют строки на месте (удаленные помечаются
+    REMOVED); добавление и перенос нарушают порядок строк. Пока таблица
+    устарела, запросы обходят свое поддерево напрямую, а перестраивается она,
+    когда такие обходы наберут столько узлов, сколько в ней строк: после mkdir
+    chmod -R маленького поддерева не платит за перестройку всего дерева.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._build()
+
+    def _build(self):
+        nodes = []
+        codes = array('H')
+        depths = array('I')
+        ends = array('I')
+        # (узел, глубина); (None, строка) закрывает поддерево директории
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if node is None:
+                ends[depth] = len(nodes)
+                continue
+            row = len(nodes)
+            nodes.append(node)
+            codes.append(mode_code(node))
+            depths.append(depth)
+            ends.append(row + 1)
+            if node.is_dir:
+                stack.append((None, row))
+                stack.extend((child, depth + 1) for child in node.children.values())
+
+        self.nodes = nodes
+        self.codes = codes
+        self.depths = depths
+        self.ends = ends
+        self.rows = dict(zip(nodes, range(len(nodes))))
+        self.removed = 0
+        self.stale = False
+        # Узлов пройдено обходом в обход устаревшей таблицы
+        self.walked = 0
+
+    def _range(self, node):
+        """Диапазон строк поддерева node или None, если таблица устарела и еще
+        не окупила перестройку - тогда поддерево обходится напрямую"""
+        if self.stale and self.walked >= len(self.nodes):
+            self._build()
+        if self.stale:
+            return None
+        row = self.rows[node]
+        return row, self.ends[row]
+
+    def subtree(self, node):
+        """Узлы поддерева node (включая его) в порядке строк или обхода"""
+        rows = self._range(node)
+        if rows is None:
+            nodes = list(walk(node))
+            self.walked += len(nodes)
+            return nodes
+        row, end = rows
+        return list(compress(self.nodes[row:end], map(LIVE.__getitem__, self.codes[row:end])))
+
+    def select(self, start, kind=None, perm=None, maxdepth=None):
+        """Узлы поддерева start с типом kind ('f' или 'd'), правами под perm
+        (как у find -perm) и не глубже maxdepth уровней от start"""
+        match = match_table(kind, perm)
+        rows = self._range(start)
+        if rows is None:
+            return self._walk_select(start, match, maxdepth)
+        row, end = rows
+        rows = compress(range(row, end), map(match.__getitem__, self.codes[row:end]))
+        if maxdepth is not None:
+            limit = self.depths[row] + maxdepth
+            depths = self.depths
+            rows = (index for index in rows if depths[index] <= limit)
+        nodes = self.nodes
+        return [nodes[index] for index in rows]
+
+    def _walk_select(self, start, match, maxdepth):
+        found = []
+        stack = [(start, 0)]
+        while stack:
+            node, depth = stack.pop()
+            self.walked += 1
+            if match[mode_code(node)]:
+                found.append(node)
+            if node.is_dir and (maxdepth is None or depth < maxdepth):
+                stack.extend((child, depth + 1) for child in node.children.values())
+        return found
+
+    def on_attach(self, parent, node):
+        self.stale = True
+
+    def on_move(self, node, old_parent, old_name):
+        self.stale = True
+
+    def on_detach(self, parent, node):
+        row = self.rows.get(node)
+        if self.stale or row is None:
+            return
+        end = self.ends[row]
+        self.codes[row:end] = array('H', [REMOVED]) * (end - row)
+        self.removed += end - row
+        # Удаленные узлы держатся таблицей до перестройки
+        if self.removed * 2 > len(self.nodes):
+            self.stale = True
+
+    def on_chmod(self, node, old_permissions):
+        row = self.rows.get(node)
+        if not self.stale and row is not None and self.codes[row] != REMOVED:
+            self.codes[row] = mode_code(node)
+
+    def on_chmod_tree(self, node, nodes, old_permissions):
+        row = self.rows.get(node)
+        if self.stale or row is None:
+            return
+        permissions = node.permissions
+        recode = [code if code == REMOVED else (code & DIR_CODE) | permissions
+                  for code in range(REMOVED + 1)]
+        end = self.ends[row]
+        self.codes[row:end] = array('H', map(recode.__getitem__, self.codes[row:end]))
+
+
+def find(vfs, start, pattern=None, kind=None, perm=None, maxdepth=None):
+    """(путь, узел) для узлов поддерева start, чье имя подходит под шаблон, по порядку путей.
+    Отбор по типу, правам и глубине идет по таблице метаданных"""
+    if kind is not None or perm is not None or maxdepth is not None:
+        nodes = vfs.get_meta_table().select(start, kind, perm, maxdepth)
+        if pattern is not None:
+            matched = vfs.get_name_index().match(pattern)
+            nodes = [node for node in nodes if node in matched]
+    elif pattern is None:
+        nodes = walk(start)
+    else:
+        nodes = (node for node in vfs.get_name_index().match(pattern) if is_linked_under(node, start))
+    return sorted((vfs.get_path(node), node) for node in nodes)
+
+
+def grep(vfs, start, pattern):
+    """(путь, строка) для строк файлов поддерева start, подходящих под выражение"""
+    regex = re.compile(pattern, re.MULTILINE)
+    if start.is_dir:
+        files = [node for node in vfs.get_content_index().candidates(pattern) if is_linked_under(node, start)]
+    else:
+        files = [start]
+
+    matches = []
+    for path, node in sorted((vfs.get_path(node), node) for node in files):
+        text = vfs.read_content(node)
+        if regex.search(text) is None:
+            continue
+        matches.extend((path, line) for line in text.split('\n') if regex.search(line))
+    return matches
@@ -0,0 +1,200 @@
+import base64
+import json
+import os
+import time
+from VfsListener import MutationListener
+from VfsContent import content_size
+from VfsNode import DIR_PERMISSIONS, FILE_PERMISSIONS, format_permissions, walk
+
+
+BATCH_SIZE = 64
+BATCH_INTERVAL = 0.05
+
+
+def journal_path(vfs_path):
+    """Путь к журналу рядом с образом VFS"""
+    return vfs_path + '.journal'
+
+
+def aside_path(vfs_path):
+    """Журнал, отложенный на время compact"""
+    return journal_path(vfs_path) + '.old'
+
+
+def set_aside(vfs_path, stamp):
+    """Откладывает журнал перед заменой образа в compact: дописывает отметку
+    stamp образа, поверх которого журнал проигрывается, и переименовывает"""
+    path = journal_path(vfs_path)
+    if not os.path.exists(path):
+        return
+    with open(path, 'ab') as f:
+        f.write(json.dumps({'op': 'compact', 'image': list(stamp)}).encode('utf-8') + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path, aside_path(vfs_path))
+
+
+def recover(vfs_path, stamp):
+    """Разбирает журнал, отложенный compact до сбоя. Если образ еще прежний
+    (отметка совпадает с stamp), журнал возвращается на место, иначе его
+    изменения уже в новом образе и он удаляется"""
+    aside = aside_path(vfs_path)
+    if not os.path.exists(aside):
+        return
+    records = list(VfsJournal.read(aside))
+    if stamp is not None and records and records[-1] == {'op': 'compact', 'image': list(stamp)}:
+        with open(aside, 'rb') as f:
+            data = f.read()
+        # Без отметки; записи журнала, начатого после сбоя, идут следом
+        data = data[:data.rstrip(b'\n').rfind(b'\n') + 1]
+        path = journal_path(vfs_path)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data += f.read()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+    os.remove(aside)
+
+
+class VfsJournal(MutationListener):
+    """Журнал изменений VFS, который только дописывается в конец
+
+    Каждое изменение - одна строка JSON с абсолютным путем. Записи копятся
+    в буфере и сбрасываются на диск с fsync пачками: по BATCH_SIZE записей
+    или раз в BATCH_INTERVAL секунд, а также в sync()/close(). Срок пачки
+    проверяется при новой записи и в poll() - на границах команд, после
+    которых записей может долго не быть. Стоимость записи не зависит от
+    размера образа.
+    """
+
+    def __init__(self, vfs, path, batch_size=BATCH_SIZE, batch_interval=BATCH_INTERVAL):
+        self.vfs = vfs
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._file = open(path, 'ab')
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    @staticmethod
+    def read(path):
+        """Читает записи журнала; оборванная последняя строка (сбой при записи) пропускается"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            lines = f.read().split(b'\n')
+        for number, line in enumerate(lines, 1):
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                if number == len(lines):
+                    return
+                raise ValueError(f"поврежденная запись журнала в строке {number}")
+
+    def on_attach(self, parent, node):
+        # Поддерево (копия, слияние сеанса) пишется целиком: повтор не зависит от других узлов
+        for child in walk(node):
+            path = self.vfs.get_path(child)
+            if child.is_dir:
+                self._append({'op': 'mkdir', 'path': path})
+            elif content_size(child.content):
+                self._append(self._write_record(child, path))
+            else:
+                self._append({'op': 'touch', 'path': path})
+            if child.permissions != (DIR_PERMISSIONS if child.is_dir else FILE_PERMISSIONS):
+                self.on_chmod(child, None)
+
+    def on_detach(self, parent, node):
+        self._remove(parent, node.name)
+
+    def on_move(self, node, old_parent, old_name):
+        if node.is_dir:
+            # Директория переносится только на свободное имя: повтор применяет
+            # запись, лишь если источник есть, а цели нет
+            self._append({'op': 'move', 'path': self._child_path(old_parent, old_name),
+                          'to': self.vfs.get_path(node)})
+            return
+        # Файл мог заменить файл на новом месте, и удаление того уже в журнале:
+        # при повторе оно удалило бы перенесенный файл, поэтому файл пишется
+        # как удаление и содержимое на новом месте
+        self._remove(old_parent, old_name)
+        self._remove(node.parent, node.name)
+        self.on_attach(node.parent, node)
+
+    def _remove(self, parent, name):
+        self._append({'op': 'remove', 'path': self._child_path(parent, name)})
+
+    def _child_path(self, parent, name):
+        return self.vfs.get_path(parent).rstrip('/') + '/' + name
+
+    def on_chmod(self, node, old_permissions):
+        self._append({'op': 'chmod', 'path': self.vfs.get_path(node), 'mode': format_permissions(node)})
+
+    def on_chmod_tree(self, node, nodes, old_permissions):
+        self._append({'op': 'chmod', 'path': self.vfs.get_path(node), 'mode': format_permissions(node),
+                      'recursive': True})
+
+    def on_write(self, node, old_content):
+        # Пишется все новое содержимое, чтобы повторное применение записи ничего не меняло
+        self._append(self._write_record(node, self.vfs.get_path(node)))
+
+    def on_append(self, node, old_content, chunks):
+        # Только дописанные байты; offset - размер файла до них: повтор применяет
+        # запись, лишь если файл ровно такого размера
+        data = b''.join(chunks)
+        record = {'op': 'append', 'path': self.vfs.get_path(node), 'offset': len(node.content) - len(data)}
+        self._append(self._set_data(record, data))
+
+    def _write_record(self, node, path):
+        return self._set_data({'op': 'write', 'path': path}, b''.join(self.vfs.read_chunks(node)))
+
+    @staticmethod
+    def _set_data(record, data):
+        try:
+            record['content'] = data.decode('utf-8')
+        except UnicodeDecodeError:
+            record['content_b64'] = base64.b64encode(data).decode('ascii')
+        return record
+
+    @staticmethod
+    def record_data(record):
+        """Байты записи write или append"""
+        if 'content_b64' in record:
+            return base64.b64decode(record['content_b64'])
+        return record['content'].encode('utf-8')
+
+    def _append(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.sync()
+        else:
+            self.poll()
+
+    def poll(self):
+        """Сбрасывает записи, если с прошлого сброса прошло batch_interval"""
+        if self._pending and time.monotonic() - self._last_sync >= self.batch_interval:
+            self.sync()
+
+    def sync(self):
+        """Сбрасывает накопленные записи на диск"""
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def reopen(self):
+        """Начинает новый файл журнала после того, как прежний отложен compact"""
+        self._file.close()
+        self._file = open(self.path, 'ab')
+        self._pending = 0
+
+    def close(self):
+        self.sync()
+        self._file.close()
@@ -0,0 +1,33 @@
+class MutationListener:
+    """Наблюдатель за изменениями VFS. Методы вызываются после изменения дерева"""
+
+    def on_attach(self, parent, node):
+        """Узел node добавлен в директорию parent"""
+
+    def on_detach(self, parent, node):
+        """Узел node (вместе с поддеревом) убран из директории parent"""
+
+    def on_release(self, node):
+        """Узел удаленного поддерева отпускается: после on_detach его поддерево
+        обходится порциями при следующих изменениях, и здесь наблюдатель
+        забывает каждый узел, а не обходит поддерево в on_detach"""
+
+    def on_move(self, node, old_parent, old_name):
+        """Узел node (вместе с поддеревом) перенесен из old_parent, где назывался old_name"""
+
+    def on_chmod(self, node, old_permissions):
+        """У узла изменились права доступа"""
+
+    def on_chmod_tree(self, node, nodes, old_permissions):
+        """Всем узлам поддерева node (nodes) заданы права node; old_permissions -
+        их прежние права в том же порядке. По умолчанию - on_chmod на каждый узел"""
+        for child, old in zip(nodes, old_permissions):
+            self.on_chmod(child, old)
+
+    def on_write(self, node, old_content):
+        """Содержимое файла заменено; old_content - прежнее содержимое (объект
+        из node.content, текст из него дает vfs.content_text)"""
+
+    def on_append(self, node, old_content, chunks):
+        """В конец файла дописаны куски байт chunks (>>). По умолчанию - on_write"""
+        self.on_write(node, old_content)
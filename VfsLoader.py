@@ -0,0 +1,282 @@
+import base64
+import re
+import sys
+from json import JSONDecodeError, JSONDecoder, dumps
+from json.decoder import scanstring
+from VfsContent import ChunkedContent
+from VfsNode import (DirectoryNode, FileNode, DIR_PERMISSIONS, FILE_PERMISSIONS,
+                     format_permissions, parse_permissions)
+
+
+CHUNK_SIZE = 1024 * 1024
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Элемент content, чей объект не содержит вложенных объектов (обычно файл):
+# такой узел целиком отдается C-декодеру json. Повторения записаны без
+# притяжательных квантификаторов (их нет до Python 3.11) и однозначно:
+# "символы (экранирование символы)*", так что откат при несовпадении линейный
+FLAT_CHILD = re.compile(r'[ \t\n\r]*(,?)[ \t\n\r]*("[^"\\]*(?:\\.[^"\\]*)*")[ \t\n\r]*:[ \t\n\r]*'
+                        r'(\{[^"{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}]*)*\})', re.S)
+
+
+class _NodeFrame:
+    """Разбираемый объект узла с вложенным content: поля копятся до '}'"""
+    __slots__ = ('name', 'parent', 'node', 'type', 'permissions', 'content', 'content_b64', 'shard',
+                 'first')
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.node = None
+        self.type = None
+        self.permissions = None
+        self.content = None
+        self.content_b64 = None
+        self.shard = None
+        self.first = True
+
+
+class _ChildrenFrame:
+    """Разбираемый словарь content директории"""
+    __slots__ = ('node', 'first')
+
+    def __init__(self, node):
+        self.node = node
+        self.first = True
+
+
+class VfsLoader:
+    """Потоковый загрузчик vfs_structure.json
+
+    Читает файл кусками и строит дерево за один нерекурсивный проход:
+    родители и права по умолчанию проставляются сразу при создании узла.
+    Промежуточные словари json не создаются, поэтому пиковая память
+    близка к размеру итогового дерева, а глубина не ограничена стеком Python.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE, blobs=None, shards=None):
+        self._file = f
+        self._blobs = blobs
+        # ShardStore, если файл - шард шардированного образа
+        self._shards = shards
+        self._chunk_size = chunk_size
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = JSONDecoder()
+
+    def load(self):
+        """Разбирает файл и возвращает корневой узел"""
+        self._expect('{')
+        stack = [_NodeFrame('', None)]
+        root = None
+
+        while stack:
+            frame = stack[-1]
+
+            if type(frame) is _ChildrenFrame:
+                if self._flat_child(frame):
+                    continue
+                if self._peek() == '}':
+                    self._pos += 1
+                    stack.pop()
+                    continue
+                if not frame.first:
+                    self._expect(',')
+                frame.first = False
+                name = sys.intern(self._string())
+                self._expect(':')
+                self._expect('{')
+                stack.append(_NodeFrame(name, frame.node))
+                continue
+
+            if self._peek() == '}':
+                self._pos += 1
+                stack.pop()
+                node = self._make_node(frame.name, frame.parent, frame.type, frame.permissions,
+                                       frame.content, frame.content_b64, frame.node, frame.shard)
+                if frame.parent is None:
+                    root = node
+                else:
+                    frame.parent.children[node.name] = node
+                continue
+
+            if not frame.first:
+                self._expect(',')
+            frame.first = False
+            key = self._string()
+            self._expect(':')
+
+            if key == 'type':
+                frame.type = self._string()
+            elif key == 'permissions':
+                frame.permissions = self._value()
+            elif key == 'content_b64':
+                frame.content_b64 = self._string()
+            elif key == 'shard':
+                frame.shard = self._value()
+            elif key == 'content' and self._peek() == '{':
+                # Содержимое-объект: это директория, ее дети разбираются следующими
+                self._pos += 1
+                frame.node = DirectoryNode(frame.name, frame.parent)
+                stack.append(_ChildrenFrame(frame.node))
+            elif key == 'content':
+                frame.content = self._value()
+            else:
+                self._value()
+
+        if self._peek() != '':
+            raise ValueError(f"лишние данные после корневого объекта (позиция {self._pos})")
+        if not root.is_dir:
+            raise ValueError("корень VFS должен быть директорией")
+        return root
+
+    def _flat_child(self, frame):
+        """Быстрый путь: узел без вложенных объектов разбирается одним регулярным
+        выражением и одним вызовом декодера. False если путь неприменим"""
+        if len(self._buf) - self._pos < self._chunk_size // 2:
+            self._fill()
+
+        match = FLAT_CHILD.match(self._buf, self._pos)
+        if match is None or bool(match.group(1)) == frame.first:
+            return False
+        frame.first = False
+
+        name = match.group(2)
+        name = sys.intern(name[1:-1] if '\\' not in name else scanstring(name, 1)[0])
+        data, self._pos = self._decoder.raw_decode(self._buf, match.start(3))
+
+        frame.node.children[name] = self._make_node(
+            name, frame.node, data.get('type'), data.get('permissions'),
+            data.get('content'), data.get('content_b64'), shard=data.get('shard'))
+        return True
+
+    def _make_node(self, name, parent, node_type, permissions, content, content_b64, node=None,
+                   shard=None):
+        """Создает узел по разобранным полям и ставит права по умолчанию"""
+        if permissions is not None:
+            permissions = parse_permissions(permissions)
+
+        if node_type is None:
+            raise ValueError(f"у узла '{name}' нет поля 'type'")
+
+        if node_type == 'directory' and shard is not None:
+            if self._shards is None or node is not None:
+                raise ValueError(f"у директории '{name}' поле 'shard' вне шардированного образа")
+            return self._shards.stub(name, parent, DIR_PERMISSIONS if permissions is None else permissions,
+                                     shard)
+
+        if node_type == 'directory':
+            node = node or DirectoryNode(name, parent)
+            node.permissions = DIR_PERMISSIONS if permissions is None else permissions
+            return node
+
+        if node is not None:
+            raise ValueError(f"у файла '{name}' содержимое задано объектом")
+        if content_b64 is not None:
+            content = content_b64.encode('ascii', 'replace')
+        content = content or ''
+        if self._blobs is not None:
+            content = self._blobs.intern(content)
+        return FileNode(name, parent, FILE_PERMISSIONS if permissions is None else permissions,
+                        content)
+
+    def _fill(self, size=None):
+        """Дочитывает следующий кусок файла, сдвигая буфер; False на конце файла"""
+        if self._eof:
+            return False
+        data = self._file.read(size or self._chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Пропускает пробелы и возвращает следующий символ ('' в конце файла)"""
+        while True:
+            self._pos = WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"ожидался '{char}', найдено '{found}' (позиция {self._pos})")
+        self._pos += 1
+
+    def _string(self):
+        """Читает строку json; длинные строки дочитываются с удвоением куска"""
+        self._expect('"')
+        while True:
+            try:
+                value, end = scanstring(self._buf, self._pos)
+                self._pos = end
+                return value
+            except JSONDecodeError:
+                if not self._fill(max(self._chunk_size, len(self._buf))):
+                    raise
+
+    def _value(self):
+        """Читает произвольное значение json целиком"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # Число могло оборваться на границе куска
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill(max(self._chunk_size, len(self._buf)))
+
+
+def dump_json(root, f, stubs=None):
+    """Записывает дерево в формате vfs_structure.json без рекурсии.
+    Директории из stubs (узел -> номер шарда) пишутся заглушками {"shard": N}"""
+    f.write('{"type": "directory", "permissions": "%s", "content": {' % format_permissions(root))
+    stack = [iter(root.children.values())]
+    first = True
+
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            f.write('}}')
+            first = False
+            continue
+
+        if not first:
+            f.write(', ')
+        f.write('%s: {"type": "%s", "permissions": "%s", ' % (
+            dumps(node.name, ensure_ascii=False), 'directory' if node.is_dir else 'file',
+            format_permissions(node)))
+
+        if stubs and node in stubs:
+            f.write('"shard": %d}' % stubs[node])
+            first = False
+            continue
+
+        if node.is_dir:
+            f.write('"content": {')
+            stack.append(iter(node.children.values()))
+            first = True
+            continue
+
+        content = node.content
+        if isinstance(content, ChunkedContent):
+            content = memoryview(content.tobytes())
+        if isinstance(content, memoryview):
+            try:
+                content = str(content, 'utf-8')
+            except UnicodeDecodeError:
+                content = base64.b64encode(content)
+        if isinstance(content, bytes):
+            f.write('"content_b64": %s}' % dumps(content.decode('ascii')))
+        else:
+            f.write('"content": %s}' % dumps(content, ensure_ascii=False))
+        first = False
@@ -0,0 +1,141 @@
+import stat
+from bisect import bisect_left, insort
+
+
+DIR_PERMISSIONS = 0o755
+FILE_PERMISSIONS = 0o644
+
+
+class Node:
+    """Базовый узел VFS: тип и права хранятся в одном целом mode"""
+    __slots__ = ('name', 'parent', 'mode')
+
+    def __init__(self, name, parent, mode):
+        self.name = name
+        self.parent = parent
+        self.mode = mode
+
+    @property
+    def is_dir(self):
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def permissions(self):
+        """Права доступа в виде числа (например 0o755)"""
+        return stat.S_IMODE(self.mode)
+
+    @permissions.setter
+    def permissions(self, value):
+        self.mode = stat.S_IFMT(self.mode) | value
+
+
+class FileNode(Node):
+    """Файл VFS. content - str с текстом или bytes с еще не декодированным base64"""
+    __slots__ = ('content',)
+
+    def __init__(self, name, parent=None, permissions=FILE_PERMISSIONS, content=''):
+        self.name = name
+        self.parent = parent
+        self.mode = stat.S_IFREG | permissions
+        self.content = content
+
+
+class DirectoryNode(Node):
+    """Директория VFS
+
+    Отсортированный список имен детей строится при первом sorted_names()
+    и дальше поддерживается в add_child/remove_child, поэтому повторные
+    ls не сортируют директорию заново.
+    """
+    __slots__ = ('children', '_sorted')
+
+    def __init__(self, name, parent=None, permissions=DIR_PERMISSIONS):
+        self.name = name
+        self.parent = parent
+        self.mode = stat.S_IFDIR | permissions
+        self.children = {}
+        self._sorted = None
+
+    def get_child(self, name):
+        return self.children.get(name)
+
+    def add_child(self, node):
+        if self._sorted is not None and node.name not in self.children:
+            insort(self._sorted, node.name)
+        self.children[node.name] = node
+        node.parent = self
+
+    def remove_child(self, name):
+        node = self.children.pop(name, None)
+        if node is not None and self._sorted is not None:
+            del self._sorted[bisect_left(self._sorted, name)]
+        return node
+
+    def child_names(self):
+        return self.children.keys()
+
+    def sorted_names(self, start=0, stop=None):
+        """Имена детей по возрастанию с позиции start до stop, без копирования списка"""
+        if self._sorted is None:
+            self._sorted = sorted(self.children)
+        names = self._sorted
+        stop = len(names) if stop is None else min(stop, len(names))
+        for index in range(start, stop):
+            yield names[index]
+
+    def names_with_prefix(self, prefix):
+        """Имена детей, начинающиеся с prefix, по возрастанию. Начало ищется
+        делением пополам в отсортированном списке, поэтому время не зависит
+        от размера директории, только от числа выданных имен"""
+        if self._sorted is None:
+            self._sorted = sorted(self.children)
+        names = self._sorted
+        for index in range(bisect_left(names, prefix), len(names)):
+            name = names[index]
+            if not name.startswith(prefix):
+                return
+            yield name
+
+
+def walk(node, loaded_only=False):
+    """Узел и все его потомки, обход без рекурсии. С loaded_only в еще не
+    прочитанные директории шардированного образа обход не заходит"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.is_dir and not (loaded_only and not getattr(node, 'loaded', True)):
+            stack.extend(node.children.values())
+
+
+def copy_tree(node):
+    """Копия поддерева из новых узлов без рекурсии. Содержимое файлов не
+    копируется: объекты содержимого неизменяемы, запись в любую из копий
+    заменяет объект только у нее"""
+    def clone(source, parent):
+        if source.is_dir:
+            return DirectoryNode(source.name, parent, source.permissions)
+        return FileNode(source.name, parent, source.permissions, source.content)
+
+    root = clone(node, None)
+    stack = [(node, root)] if node.is_dir else []
+    while stack:
+        source, target = stack.pop()
+        for child in source.children.values():
+            copy = target.children[child.name] = clone(child, target)
+            if child.is_dir:
+                stack.append((child, copy))
+    return root
+
+
+def format_permissions(node):
+    """Права доступа узла в виде строки из трех восьмеричных цифр"""
+    return '%03o' % node.permissions
+
+
+def parse_permissions(mode):
+    """Переводит права ('755') в число, None если формат некорректен"""
+    mode = str(mode)
+    if len(mode) != 3 or any(char not in '01234567' for char in mode):
+        return None
+    return int(mode, 8)
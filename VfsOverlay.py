@@ -0,0 +1,227 @@
+import heapq
+import sys
+import weakref
+from collections.abc import Mapping
+from itertools import islice
+from VfsContent import BlobStore
+from VfsNode import DirectoryNode, FileNode, copy_tree
+from VirtualFileSystem import PathCache, VirtualFileSystem
+
+
+def _pin(node):
+    """Закрепляет измененную обертку и всех ее предков в слое сеанса"""
+    while node.parent is not None and node.parent.added.get(node.name) is not node:
+        node.parent.added[node.name] = node
+        node = node.parent
+
+
+class OverlayFileNode(FileNode):
+    """Файл базового слоя, видимый из сеанса. Базовый узел не меняется:
+    при первой записи копия закрепляется в слое сеанса"""
+    __slots__ = ('base', '__weakref__')
+
+    def __init__(self, base, parent):
+        self.name = base.name
+        self.parent = parent
+        self.mode = base.mode
+        self.content = base.content
+        self.base = base
+
+    @property
+    def permissions(self):
+        return self.mode & 0o777
+
+    @permissions.setter
+    def permissions(self, value):
+        self.mode = (self.mode & ~0o777) | value
+        _pin(self)
+
+
+class _MergedChildren(Mapping):
+    """Содержимое директории слоя: свои узлы поверх базовых, минус удаленные"""
+    __slots__ = ('_dir',)
+
+    def __init__(self, directory):
+        self._dir = directory
+
+    def __getitem__(self, name):
+        node = self._dir.get_child(name)
+        if node is None:
+            raise KeyError(name)
+        return node
+
+    def __iter__(self):
+        directory = self._dir
+        yield from directory.added
+        for name in directory.base.children:
+            if name not in directory.added and name not in directory.whiteouts:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __bool__(self):
+        return next(iter(self), None) is not None
+
+
+class OverlayDirectoryNode(DirectoryNode):
+    """Директория сеанса поверх директории базового слоя
+
+    added - узлы, созданные или измененные в сеансе (включая измененные
+    копии базовых), whiteouts - имена базовых узлов, удаленных в сеансе.
+    Неизмененные базовые узлы оборачиваются по требованию и держатся
+    только слабыми ссылками, поэтому память сеанса растет с числом
+    изменений, а не с размером образа.
+    """
+    __slots__ = ('base', 'added', 'whiteouts', '_wrappers', '__weakref__')
+
+    def __init__(self, base, parent):
+        self.name = base.name
+        self.parent = parent
+        self.mode = base.mode
+        self.base = base
+        self.added = {}
+        self.whiteouts = set()
+        self._wrappers = None
+        self.children = _MergedChildren(self)
+
+    @property
+    def permissions(self):
+        return self.mode & 0o777
+
+    @permissions.setter
+    def permissions(self, value):
+        self.mode = (self.mode & ~0o777) | value
+        _pin(self)
+
+    def get_child(self, name):
+        node = self.added.get(name)
+        if node is not None or name in self.whiteouts:
+            return node
+
+        base_child = self.base.children.get(name)
+        if base_child is None:
+            return None
+        if self._wrappers is None:
+            self._wrappers = weakref.WeakValueDictionary()
+        node = self._wrappers.get(name)
+        if node is None:
+            wrapper = OverlayDirectoryNode if base_child.is_dir else OverlayFileNode
+            node = self._wrappers[name] = wrapper(base_child, self)
+        return node
+
+    def add_child(self, node):
+        self.added[node.name] = node
+        self.whiteouts.discard(node.name)
+        node.parent = self
+        _pin(self)
+
+    def remove_child(self, name):
+        node = self.get_child(name)
+        self.added.pop(name, None)
+        if name in self.base.children:
+            self.whiteouts.add(name)
+        _pin(self)
+        return node
+
+    def sorted_names(self, start=0, stop=None):
+        """Слияние отсортированных имен базовой директории и имен слоя"""
+        added, whiteouts = self.added, self.whiteouts
+        base_names = (name for name in self.base.sorted_names()
+                      if name not in added and name not in whiteouts)
+        return islice(heapq.merge(sorted(added), base_names), start, stop)
+
+    def names_with_prefix(self, prefix):
+        added, whiteouts = self.added, self.whiteouts
+        base_names = (name for name in self.base.names_with_prefix(prefix)
+                      if name not in added and name not in whiteouts)
+        return heapq.merge(sorted(name for name in added if name.startswith(prefix)), base_names)
+
+
+class OverlayFileSystem(VirtualFileSystem):
+    """VFS сеанса: общий неизменяемый базовый образ плюс тонкий слой изменений
+
+    Чтение проходит в базовый слой, mkdir/touch/rmdir/chmod меняют только
+    слой. Слой можно сбросить (discard) или влить в базовый образ (merge).
+    """
+
+    def __init__(self, base):
+        self._init_state(base.vfs_path, base.content_cache)
+        self.base = base
+        self.root = OverlayDirectoryNode(base.root, None)
+
+    def read_chunks(self, node):
+        # Неизмененные файлы читаются через базовый узел, чтобы делить с другими
+        # сеансами кэш декодированного содержимого
+        if isinstance(node, OverlayFileNode) and node.content is node.base.content:
+            return self.base.read_chunks(node.base)
+        return super().read_chunks(node)
+
+    def _write(self, node, text, appended=None):
+        super()._write(node, text, appended)
+        if isinstance(node, OverlayFileNode):
+            _pin(node)
+
+    def _move(self, node, parent, name):
+        # Узел базового слоя нельзя перепривязать: слой видит его через обертку.
+        # Он копируется (содержимое разделяется) и удаляется на старом месте
+        if isinstance(node, (OverlayFileNode, OverlayDirectoryNode)):
+            copy = copy_tree(node)
+            copy.name = sys.intern(name)
+            self._detach(node)
+            self._attach(parent, copy)
+        else:
+            super()._move(node, parent, name)
+
+    def _owns(self, node):
+        # Неизмененные файлы базового слоя ссылаются на блобы базового образа
+        return not (isinstance(node, OverlayFileNode) and node.content is node.base.content)
+
+    def reload(self):
+        # Слой ссылается на узлы общего образа: перечитать можно только сам образ
+        raise RuntimeError("reload недоступен в сеансе поверх общего образа")
+
+    def discard(self):
+        """Сбрасывает все изменения сеанса"""
+        self.root = OverlayDirectoryNode(self.base.root, None)
+        self.path_cache = PathCache(self.path_cache.max_entries)
+        # Блобы слоя и его удаленные поддеревья сбрасываются вместе с ним
+        self.blobs = BlobStore()
+        self._garbage = {}
+        self.drop_indexes()
+        # Отменять больше нечего: узлы журнала отмены принадлежали сброшенному слою
+        if self.undo_log is not None:
+            self.remove_listener(self.undo_log)
+            self.undo_log = None
+
+    def merge(self):
+        """Вливает изменения сеанса в базовый образ (с оповещением его наблюдателей)
+        и начинает пустой слой"""
+        base_vfs = self.base
+        stack = [self.root]
+        while stack:
+            layer = stack.pop()
+            base_dir = layer.base
+            if layer.permissions != base_dir.permissions:
+                base_vfs._chmod(base_dir, layer.permissions)
+
+            for name in layer.whiteouts:
+                node = base_dir.children.get(name)
+                if node is not None:
+                    base_vfs._detach(node)
+
+            for name, node in layer.added.items():
+                existing = base_dir.children.get(name)
+                if isinstance(node, OverlayDirectoryNode) and node.base is existing:
+                    stack.append(node)
+                elif isinstance(node, OverlayFileNode) and node.base is existing:
+                    if node.content is not existing.content:
+                        base_vfs._write(existing, node.content)
+                    if node.permissions != existing.permissions:
+                        base_vfs._chmod(existing, node.permissions)
+                else:
+                    # Узел создан в сеансе: его поддерево целиком принадлежит слою
+                    if existing is not None:
+                        base_vfs._detach(existing)
+                    base_vfs._attach(base_dir, node)
+        self.discard()
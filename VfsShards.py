@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+from collections import deque
+from VfsLoader import VfsLoader, dump_json
+from VfsNode import DirectoryNode, walk
+
+
+INDEX_NAME = 'index.json'
+FORMAT = 'vfs-shards'
+VERSION = 1
+# Примерное число узлов в одном шарде
+SHARD_NODES = 2000
+
+# Слот children из DirectoryNode: LazyDirectoryNode закрывает его свойством
+_CHILDREN = DirectoryNode.__dict__['children']
+
+
+def is_sharded(path):
+    """Проверяет, что path - директория шардированного образа"""
+    return os.path.isfile(os.path.join(path, INDEX_NAME))
+
+
+def read_index(path):
+    with open(os.path.join(path, INDEX_NAME), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('format') != FORMAT or index.get('version') != VERSION:
+        raise ValueError(f"'{path}' не является шардированным образом версии {VERSION}")
+    return index
+
+
+class LazyDirectoryNode(DirectoryNode):
+    """Директория, чьи дети лежат в отдельном шарде или в таблице узлов снимка
+
+    Дети читаются через store.load_children(key, node) при первом обращении
+    к children: переход по пути, ls, обход поддерева. key - номер шарда
+    (ShardStore) или узла (VfsSnapshot). До этого узел знает только имя и права.
+    """
+    __slots__ = ('_store', '_key')
+
+    def __init__(self, name, parent, permissions, store, key):
+        super().__init__(name, parent, permissions)
+        self._store = store
+        self._key = key
+
+    @property
+    def loaded(self):
+        return self._store is None
+
+    @property
+    def children(self):
+        if self._store is not None:
+            _CHILDREN.__set__(self, self._store.load_children(self._key, self))
+            self._store = None
+        return _CHILDREN.__get__(self)
+
+    @children.setter
+    def children(self, value):
+        _CHILDREN.__set__(self, value)
+
+
+class ShardStore:
+    """Шардированный образ на диске: index.json и по файлу JSON на шард
+
+    Шард - директория в формате vfs_structure.json, в котором вложенные
+    директории из других шардов записаны заглушками {"shard": N}. Шарды
+    лежат в директории поколения g<N>; compact пишет новое поколение и
+    атомарно подменяет index.json, так что образ на диске всегда цел.
+    """
+
+    def __init__(self, path, blobs=None):
+        self.path = path
+        self.blobs = blobs
+        self.index = read_index(path)
+        # Сколько шардов прочитано с диска
+        self.loaded = 0
+
+    def shard_path(self, shard):
+        return shard_path(self.path, self.index['generation'], shard)
+
+    def _load(self, shard):
+        try:
+            with open(self.shard_path(shard), 'r', encoding='utf-8') as f:
+                root = VfsLoader(f, blobs=self.blobs, shards=self).load()
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f"Ошибка загрузки шарда {shard}: {e}")
+        self.loaded += 1
+        return root
+
+    def load_root(self):
+        """Корень образа; его поддиректории из других шардов остаются заглушками"""
+        return self._load(self.index['root'])
+
+    def load_children(self, shard, directory):
+        """Дети директории из шарда shard, уже привязанные к directory"""
+        children = self._load(shard).children
+        for child in children.values():
+            child.parent = directory
+        return children
+
+    def stub(self, name, parent, permissions, shard):
+        return LazyDirectoryNode(name, parent, permissions, self, shard)
+
+
+def shard_path(path, generation, shard):
+    # 256 поддиректорий, чтобы в одной директории не лежали сотни тысяч файлов
+    return os.path.join(path, f"g{generation}", f"{shard % 256:02x}", f"{shard}.json")
+
+
+def _subtree_sizes(root):
+    """Число узлов в поддереве каждой директории (включая ее саму)"""
+    sizes = {}
+    for directory in reversed([node for node in walk(root) if node.is_dir]):
+        sizes[directory] = 1 + sum(sizes[child] if child.is_dir else 1
+                                   for child in directory.children.values())
+    return sizes
+
+
+def _split(top, sizes, shard_nodes):
+    """Директории, которые уходят из шарда top в отдельные шарды. Дети самой top
+    всегда лежат в ее шарде; поддерево директории-ребенка встраивается целиком,
+    если помещается в остаток shard_nodes, иначе становится своим шардом"""
+    stubs = []
+    budget = shard_nodes - len(top.children)
+    stack = [child for _, child in sorted(top.children.items(), reverse=True) if child.is_dir]
+    while stack:
+        directory = stack.pop()
+        # Сама директория уже учтена среди детей своего родителя
+        inner = sizes[directory] - 1
+        if inner <= budget:
+            budget -= inner
+        else:
+            stubs.append(directory)
+    return stubs
+
+
+def write(root, path, shard_nodes=SHARD_NODES):
+    """Записывает дерево в шардированный образ path (создает или заменяет)"""
+    old = read_index(path) if is_sharded(path) else None
+    generation = old['generation'] + 1 if old is not None else 0
+    if os.path.exists(os.path.join(path, f"g{generation}")):
+        shutil.rmtree(os.path.join(path, f"g{generation}"))
+
+    sizes = _subtree_sizes(root)
+    next_shard = 1
+    queue = deque([(0, root)])
+    while queue:
+        shard, top = queue.popleft()
+        stubs = {}
+        for directory in _split(top, sizes, shard_nodes):
+            stubs[directory] = next_shard
+            queue.append((next_shard, directory))
+            next_shard += 1
+
+        target = shard_path(path, generation, shard)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w', encoding='utf-8') as f:
+            dump_json(top, f, stubs)
+
+    index = {'format': FORMAT, 'version': VERSION, 'generation': generation, 'root': 0,
+             'shards': next_shard, 'nodes': sizes[root]}
+    temp_path = os.path.join(path, INDEX_NAME + '.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(path, INDEX_NAME))
+
+    if old is not None:
+        shutil.rmtree(os.path.join(path, f"g{old['generation']}"), ignore_errors=True)
+    return index
+
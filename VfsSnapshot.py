@@ -0,0 +1,164 @@
+import base64
+import hashlib
+import mmap
+import struct
+import sys
+from collections import deque
+from VfsContent import ChunkedContent
+from VfsNode import FileNode
+from VfsShards import LazyDirectoryNode
+
+
+MAGIC = b'VFSSNAP1'
+VERSION = 1
+# magic, версия, число узлов, смещения и размеры таблицы узлов, строк и содержимого
+HEADER = struct.Struct('<8sIIQQQQQQ')
+# mode, родитель, смещение и длина имени, первый ребенок и число детей,
+# смещение и длина содержимого
+NODE = struct.Struct('<IIIIIIQQ')
+NO_PARENT = 0xFFFFFFFF
+# Флаг в mode: содержимое осталось в base64, потому что не декодировалось при записи
+ENCODED = 1 << 20
+
+
+def is_snapshot(path):
+    """Проверяет по сигнатуре, что файл является бинарным снимком VFS"""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class VfsSnapshot:
+    """Бинарный снимок VFS, открываемый через mmap
+
+    Формат: заголовок, область содержимого файлов, таблица строк (имена)
+    и таблица узлов фиксированного размера. Узлы записаны в порядке обхода
+    в ширину, поэтому дети каждой директории лежат подряд и отсортированы
+    по имени. Дерево не разбирается целиком: директории - ленивые узлы
+    (VfsShards.LazyDirectoryNode), их дети читаются из таблицы при первом
+    обращении, а содержимое файлов отдается срезами memoryview без копирования.
+    """
+
+    def __init__(self, path, blobs=None):
+        self.path = path
+        self.blobs = blobs
+        # (смещение, длина) в таблице строк -> имя: одинаковые имена записаны один раз
+        self._names = {}
+        # Сколько директорий прочитано из таблицы узлов
+        self.loaded = 0
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+
+        (magic, version, self.node_count, self._nodes_off, _,
+         self._strings_off, _, self._blobs_off, _) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{path}' не является снимком VFS версии {VERSION}")
+
+    def node(self, index):
+        """Запись узла: (mode, parent, name_off, name_len, first_child, child_count,
+        content_off, content_len)"""
+        return NODE.unpack_from(self._mm, self._nodes_off + index * NODE.size)
+
+    def load_root(self):
+        """Корень снимка; его поддиректории - ленивые, как заглушки шардов"""
+        mode, _, name_off, name_len = self.node(0)[:4]
+        return LazyDirectoryNode(self._name(name_off, name_len), None, mode & 0o777, self, 0)
+
+    def load_children(self, index, directory):
+        """Дети директории index из таблицы узлов, уже привязанные к directory.
+        Дети лежат в таблице подряд, поэтому читается только их диапазон;
+        файлы ссылаются на срезы снимка, поддиректории снова ленивые"""
+        _, _, _, _, first, count, _, _ = self.node(index)
+        start = self._nodes_off + first * NODE.size
+        view = self._view
+        blobs_off = self._blobs_off
+        children = {}
+        for offset, (mode, _, name_off, name_len, _, _, content_off, content_len) in enumerate(
+                NODE.iter_unpack(view[start:start + count * NODE.size])):
+            name = self._name(name_off, name_len)
+            if mode & 0o170000 == 0o040000:
+                node = LazyDirectoryNode(name, directory, mode & 0o777, self, first + offset)
+            else:
+                content = view[blobs_off + content_off:blobs_off + content_off + content_len]
+                if mode & ENCODED:
+                    # Нераскодированный base64 учитывается в blobs, как при загрузке JSON
+                    content = bytes(content)
+                    if self.blobs is not None:
+                        content = self.blobs.intern(content)
+                node = FileNode(name, directory, mode & 0o777, content)
+            children[name] = node
+        self.loaded += 1
+        return children
+
+    def _name(self, name_off, name_len):
+        name = self._names.get((name_off, name_len))
+        if name is None:
+            start = self._strings_off + name_off
+            name = self._names[name_off, name_len] = sys.intern(str(self._view[start:start + name_len], 'utf-8'))
+        return name
+
+    @staticmethod
+    def write(root, path):
+        """Записывает дерево в снимок. base64 декодируется здесь, один раз;
+        одинаковое содержимое пишется один раз, узлы ссылаются на одну область"""
+        names = {}
+        offsets = {}
+        strings = bytearray()
+        table = bytearray()
+        blobs_len = 0
+
+        with open(path, 'wb') as f:
+            f.write(b'\0' * HEADER.size)
+            blobs_off = HEADER.size
+
+            queue = deque([(root, NO_PARENT)])
+            next_index = 1
+            while queue:
+                node, parent = queue.popleft()
+                index = len(table) // NODE.size
+
+                name_off = names.get(node.name)
+                if name_off is None:
+                    name_off = names[node.name] = len(strings)
+                    strings += node.name.encode('utf-8')
+                name_len = len(node.name.encode('utf-8'))
+
+                mode = node.mode
+                first_child = child_count = 0
+                content_off = content_len = 0
+                if node.is_dir:
+                    children = sorted(node.children.items())
+                    first_child, child_count = next_index, len(children)
+                    next_index += child_count
+                    queue.extend((child, index) for _, child in children)
+                else:
+                    data = node.content
+                    if isinstance(data, str):
+                        data = data.encode('utf-8')
+                    elif isinstance(data, ChunkedContent):
+                        data = data.tobytes()
+                    elif isinstance(data, bytes):
+                        try:
+                            data = base64.b64decode(data)
+                        except ValueError:
+                            mode |= ENCODED
+                    content_len = len(data)
+                    # Ключ - хэш, а не сами байты: иначе все содержимое осталось бы в памяти
+                    key = (mode & ENCODED, hashlib.blake2b(data, digest_size=20).digest())
+                    content_off = offsets.get(key)
+                    if content_off is None:
+                        content_off = offsets[key] = blobs_len
+                        f.write(data)
+                        blobs_len += content_len
+
+                table += NODE.pack(mode, parent, name_off, name_len, first_child, child_count,
+                                   content_off, content_len)
+
+            strings_off = blobs_off + blobs_len
+            f.write(strings)
+            nodes_off = strings_off + len(strings)
+            f.write(table)
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, len(table) // NODE.size, nodes_off, len(table),
+                                strings_off, len(strings), blobs_off, blobs_len))
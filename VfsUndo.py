@@ -0,0 +1,97 @@
+from VfsListener import MutationListener
+
+
+class UndoLog(MutationListener):
+    """Журнал отмены для транзакций VFS
+
+    Каждое изменение дерева записывается обратным действием, откат выполняет
+    их в обратном порядке, поэтому стоит O(числа изменений), а не размера
+    дерева. Удаленные поддеревья и прежнее содержимое файлов держатся
+    журналом до commit: откат удаления возвращает те же узлы.
+
+    Транзакции вкладываются: на каждый begin - уровень с позицией начала в
+    журнале и своими точками сохранения (имя -> позиция, в порядке создания).
+    """
+
+    def __init__(self, vfs):
+        self.vfs = vfs
+        # (обратное действие, аргументы)
+        self.entries = []
+        # [позиция начала, {имя точки сохранения: позиция}] на каждую открытую транзакцию
+        self.levels = []
+
+    def begin(self):
+        self.levels.append([len(self.entries), {}])
+
+    def savepoint(self, name):
+        savepoints = self.levels[-1][1]
+        # Повторное имя переносит точку на текущую позицию
+        savepoints.pop(name, None)
+        savepoints[name] = len(self.entries)
+
+    def rollback(self, name=None):
+        """Отменяет изменения до точки сохранения name (транзакция остается открытой)
+        или всю текущую транзакцию; возвращает число отмененных изменений"""
+        if name is None:
+            start, _ = self.levels.pop()
+            return self._undo(start)
+
+        for depth in range(len(self.levels) - 1, -1, -1):
+            savepoints = self.levels[depth][1]
+            if name in savepoints:
+                break
+        else:
+            raise RuntimeError(f"Точка сохранения '{name}' не найдена")
+        # Вложенные транзакции и точки, созданные после name, закрываются вместе с откатом
+        del self.levels[depth + 1:]
+        names = list(savepoints)
+        for later in names[names.index(name) + 1:]:
+            del savepoints[later]
+        return self._undo(savepoints[name])
+
+    def commit(self):
+        """Закрывает текущую транзакцию; изменения вложенной остаются в журнале
+        внешней, пока та не закрыта"""
+        _, savepoints = self.levels.pop()
+        if self.levels:
+            outer = self.levels[-1][1]
+            for name, position in savepoints.items():
+                outer.pop(name, None)
+                outer[name] = position
+        else:
+            self.entries.clear()
+
+    def _undo(self, position):
+        entries = self.entries
+        count = len(entries) - position
+        # Обратные действия сами меняют дерево и не должны попасть в журнал
+        self.vfs.remove_listener(self)
+        try:
+            while len(entries) > position:
+                undo, args = entries.pop()
+                undo(*args)
+        finally:
+            self.vfs.add_listener(self)
+        return count
+
+    def _restore_permissions(self, nodes, old_permissions):
+        for node, permissions in zip(nodes, old_permissions):
+            self.vfs._chmod(node, permissions)
+
+    def on_attach(self, parent, node):
+        self.entries.append((self.vfs._detach, (node,)))
+
+    def on_detach(self, parent, node):
+        self.entries.append((self.vfs._attach, (parent, node)))
+
+    def on_move(self, node, old_parent, old_name):
+        self.entries.append((self.vfs._move, (node, old_parent, old_name)))
+
+    def on_chmod(self, node, old_permissions):
+        self.entries.append((self.vfs._chmod, (node, old_permissions)))
+
+    def on_chmod_tree(self, node, nodes, old_permissions):
+        self.entries.append((self._restore_permissions, (nodes, old_permissions)))
+
+    def on_write(self, node, old_content):
+        self.entries.append((self.vfs._write, (node, old_content)))
@@ -1,77 +1,487 @@
-import json
-import base64
 import os
+import sys
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from VfsNode import Node, DirectoryNode, FileNode, copy_tree, parse_permissions, walk
+from VfsLoader import VfsLoader, dump_json
+from VfsJournal import VfsJournal, aside_path, journal_path, recover, set_aside
+from VfsUndo import UndoLog
+from VfsSnapshot import VfsSnapshot, is_snapshot
+import VfsShards
+from VfsIndex import DigestIndex, MetaTable, NameIndex, SizeIndex, TrigramIndex, is_under, tree_digests
+from VfsContent import BlobStore, ChunkedContent, ChunkWriter, content_digest, decode_chunks, split_view
+
+
+CONTENT_CACHE_BYTES = 64 * 1024 * 1024
+PATH_CACHE_ENTRIES = 4096
+# Сколько узлов удаленных поддеревьев разбирается за одно изменение дерева
+GC_BATCH = 4096
+
+
+class ContentCache:
+    """LRU-кэш декодированного содержимого файлов с ограничением по байтам
+
+    Ключ - сам объект base64: содержимое неизменяемо, а одинаковые файлы
+    делят один объект, поэтому и декодируются один раз.
+    """
+
+    def __init__(self, max_bytes=CONTENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, encoded):
+        entry = self._entries.get(encoded)
+        if entry is None:
+            return None
+        self._entries.move_to_end(encoded)
+        return entry[0]
+
+    def put(self, encoded, content, nbytes):
+        if nbytes > self.max_bytes:
+            return
+        self.discard(encoded)
+        self._entries[encoded] = (content, nbytes)
+        self.size += nbytes
+        # Вытесняем самые давно читанные файлы, они остаются в base64
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+
+    def discard(self, encoded):
+        entry = self._entries.pop(encoded, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class PathCache:
+    """Ограниченный LRU-кэш разрешения путей: (узел-основа, путь) -> узел
+
+    Для каждой записи запоминаются узлы, через которые шел поиск. Изменение
+    детей директории сбрасывает только записи, заглядывавшие в нее.
+    """
+
+    MISS = object()
+
+    def __init__(self, max_entries=PATH_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._dependents = {}
+
+    def get(self, base, path):
+        key = (base, path)
+        entry = self._entries.get(key)
+        if entry is None:
+            return self.MISS
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, base, path, node, visited):
+        if self.max_entries <= 0:
+            return
+        key = (base, path)
+        self._drop(key)
+        self._entries[key] = (node, visited)
+        for dependency in visited:
+            self._dependents.setdefault(dependency, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def invalidate(self, node):
+        """Сбрасывает записи, при разрешении которых поиск проходил через node"""
+        for key in self._dependents.pop(node, ()):
+            self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for dependency in entry[1]:
+            keys = self._dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[dependency]
 
 
 class VirtualFileSystem:
-    """Виртуальная файловая система с поддержкой base64"""
+    """Виртуальная файловая система с поддержкой base64
 
-    def __init__(self, vfs_path):
-        self.vfs_path = vfs_path
+    Образ загружается из JSON (vfs_structure.json), из бинарного снимка,
+    созданного save_snapshot, или из шардированного образа (VfsShards); в двух
+    последних директории читаются с диска при первом обращении. Если рядом с образом есть журнал изменений,
+    он проигрывается поверх образа. С journal=True новые изменения
+    дописываются в журнал, а compact() сворачивает журнал в новый образ.
+    """
+
+    def __init__(self, vfs_path, cache_bytes=CONTENT_CACHE_BYTES, journal=False):
+        self._init_state(vfs_path, ContentCache(cache_bytes))
         try:
-            with open(vfs_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            self.root = self._process_vfs_data(data)
-            self._set_parent_references(self.root, None)
-            self._ensure_default_permissions(self.root)
+            if VfsShards.is_sharded(vfs_path):
+                self.shards = VfsShards.ShardStore(vfs_path, self.blobs)
+                self.root = self.shards.load_root()
+            elif is_snapshot(vfs_path):
+                self.snapshot = VfsSnapshot(vfs_path, self.blobs)
+                self.root = self.snapshot.load_root()
+            else:
+                with open(vfs_path, 'r', encoding='utf-8') as f:
+                    self.root = VfsLoader(f, blobs=self.blobs).load()
+            self._replay_journal()
+            if journal:
+                self.journal = VfsJournal(self, journal_path(vfs_path))
+                self.add_listener(self.journal)
         except Exception as e:
             raise RuntimeError(f"Ошибка загрузки VFS: {e}")
 
-    def _ensure_default_permissions(self, node):
-        """Ставит стандартные права если их нет"""
-        if 'permissions' not in node:
-            # Для папок - 755, для файлов - 644
-            if node['type'] == 'directory':
-                node['permissions'] = '755'
+    def _init_state(self, vfs_path, content_cache):
+        """Состояние, общее для образа с диска и для слоев поверх него"""
+        self.vfs_path = vfs_path
+        self.content_cache = content_cache
+        # Одинаковое содержимое файлов хранится один раз
+        self.blobs = BlobStore()
+        # Удаленные поддеревья -> обход их узлов (None, пока не начат): блобы
+        # отпускаются порциями позже
+        self._garbage = {}
+        self.path_cache = PathCache()
+        self.listeners = []
+        self.snapshot = None
+        self.shards = None
+        self.journal = None
+        self.root = None
+        # VfsCounters при включенном профилировании, иначе None
+        self.counters = None
+        # Индексы поиска строятся при первом find/grep
+        self.name_index = None
+        self.content_index = None
+        # Суммарные размеры директорий строятся при первом du/tree
+        self.size_index = None
+        # Типы и права узлов в массивах - при первом find -type/-perm
+        self.meta_table = None
+        # Хэши Меркла директорий - при первом reload
+        self.digest_index = None
+        # Журнал отмены, пока открыта транзакция (begin)
+        self.undo_log = None
+
+    def add_listener(self, listener):
+        """Подписывает MutationListener на изменения дерева"""
+        self.listeners.append(listener)
+
+    def get_name_index(self):
+        """Индекс имен для find; после построения обновляется при изменениях дерева"""
+        if self.name_index is None:
+            self.name_index = NameIndex(self.root)
+            self.add_listener(self.name_index)
+        return self.name_index
+
+    def get_content_index(self):
+        """Индекс триграмм содержимого для grep"""
+        if self.content_index is None:
+            self.content_index = TrigramIndex(self)
+            self.add_listener(self.content_index)
+        return self.content_index
+
+    def get_size_index(self):
+        """Размеры и число потомков директорий для du и tree"""
+        if self.size_index is None:
+            self.size_index = SizeIndex(self.root)
+            self.add_listener(self.size_index)
+        return self.size_index
+
+    def get_meta_table(self):
+        """Таблица типов, прав и глубин узлов для find -type/-perm; chmod -R
+        пользуется ею, если она уже построена"""
+        if self.meta_table is None:
+            self.meta_table = MetaTable(self.root)
+            self.add_listener(self.meta_table)
+        return self.meta_table
+
+    def get_digest_index(self):
+        """Хэши поддеревьев для сравнения с новым образом в reload"""
+        if self.digest_index is None:
+            self.digest_index = DigestIndex()
+            self.add_listener(self.digest_index)
+        return self.digest_index
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def blob_stats(self):
+        """Статистика дедупликации содержимого: блобы, ссылки, dedup_ratio, bytes_saved.
+        В открытой транзакции учтены и блобы удаленных поддеревьев из журнала отмены"""
+        self._collect()
+        return self.blobs.stats()
+
+    def drop_indexes(self):
+        """Забывает индексы (при подмене корня дерева)"""
+        for index in (self.name_index, self.content_index, self.size_index, self.meta_table,
+                      self.digest_index):
+            if index is not None:
+                self.remove_listener(index)
+        self.name_index = None
+        self.content_index = None
+        self.size_index = None
+        self.meta_table = None
+        self.digest_index = None
+
+    def save_snapshot(self, path):
+        """Сохраняет текущее дерево в бинарный снимок"""
+        VfsSnapshot.write(self.root, path)
+
+    def save_shards(self, path, shard_nodes=VfsShards.SHARD_NODES):
+        """Сохраняет текущее дерево в шардированный образ (директорию)"""
+        return VfsShards.write(self.root, path, shard_nodes)
+
+    def save_json(self, path):
+        """Сохраняет текущее дерево в формате vfs_structure.json"""
+        with open(path, 'w', encoding='utf-8') as f:
+            dump_json(self.root, f)
+
+    def _replay_journal(self):
+        """Применяет записи журнала к только что загруженному образу"""
+        recover(self.vfs_path, self.image_stamp())
+        for record in VfsJournal.read(journal_path(self.vfs_path)):
+            op, path = record['op'], record['path']
+            if op == 'mkdir':
+                self.create_directory(self.root, path)
+            elif op == 'touch':
+                self.create_file(self.root, path)
+            elif op == 'chmod':
+                self.change_permissions(self.root, path, record['mode'], record.get('recursive', False))
+            elif op == 'write':
+                node = self._replay_file(path)
+                if node is not None:
+                    if 'content_b64' in record:
+                        content = ChunkedContent.from_base64(record['content_b64'].encode('ascii'))
+                    else:
+                        content = ChunkedContent.from_bytes(record['content'].encode('utf-8'))
+                    self._write(node, content)
+            elif op == 'append':
+                node = self._replay_file(path)
+                if node is not None:
+                    writer = self._appender(node)
+                    # Другой размер - в образе не тот файл, к которому дописывали
+                    # (запись уже в нем или образ перегенерирован): запись пропускается
+                    if sum(map(len, writer.chunks)) == record['offset']:
+                        kept = len(writer.chunks)
+                        writer.write(VfsJournal.record_data(record))
+                        content = writer.close()
+                        self._write(node, content, content.chunks[kept:])
+            elif op == 'remove':
+                node = self.resolve(self.root, path)
+                if node is not None and node.parent is not None:
+                    self._detach(node)
+            elif op == 'move':
+                # Источника нет или цель занята - перенос уже в образе
+                node = self.resolve(self.root, path)
+                if node is not None and node.parent is not None and self.resolve(self.root, record['to']) is None:
+                    self.move(self.root, path, record['to'])
             else:
-                node['permissions'] = '644'
-
-        # Для всех вложенных файлов/папок тоже ставим права
-        if node['type'] == 'directory':
-            for child in node['content'].values():
-                self._ensure_default_permissions(child)
-    def _process_vfs_data(self, node, path=""):
-        """Обрабатывает данные VFS, декодируя base64 если нужно"""
-        if node['type'] == 'file' and 'content_b64' in node:
-            try:
-                node['content'] = base64.b64decode(node['content_b64']).decode('utf-8')
-                del node['content_b64']
-            except Exception as e:
-                node['content'] = f"Ошибка декодирования: {e}"
-        elif node['type'] == 'directory':
-            for name, child in node['content'].items():
-                child_path = f"{path}/{name}" if path else name
-                node['content'][name] = self._process_vfs_data(child, child_path)
-        return node
-
-    def _set_parent_references(self, node, parent):
-        """Устанавливает ссылки на родительские узлы"""
-        node['parent'] = parent
-        if node['type'] == 'directory':
-            for child_name, child_node in node['content'].items():
-                self._set_parent_references(child_node, node)
-
-    def _ensure_default_permissions(self, node):
-        """Устанавливает права доступа по умолчанию если их нет"""
-        if 'permissions' not in node:
-            node['permissions'] = '755' if node['type'] == 'directory' else '644'
-
-        if node['type'] == 'directory':
-            for child_node in node['content'].values():
-                self._ensure_default_permissions(child_node)
-
-    def resolve_path(self, current_path, target_path):
-        """Разрешает путь относительно текущей директории"""
+                raise ValueError(f"неизвестная операция журнала '{op}'")
+
+    def _replay_file(self, path):
+        """Файл для записи журнала write/append (создается, если его нет) или None:
+        в перегенерированном образе на этом пути может оказаться директория"""
+        if not self.create_file(self.root, path):
+            return None
+        node = self.resolve(self.root, path)
+        return None if node.is_dir else node
+
+    def compact(self):
+        """Сворачивает журнал: пишет новый образ того же формата и очищает журнал"""
+        # Журнал откладывается с отметкой прежнего образа: после сбоя загрузка
+        # по отметке решает, проигрывать его или он уже в новом образе
+        if self.journal is not None:
+            self.journal.sync()
+        set_aside(self.vfs_path, self.image_stamp())
+        if self.shards is not None:
+            # Новое поколение шардов подменяет старое атомарной заменой index.json
+            self.save_shards(self.vfs_path)
+        else:
+            temp_path = self.vfs_path + '.tmp'
+            if self.snapshot is not None:
+                self.save_snapshot(temp_path)
+            else:
+                self.save_json(temp_path)
+            with open(temp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.vfs_path)
+
+        if os.path.exists(aside_path(self.vfs_path)):
+            os.remove(aside_path(self.vfs_path))
+        if self.journal is not None:
+            self.journal.reopen()
+
+    def begin(self):
+        """Начинает транзакцию; внутри открытой начинается вложенная"""
+        if self.undo_log is None:
+            self.undo_log = UndoLog(self)
+            self.add_listener(self.undo_log)
+        self.undo_log.begin()
+
+    def savepoint(self, name):
+        """Точка сохранения в текущей транзакции"""
+        self._undo_log().savepoint(name)
+
+    def rollback(self, name=None):
+        """Отменяет изменения до точки сохранения name или всю текущую транзакцию;
+        возвращает число отмененных изменений"""
+        undone = self._undo_log().rollback(name)
+        self._end_transaction()
+        return undone
+
+    def commit(self):
+        """Закрывает текущую транзакцию, сохраняя ее изменения"""
+        self._undo_log().commit()
+        self._end_transaction()
+
+    def transaction_depth(self):
+        """Число открытых (вложенных) транзакций"""
+        return len(self.undo_log.levels) if self.undo_log is not None else 0
+
+    def _undo_log(self):
+        if self.undo_log is None:
+            raise RuntimeError("Нет открытой транзакции")
+        return self.undo_log
+
+    def _end_transaction(self):
+        # После закрытия внешней транзакции изменения больше не записываются
+        if not self.undo_log.levels:
+            self.remove_listener(self.undo_log)
+            self.undo_log = None
+
+    def image_stamp(self):
+        """(inode, время изменения, размер) файла образа или None: по смене замечается
+        новый образ. Inode меняет и замена образа в пределах точности времени"""
+        path = self.vfs_path
+        if VfsShards.is_sharded(path):
+            path = os.path.join(path, VfsShards.INDEX_NAME)
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        return info.st_ino, info.st_mtime_ns, info.st_size
+
+    def reload(self):
+        """Приводит дерево к образу на диске с журналом поверх (как при новом запуске),
+        меняя на месте только отличающиеся узлы. Поддеревья сравниваются по хэшам
+        Меркла, поэтому неизмененные части дерева не обходятся. Возвращает
+        (добавлено, удалено, изменено)"""
+        if self.shards is not None:
+            # Незагруженные директории живого дерева ссылаются на поколение шардов,
+            # которое новый образ уже удалил
+            raise RuntimeError("reload не поддерживается для шардированного образа")
+        self.sync()
+        image = VirtualFileSystem(self.vfs_path)
+        new_digests = tree_digests(image.root)
+        digests = self.get_digest_index()
+
+        # Журнал уже содержит изменения сеанса, а новый образ - изменения с диска
+        journal = self.journal
+        if journal is not None:
+            self.remove_listener(journal)
+        try:
+            if digests.digest(self.root) == new_digests[image.root]:
+                return 0, 0, 0
+            return self._apply_image(image.root, new_digests, digests)
+        finally:
+            if journal is not None:
+                self.add_listener(journal)
+
+    def _apply_image(self, root, new_digests, digests):
+        """Переносит отличия нового дерева root в живое: спуск идет только
+        в директории с разными хэшами, новые узлы перевешиваются целиком"""
+        added = removed = changed = 0
+        stack = [(self.root, root)]
+        while stack:
+            live, new = stack.pop()
+            if live.permissions != new.permissions:
+                self._chmod(live, new.permissions)
+                changed += 1
+            for name in [name for name in live.children if name not in new.children]:
+                self._detach(live.get_child(name))
+                removed += 1
+
+            for name, node in list(new.children.items()):
+                current = live.get_child(name)
+                if current is None or current.is_dir != node.is_dir:
+                    if current is not None:
+                        self._detach(current)
+                        removed += 1
+                    self._attach(live, node)
+                    added += 1
+                elif node.is_dir:
+                    if digests.digest(current) != new_digests[node]:
+                        stack.append((current, node))
+                else:
+                    modified = False
+                    if content_digest(current.content) != content_digest(node.content):
+                        self._write(current, node.content)
+                        modified = True
+                    if current.permissions != node.permissions:
+                        self._chmod(current, node.permissions)
+                        modified = True
+                    changed += modified
+        return added, removed, changed
+
+    def sync(self):
+        """Сбрасывает журнал на диск"""
+        if self.journal is not None:
+            self.journal.sync()
+
+    def poll_journal(self):
+        """Сбрасывает журнал, если срок его пачки истек"""
+        if self.journal is not None:
+            self.journal.poll()
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.remove_listener(self.journal)
+            self.journal = None
+
+    def resolve_path(self, current, target_path):
+        """Разрешает путь относительно текущей директории (узла или строки пути)"""
         if target_path.startswith('/'):
-            path_parts = self._split_path(target_path)
             current_node = self.root
         else:
-            path_parts = self._split_path(target_path)
-            current_node = self._get_node_at_path(current_path)
+            current_node = self._base_node(current)
             if current_node is None:
                 return None
 
-        return self._follow_path(path_parts, current_node)
+        return self.resolve(current_node, target_path)
+
+    def resolve(self, base, target_path):
+        """Разрешает путь от узла base через кэш путей"""
+        counters = self.counters
+        if counters is not None:
+            counters.lookups += 1
+        node = self.path_cache.get(base, target_path)
+        if node is not PathCache.MISS:
+            if counters is not None:
+                counters.cache_hits += 1
+            return node
+
+        visited = []
+        node = self._follow_path(self._split_path(target_path), base, visited)
+        self.path_cache.put(base, target_path, node, tuple(visited))
+        if counters is not None:
+            counters.nodes_walked += len(visited)
+        return node
+
+    def _base_node(self, current):
+        """Текущая директория: узел передается как есть, строка разрешается от корня"""
+        if isinstance(current, Node):
+            return current
+        return self._get_node_at_path(current)
+
+    def get_path(self, node):
+        """Абсолютный путь узла, собранный по ссылкам на родителей"""
+        parts = []
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return '/' + '/'.join(reversed(parts))
 
     def _split_path(self, path):
         """Разбивает путь на части"""
@@ -82,41 +492,181 @@ class VirtualFileSystem:
         if path == '/':
             return self.root
 
-        path_parts = self._split_path(path)
-        current_node = self.root
-
-        for part in path_parts:
-            if (part in current_node.get('content', {}) and
-                    current_node['content'][part]['type'] == 'directory'):
-                current_node = current_node['content'][part]
-            else:
-                return None
-        return current_node
+        node = self.resolve(self.root, path)
+        if node is None or not node.is_dir:
+            return None
+        return node
 
-    def _follow_path(self, path_parts, current_node):
-        """Следует по пути из частей"""
+    def _follow_path(self, path_parts, current_node, visited=None):
+        """Следует по пути из частей; пройденные узлы добавляются в visited"""
         for part in path_parts:
+            if visited is not None:
+                visited.append(current_node)
             if part == '..':
-                current_node = current_node.get('parent', current_node)
+                current_node = current_node.parent or current_node
             elif part == '.':
                 continue
-            elif part in current_node.get('content', {}):
-                current_node = current_node['content'][part]
             else:
-                return None
+                current_node = current_node.get_child(part) if current_node.is_dir else None
+                if current_node is None:
+                    return None
         return current_node
 
-    def get_file_content(self, current_path, file_path):
+    def get_file_content(self, current, file_path):
         """Получает содержимое файла"""
-        node = self.resolve_path(current_path, file_path)
-        if node and node['type'] == 'file':
-            return node.get('content', '')
+        node = self.resolve_path(current, file_path)
+        if node and not node.is_dir:
+            return self.read_content(node)
+        return None
+
+    def get_file_chunks(self, current, file_path):
+        """Содержимое файла кусками байт, None если это не файл"""
+        node = self.resolve_path(current, file_path)
+        if node and not node.is_dir:
+            return self.read_chunks(node)
         return None
 
-    def create_directory(self, current_path, dir_path):
+    def read_chunks(self, node):
+        """Байты файла списком кусков (bytes или memoryview) без склейки в одну строку
+
+        Записанные файлы уже хранятся кусками, байты снимка режутся срезами
+        memoryview, base64 декодируется по кускам при первом обращении и
+        держится в LRU-кэше.
+        """
+        return self.content_chunks(node.content)
+
+    def content_chunks(self, content):
+        """Куски байт объекта содержимого (значения node.content)"""
+        if isinstance(content, ChunkedContent):
+            return content.chunks
+        if isinstance(content, str):
+            return [content.encode('utf-8')]
+        if isinstance(content, memoryview):
+            return split_view(content)
+
+        decoded = self.content_cache.get(content)
+        if decoded is None:
+            try:
+                decoded = ChunkedContent.from_base64(content)
+            except ValueError as e:
+                decoded = ChunkedContent.from_bytes(f"Ошибка декодирования: {e}".encode('utf-8'))
+            self.content_cache.put(content, decoded, len(decoded))
+            if self.counters is not None:
+                self.counters.bytes_decoded += len(decoded)
+        return decoded.chunks
+
+    def read_content(self, node):
+        """Текст файла; байты не в UTF-8 - суррогаты surrogateescape (сами байты не меняются)"""
+        content = node.content
+        if isinstance(content, str):
+            return content
+        return decode_chunks(self.read_chunks(node))
+
+    def content_text(self, content):
+        """Текст объекта содержимого, как read_content"""
+        if isinstance(content, str):
+            return content
+        return decode_chunks(self.content_chunks(content))
+
+    def _make_parents(self, current, path_parts):
+        """Проходит по частям пути, создавая недостающие директории"""
+        for part in path_parts:
+            child = current.get_child(part)
+            if child is None:
+                child = DirectoryNode(sys.intern(part))
+                self._attach(current, child)
+            elif not child.is_dir:
+                return None
+            current = child
+        return current
+
+    def _attach(self, parent, node):
+        """Добавляет узел в директорию"""
+        # Удаленное поддерево возвращается (откат транзакции): если его блобы
+        # еще не начали отпускаться, они по-прежнему учтены и обход не нужен
+        retain = True
+        if node in self._garbage:
+            pending = self._garbage.pop(node)
+            if pending is None:
+                retain = False
+            else:
+                self._release(pending)
+        self._collect(GC_BATCH)
+        parent.add_child(node)
+        self.path_cache.invalidate(parent)
+        if retain:
+            self._retain(node)
+        for listener in self.listeners:
+            listener.on_attach(parent, node)
+
+    def _detach(self, node):
+        """Убирает узел из родительской директории за O(1): поддерево не обходится,
+        его блобы отпускаются порциями при следующих изменениях (_collect)"""
+        parent = node.parent
+        parent.remove_child(node.name)
+        self.path_cache.invalidate(parent)
+        self.path_cache.invalidate(node)
+        self._collect(GC_BATCH)
+        self._garbage[node] = None
+        for listener in self.listeners:
+            listener.on_detach(parent, node)
+
+    def _move(self, node, parent, name):
+        """Переносит узел с поддеревом в parent под именем name за O(1): меняются
+        только ссылки, поддерево не обходится"""
+        old_parent, old_name = node.parent, node.name
+        old_parent.remove_child(old_name)
+        self.path_cache.invalidate(old_parent)
+        self.path_cache.invalidate(node)
+        node.name = sys.intern(name)
+        parent.add_child(node)
+        self.path_cache.invalidate(parent)
+        for listener in self.listeners:
+            listener.on_move(node, old_parent, old_name)
+
+    def _collect(self, budget=None):
+        """Отпускает блобы файлов удаленных поддеревьев: все или около budget узлов"""
+        if self.undo_log is not None:
+            # Удаленные поддеревья держит журнал отмены: откат вернет их вместе с блобами
+            return
+        while self._garbage and (budget is None or budget > 0):
+            root = next(iter(self._garbage))
+            nodes = self._garbage[root]
+            if nodes is None:
+                nodes = self._garbage[root] = walk(root, loaded_only=True)
+            count = self._release(islice(nodes, budget))
+            if budget is None or count < budget:
+                del self._garbage[root]
+            if budget is not None:
+                budget -= count
+
+    def _release(self, nodes):
+        """Отпускает блобы файлов из nodes и оповещает о них наблюдателей,
+        возвращает число пройденных узлов"""
+        releases = [listener.on_release for listener in self.listeners]
+        count = 0
+        for node in nodes:
+            count += 1
+            for release in releases:
+                release(node)
+            if not node.is_dir and self._owns(node):
+                self.blobs.release(node.content)
+        return count
+
+    def _retain(self, node):
+        """Переводит содержимое файлов поддерева на общие блобы"""
+        for child in walk(node):
+            if not child.is_dir:
+                child.content = self.blobs.intern(child.content)
+
+    def _owns(self, node):
+        """Учтено ли содержимое файла в блобах этого дерева"""
+        return True
+
+    def create_directory(self, current, dir_path):
         """Создает директорию в памяти VFS"""
-        parent_node = self._get_node_at_path(current_path)
-        if not parent_node or parent_node['type'] != 'directory':
+        parent_node = self.root if dir_path.startswith('/') else self._base_node(current)
+        if not parent_node or not parent_node.is_dir:
             return False
 
         path_parts = self._split_path(dir_path)
@@ -124,25 +674,12 @@ class VirtualFileSystem:
             return False
 
         # Создаем все промежуточные директории
-        current = parent_node
-        for part in path_parts:
-            if part not in current['content']:
-                current['content'][part] = {
-                    'type': 'directory',
-                    'content': {},
-                    'parent': current,
-                    'permissions': '755'
-                }
-            elif current['content'][part]['type'] != 'directory':
-                return False
-            current = current['content'][part]
-
-        return True
+        return self._make_parents(parent_node, path_parts) is not None
 
-    def create_file(self, current_path, file_path):
+    def create_file(self, current, file_path):
         """Создает файл в памяти VFS"""
-        parent_node = self._get_node_at_path(current_path)
-        if not parent_node or parent_node['type'] != 'directory':
+        parent_node = self.root if file_path.startswith('/') else self._base_node(current)
+        if not parent_node or not parent_node.is_dir:
             return False
 
         path_parts = self._split_path(file_path)
@@ -153,59 +690,155 @@ class VirtualFileSystem:
         parent_parts = path_parts[:-1]
 
         # Переходим к родительской директории
-        current = parent_node
-        for part in parent_parts:
-            if part not in current['content']:
-                current['content'][part] = {
-                    'type': 'directory',
-                    'content': {},
-                    'parent': current,
-                    'permissions': '755'
-                }
-            elif current['content'][part]['type'] != 'directory':
-                return False
-            current = current['content'][part]
+        current = self._make_parents(parent_node, parent_parts)
+        if current is None:
+            return False
 
         # Создаем файл
-        if filename not in current['content']:
-            current['content'][filename] = {
-                'type': 'file',
-                'content': '',
-                'parent': current,
-                'permissions': '644'
-            }
+        if current.get_child(filename) is None:
+            self._attach(current, FileNode(sys.intern(filename)))
 
         return True
 
-    def remove_directory(self, current_path, dir_path):
+    def write_file(self, current, file_path, lines, append=False):
+        """Записывает строки в файл, создавая его; с append дописывает в конец.
+        Строки разделяются переводом строки, как их выводит cat"""
+        if not self.create_file(current, file_path):
+            return False
+        node = self.resolve_path(current, file_path)
+        if node is None or node.is_dir:
+            return False
+
+        # Строки кодируются по одной прямо в куски: весь текст целиком не собирается
+        writer = self._appender(node) if append else ChunkWriter()
+        kept = len(writer.chunks)
+        separator = b'\n' if any(writer.chunks) else b''
+        for line in lines:
+            writer.write(separator + line.encode('utf-8', 'surrogateescape'))
+            separator = b'\n'
+        content = writer.close()
+        self._write(node, content, content.chunks[kept:] if append else None)
+        return True
+
+    def _appender(self, node):
+        """ChunkWriter, начатый с кусков файла node: записанное ляжет после них"""
+        writer = ChunkWriter()
+        writer.chunks.extend(chunk if isinstance(chunk, bytes) else bytes(chunk) for chunk in self.read_chunks(node))
+        return writer
+
+    def _write(self, node, content, appended=None):
+        """Заменяет содержимое файла (ChunkedContent) и оповещает наблюдателей.
+        appended - куски, дописанные в конец прежнего содержимого, если это >>"""
+        self._collect(GC_BATCH)
+        old_content = node.content
+        if self._owns(node):
+            self.blobs.release(old_content)
+        node.content = self.blobs.intern(content)
+        for listener in self.listeners:
+            if appended is None:
+                listener.on_write(node, old_content)
+            else:
+                listener.on_append(node, old_content, appended)
+
+    def remove_directory(self, current, dir_path):
         """Удаляет пустую директорию"""
-        target_node = self.resolve_path(current_path, dir_path)
+        target_node = self.resolve_path(current, dir_path)
         if not target_node:
             return False
 
-        if target_node['type'] != 'directory':
+        if not target_node.is_dir:
             return False
 
         # Проверяем что директория пуста
-        if target_node['content']:
+        if target_node.children:
             return False
 
         # Удаляем из родительской директории
-        parent = target_node.get('parent')
+        parent = target_node.parent
         if not parent:
             return False  # Нельзя удалить корневую директорию
 
-        # Находим имя директории в родительском содержимом
-        for name, node in parent['content'].items():
-            if node is target_node:
-                del parent['content'][name]
-                return True
+        self._detach(target_node)
+        return True
+
+    def remove(self, current, target_path, recursive=False):
+        """Удаляет файл, а с recursive - и директорию вместе с поддеревом"""
+        node = self.resolve_path(current, target_path)
+        if node is None or node.parent is None:
+            return False
+        if node.is_dir and not recursive:
+            return False
+        self._detach(node)
+        return True
+
+    def _destination(self, current, node, target_path):
+        """(директория, имя) для mv/cp узла node в target_path: внутрь существующей
+        директории или под новым именем. None, если путь некорректен"""
+        target = self.resolve_path(current, target_path)
+        if target is not None and target.is_dir:
+            return target, node.name
+
+        parent_path, _, name = target_path.rstrip('/').rpartition('/')
+        if not parent_path:
+            parent_path = '/' if target_path.startswith('/') else '.'
+        parent = self.resolve_path(current, parent_path)
+        if parent is None or not parent.is_dir or name in ('', '.', '..'):
+            return None
+        return parent, name
+
+    def _make_room(self, parent, name, node):
+        """Освобождает имя name в parent для node: файл заменяется, директория - нет"""
+        existing = parent.get_child(name)
+        if existing is None:
+            return True
+        if existing.is_dir or node.is_dir:
+            return False
+        self._detach(existing)
+        return True
+
+    def move(self, current, source_path, target_path):
+        """Переносит или переименовывает узел; поддерево переносится за O(1)"""
+        node = self.resolve_path(current, source_path)
+        if node is None or node.parent is None:
+            return False
+        destination = self._destination(current, node, target_path)
+        if destination is None:
+            return False
+        parent, name = destination
+        # Директорию нельзя перенести внутрь нее самой
+        if is_under(parent, node):
+            return False
+        if parent.get_child(name) is node:
+            return True
+        if not self._make_room(parent, name, node):
+            return False
+        self._move(node, parent, name)
+        return True
 
-        return False
+    def copy(self, current, source_path, target_path, recursive=False):
+        """Копирует файл, а с recursive - и директорию. Содержимое файлов копии
+        разделяется с оригиналом до первой записи в любой из них"""
+        node = self.resolve_path(current, source_path)
+        if node is None or (node.is_dir and not recursive):
+            return False
+        destination = self._destination(current, node, target_path)
+        if destination is None:
+            return False
+        parent, name = destination
+        if node.is_dir and is_under(parent, node):
+            return False
+        if parent.get_child(name) is node:
+            return False
+        if not self._make_room(parent, name, node):
+            return False
+        copy = copy_tree(node)
+        copy.name = sys.intern(name)
+        self._attach(parent, copy)
+        return True
 
-    def change_permissions(self, current_path, target_path, mode):
-        """Изменяет права доступа файла/директории"""
-        target_node = self.resolve_path(current_path, target_path)
+    def change_permissions(self, current, target_path, mode, recursive=False):
+        """Изменяет права доступа файла/директории (с recursive - всего поддерева)"""
+        target_node = self.resolve_path(current, target_path)
         if not target_node:
             return False
 
@@ -213,16 +846,36 @@ class VirtualFileSystem:
         if not self._is_valid_permissions(mode):
             return False
 
-        target_node['permissions'] = mode
+        # Кэш путей не сбрасывается: права не влияют на разрешение путей,
+        # а записи кэша ссылаются на сами узлы
+        if recursive:
+            self._chmod_tree(target_node, int(mode, 8))
+        else:
+            self._chmod(target_node, int(mode, 8))
         return True
 
+    def _chmod(self, node, permissions):
+        """Меняет права узла и оповещает наблюдателей"""
+        old_permissions = node.permissions
+        node.permissions = permissions
+        for listener in self.listeners:
+            listener.on_chmod(node, old_permissions)
+
+    def _chmod_tree(self, node, permissions):
+        """Задает права всему поддереву. Узлы берутся диапазоном строк таблицы
+        метаданных, если ее уже построил find, иначе обходом поддерева: таблица
+        всего дерева ради одного поддерева не строится (в слое сеанса она
+        держала бы обертки всех узлов образа). Наблюдатели получают одно
+        событие на поддерево"""
+        table = self.meta_table
+        nodes = table.subtree(node) if table is not None else list(walk(node))
+        old_permissions = array('H')
+        for child in nodes:
+            old_permissions.append(child.permissions)
+            child.permissions = permissions
+        for listener in self.listeners:
+            listener.on_chmod_tree(node, nodes, old_permissions)
+
     def _is_valid_permissions(self, mode):
         """Проверяет корректность формата прав доступа"""
-        if len(mode) != 3:
-            return False
-
-        for char in mode:
-            if not char.isdigit() or int(char) > 7:
-                return False
-
-        return True
+        return parse_permissions(mode) is not None
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Задержка дополнения по Tab в огромной директории
+
+Директория из N файлов; для случайных префиксов сравнивается дополнение
+по отсортированному индексу с перебором всех имен, в том числе после
+touch/rmdir и в слое сеанса.
+
+Запуск: python benchmarks/bench_completion.py [файлов] [запросов]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from OutputSink import CaptureSink
+from ShellCompleter import Completer
+from ShellEmulator import ShellEmulator
+from VfsOverlay import OverlayFileSystem
+from VirtualFileSystem import VirtualFileSystem
+
+
+def write_image(path, files):
+    children = {f"file{i:07d}.txt": {"type": "file", "content": ""} for i in range(files)}
+    children["sub"] = {"type": "directory", "content": {}}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"type": "directory", "content": {"big": {"type": "directory", "content": children}}}, f)
+
+
+def brute(vfs, text, limit):
+    """Дополнение перебором имен директории"""
+    directory_part, _, prefix = text.rpartition('/')
+    directory = vfs.resolve_path('/', directory_part or '/')
+    names = sorted(name for name in directory.children if name.startswith(prefix))[:limit]
+    return [f"{directory_part}/{name}{'/' if directory.children[name].is_dir else ''}" for name in names]
+
+
+def measure(completer, vfs, prefixes):
+    samples = []
+    for text in prefixes:
+        start = time.perf_counter()
+        found = completer.matches('cat ', text)
+        samples.append(time.perf_counter() - start)
+        assert found == brute(vfs, text, completer.limit), text
+    samples.sort()
+    return sum(samples) / len(samples) * 1e3, samples[int(len(samples) * 0.99)] * 1e3
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'big.json')
+        write_image(path, files)
+        vfs = VirtualFileSystem(path)
+        shell = ShellEmulator(path, vfs=vfs, output=CaptureSink())
+        completer = Completer(shell)
+
+        start = time.perf_counter()
+        completer.matches('ls ', '/big/x')
+        print(f"Файлов: {files}; первое дополнение (строит индекс) {(time.perf_counter() - start) * 1e3:.1f} мс")
+
+        prefixes = [f"/big/file{rng.randrange(files):07d}"[:rng.randint(10, 17)] for _ in range(count)]
+        mean, p99 = measure(completer, vfs, prefixes)
+        print(f"Путь: среднее {mean:.3f} мс, p99 {p99:.3f} мс")
+        assert completer.matches('', 'gr') == ['grep'] and completer.matches('cat x |', 'he') == ['head']
+
+        # Изменения VFS сразу видны дополнению
+        shell.execute_line('touch /big/file_new.txt')
+        shell.execute_line('mkdir /big/file_dir')
+        shell.execute_line('rmdir /big/sub')
+        assert completer.matches('cat ', '/big/file_') == ['/big/file_dir/', '/big/file_new.txt']
+        assert completer.matches('cd ', '/big/su') == []
+
+        overlay = OverlayFileSystem(vfs)
+        session = ShellEmulator(path, vfs=overlay, output=CaptureSink())
+        session.execute_line('touch /big/file0000000a')
+        session.execute_line('rmdir /big/file_dir')
+        session_completer = Completer(session)
+        mean, p99 = measure(session_completer, overlay, prefixes[:100] + ['/big/file0000000', '/big/file_'])
+        print(f"Слой сеанса: среднее {mean:.3f} мс, p99 {p99:.3f} мс")
+        print("Дополнение совпадает с перебором: OK")
+
+
+if __name__ == "__main__":
+    main()
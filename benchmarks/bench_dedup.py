@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Дедупликация содержимого: память при загрузке и проверки счетчиков ссылок
+
+Строит образ, где файлы повторяют несколько десятков вариантов содержимого
+(текст и base64), сравнивает память дерева с дедупликацией и без нее,
+выводит blob_stats() и размер снимка. Затем удаляет, переписывает и
+сливает файлы и после каждого шага сверяет счетчики ссылок хранилища
+с реальным числом файлов в дереве.
+
+Запуск: python benchmarks/bench_dedup.py [файлов] [вариантов]
+"""
+
+import base64
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from VfsContent import BlobStore
+from VfsLoader import VfsLoader
+from VfsNode import walk
+from VfsOverlay import OverlayFileSystem
+from VirtualFileSystem import VirtualFileSystem
+
+
+def write_image(path, files, variants, rng):
+    """Директории по 100 файлов; содержимое выбирается из variants вариантов"""
+    texts = [f"variant {i}\n" + 'x' * rng.randrange(500, 4000) for i in range(variants)]
+    dirs = {}
+    for i in range(files):
+        text = texts[rng.randrange(variants)]
+        if i % 2:
+            entry = {"type": "file", "content_b64": base64.b64encode(text.encode('utf-8')).decode('ascii')}
+        else:
+            entry = {"type": "file", "content": text}
+        dirs.setdefault(f"dir{i // 100}", {"type": "directory", "content": {}})["content"][f"f{i}.txt"] = entry
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"type": "directory", "content": dirs}, f)
+
+
+def tree_memory(load):
+    """Память, которую занимает дерево, построенное load()"""
+    gc.collect()
+    tracemalloc.start()
+    root = load()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del root
+    return used
+
+
+def check_refcounts(vfs):
+    """Счетчик каждого блоба равен числу файлов дерева, ссылающихся на него"""
+    # blob_stats() сначала отпускает блобы удаленных поддеревьев
+    stats = vfs.blob_stats()
+    counts = Counter()
+    contents = {}
+    for node in walk(vfs.root):
+        if not node.is_dir and not isinstance(node.content, memoryview):
+            counts[id(node.content)] += 1
+            contents[id(node.content)] = node.content
+    for key, expected in counts.items():
+        actual = vfs.blobs.refcount(contents[key])
+        assert actual == expected, f"refcount {actual}, файлов {expected}"
+    assert stats['references'] == sum(counts.values()), stats
+    assert stats['blobs'] == len(counts), stats
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    variants = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'dedup.json')
+        write_image(path, files, variants, rng)
+
+        def load(blobs=None):
+            with open(path, 'r', encoding='utf-8') as f:
+                return VfsLoader(f, blobs=blobs).load()
+
+        plain = tree_memory(load)
+        vfs = VirtualFileSystem(path)
+        deduped = tree_memory(lambda: load(BlobStore()))
+        stats = vfs.blob_stats()
+        print(f"Файлов: {files}, вариантов: {variants}")
+        print(f"Память дерева: без дедупликации {plain / 2 ** 20:.1f} МБ, "
+              f"с дедупликацией {deduped / 2 ** 20:.1f} МБ")
+        print(f"Блобов {stats['blobs']}, ссылок {stats['references']}, "
+              f"dedup_ratio {stats['dedup_ratio']:.1f}, сэкономлено {stats['bytes_saved'] / 2 ** 20:.1f} МБ")
+
+        snapshot = os.path.join(tmp, 'dedup.vfs')
+        vfs.save_snapshot(snapshot)
+        print(f"Снимок: {os.path.getsize(snapshot) / 2 ** 20:.2f} МБ "
+              f"при {stats['logical_bytes'] / 2 ** 20:.1f} МБ содержимого")
+        check_refcounts(VirtualFileSystem(snapshot))
+
+        root = vfs.root
+        check_refcounts(vfs)
+        vfs._detach(vfs.resolve_path(root, '/dir0/f0.txt'))
+        vfs._detach(vfs.resolve_path(root, '/dir1'))
+        check_refcounts(vfs)
+
+        vfs.write_file(root, '/dir2/f200.txt', ['variant 0'])
+        vfs.write_file(root, '/dir2/f201.txt', ['variant 0'])
+        vfs.write_file(root, '/dir2/f202.txt', ['more'], append=True)
+        vfs.create_file(root, '/dir2/empty.txt')
+        assert vfs.resolve_path(root, '/dir2/f200.txt').content is vfs.resolve_path(root, '/dir2/f201.txt').content
+        check_refcounts(vfs)
+
+        # Удаление всех копий забывает блоб
+        content = vfs.resolve_path(root, '/dir2/f200.txt').content
+        vfs._detach(vfs.resolve_path(root, '/dir2/f200.txt'))
+        vfs._detach(vfs.resolve_path(root, '/dir2/f201.txt'))
+        vfs.blob_stats()
+        assert vfs.blobs.refcount(content) == 0
+        check_refcounts(vfs)
+
+        # Слой сеанса: его блобы отдельные, базовые счетчики меняет только merge
+        overlay = OverlayFileSystem(vfs)
+        overlay.write_file(overlay.root, '/dir3/f300.txt', ['session'])
+        overlay.create_file(overlay.root, '/dir3/new.txt')
+        overlay._detach(overlay.resolve_path(overlay.root, '/dir3/f301.txt'))
+        check_refcounts(vfs)
+        overlay.merge()
+        check_refcounts(vfs)
+        assert overlay.blob_stats()['blobs'] == 0
+
+        # discard отпускает блобы слоя: память сеанса не копится между сбросами
+        for _ in range(3):
+            overlay.write_file(overlay.root, '/dir3/f302.txt', ['a' * 1000])
+            overlay.write_file(overlay.root, '/dir3/session.txt', ['b' * 1000])
+            assert overlay.blob_stats()['blobs'] == 2
+            overlay.discard()
+            stats = overlay.blob_stats()
+            assert stats['blobs'] == stats['references'] == 0, stats
+        check_refcounts(vfs)
+        print("Счетчики ссылок после удалений, записей, слияния и сброса слоя: OK")
+
+
+if __name__ == "__main__":
+    main()
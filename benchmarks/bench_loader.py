@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Проверка и замер потокового загрузчика VFS
+
+Строит два синтетических образа - цепочку из 10k вложенных директорий
+и широкое дерево на 1M узлов - грузит их через VirtualFileSystem и
+сравнивает время и пиковую память с json.load.
+
+Запуск: python benchmarks/bench_loader.py [глубина] [узлов_в_ширину]
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from VirtualFileSystem import VirtualFileSystem
+from VfsLoader import VfsLoader
+
+
+def write_chain(path, depth):
+    """Цепочка d0/d1/.../d{depth-1}/leaf.txt"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(depth):
+            f.write('{"type": "directory", "content": {"d%d": ' % i)
+        f.write('{"type": "directory", "content": {"leaf.txt": {"type": "file", "content": "end"}}}')
+        f.write('}}' * depth)
+
+
+def write_wide(path, total, per_dir=1000):
+    """Корень с total/per_dir директориями по per_dir файлов"""
+    dirs = max(1, total // (per_dir + 1))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"type": "directory", "content": {')
+        for d in range(dirs):
+            if d:
+                f.write(', ')
+            f.write('"dir%d": {"type": "directory", "permissions": "750", "content": {' % d)
+            f.write(', '.join('"f%d.txt": {"type": "file", "content_b64": "aGVsbG8="}' % i
+                              for i in range(per_dir)))
+            f.write('}}')
+        f.write('}}')
+    return dirs * (per_dir + 1) + 1
+
+
+def count_nodes(root):
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if node.is_dir:
+            stack.extend(node.children.values())
+    return count
+
+
+def measure(func):
+    """Время без трассировки и пиковая память отдельным прогоном под tracemalloc"""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def check_chunk_boundaries():
+    """Разбор с крошечным куском должен совпадать с json.load"""
+    data = {"type": "directory", "permissions": "711", "content": {
+        "a \"quoted\" name": {"type": "file", "content": "строка\nс \\u экранированием é"},
+        "b": {"type": "file", "content_b64": "aGVsbG8=", "permissions": 600, "extra": [1.5, {"x": None}]},
+        "c": {"content": {"d": {"type": "file", "content": ""}}, "type": "directory"},
+    }}
+    text = json.dumps(data)
+    for chunk in (1, 2, 3, 7, 64):
+        root = VfsLoader(io.StringIO(text), chunk_size=chunk).load()
+        assert root.permissions == 0o711
+        a = root.children['a "quoted" name']
+        assert a.content == data['content']['a "quoted" name']['content'] and a.parent is root
+        assert root.children['b'].content == b'aGVsbG8=' and root.children['b'].permissions == 0o600
+        assert root.children['c'].children['d'].parent is root.children['c']
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    wide = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+
+    check_chunk_boundaries()
+    print("Разбор на границах кусков: OK")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        chain_path = os.path.join(tmp, 'chain.json')
+        write_chain(chain_path, depth)
+        vfs, elapsed, peak = measure(lambda: VirtualFileSystem(chain_path))
+        node = vfs.resolve_path('/', '/'.join(f"d{i}" for i in range(depth)) + '/leaf.txt')
+        assert node is not None and vfs.read_content(node) == 'end'
+        print(f"Цепочка глубины {depth}: {elapsed:.2f} с, пик {peak / 2 ** 20:.1f} МБ")
+        del vfs, node
+
+        wide_path = os.path.join(tmp, 'wide.json')
+        expected = write_wide(wide_path, wide)
+        size = os.path.getsize(wide_path)
+        vfs, elapsed, peak = measure(lambda: VirtualFileSystem(wide_path))
+        assert count_nodes(vfs.root) == expected
+        assert vfs.get_file_content('/', 'dir0/f0.txt') == 'hello'
+        print(f"Широкое дерево {expected} узлов ({size / 2 ** 20:.0f} МБ json): "
+              f"{elapsed:.2f} с, пик {peak / 2 ** 20:.0f} МБ")
+        del vfs
+
+        def json_load():
+            with open(wide_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        _, elapsed, peak = measure(json_load)
+        print(f"Для сравнения только json.load: {elapsed:.2f} с, пик {peak / 2 ** 20:.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Сравнение памяти: старые узлы-словари против узлов со __slots__
+
+Запуск: python benchmarks/bench_memory.py [количество_узлов]
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from VirtualFileSystem import DirectoryNode, FileNode
+
+
+FAN_OUT = 10
+FILES_PER_DIR = 40
+
+
+def build_dict_tree(total):
+    """Дерево в старом формате: словарь на каждый узел"""
+    root = {'type': 'directory', 'content': {}, 'parent': None, 'permissions': '755'}
+    queue = deque([root])
+    count = 1
+    while queue and count < total:
+        node = queue.popleft()
+        for i in range(FILES_PER_DIR):
+            if count >= total:
+                break
+            node['content'][f"file{i}.txt"] = {'type': 'file', 'content': '', 'parent': node,
+                                               'permissions': '644'}
+            count += 1
+        for i in range(FAN_OUT):
+            if count >= total:
+                break
+            child = {'type': 'directory', 'content': {}, 'parent': node, 'permissions': '755'}
+            node['content'][f"dir{i}"] = child
+            queue.append(child)
+            count += 1
+    return root
+
+
+def build_slotted_tree(total):
+    """То же дерево из узлов FileNode/DirectoryNode"""
+    root = DirectoryNode('')
+    queue = deque([root])
+    count = 1
+    while queue and count < total:
+        node = queue.popleft()
+        for i in range(FILES_PER_DIR):
+            if count >= total:
+                break
+            node.add_child(FileNode(sys.intern(f"file{i}.txt")))
+            count += 1
+        for i in range(FAN_OUT):
+            if count >= total:
+                break
+            child = DirectoryNode(sys.intern(f"dir{i}"))
+            node.add_child(child)
+            queue.append(child)
+            count += 1
+    return root
+
+
+def measure(builder, total):
+    """Возвращает объем памяти (в байтах), занятый построенным деревом"""
+    gc.collect()
+    tracemalloc.start()
+    tree = builder(total)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tree
+    gc.collect()
+    return size
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    old = measure(build_dict_tree, total)
+    new = measure(build_slotted_tree, total)
+    print(f"Узлов: {total}")
+    print(f"Словари:  {old / 2 ** 20:8.1f} МБ ({old / total:.0f} байт/узел)")
+    print(f"__slots__: {new / 2 ** 20:8.1f} МБ ({new / total:.0f} байт/узел)")
+    print(f"Экономия: {(1 - new / old) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
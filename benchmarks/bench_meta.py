@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""chmod -R и find -type/-perm по таблице метаданных против обхода узлов
+
+Строит синтетический образ, сравнивает chmod -R поддерева с поузловым
+change_permissions и find -perm/-type по таблице с отбором полным обходом.
+Затем меняет дерево (chmod, rm, mv, cp, запись) и сверяет таблицу с узлами,
+проверяет повтор chmod -R из журнала и chmod -R в слое сеанса.
+
+Запуск: python benchmarks/bench_meta.py [глубина] [ветвление] [файлов]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import VfsIndex
+from generate_vfs import generate
+from VfsNode import walk
+from VfsOverlay import OverlayFileSystem
+from VirtualFileSystem import VirtualFileSystem
+
+
+def brute_select(vfs, start, kind=None, perm=None, maxdepth=None):
+    """Пути узлов поддерева start под условия find полным обходом"""
+    test = VfsIndex.permission_test(perm) if perm is not None else None
+    base = vfs.get_path(start).rstrip('/').count('/')
+    found = []
+    for node in walk(start):
+        path = vfs.get_path(node)
+        depth = path.rstrip('/').count('/') - base
+        if kind is not None and (kind == 'd') != node.is_dir:
+            continue
+        if test is not None and not test(node.permissions):
+            continue
+        if maxdepth is not None and depth > maxdepth:
+            continue
+        found.append(path)
+    return sorted(found)
+
+
+def check(vfs, start):
+    for kind, perm, maxdepth in ((None, '-002', None), ('f', '/022', None), ('d', '700', None),
+                                 ('d', None, 2), (None, '644', 1), ('f', None, None)):
+        found = [path for path, _ in VfsIndex.find(vfs, start, kind=kind, perm=perm, maxdepth=maxdepth)]
+        assert found == brute_select(vfs, start, kind, perm, maxdepth), (kind, perm, maxdepth)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    fanout = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tree.json')
+        nodes = generate(path, depth=depth, fanout=fanout, files=files)
+        vfs = VirtualFileSystem(path)
+        root = vfs.root
+
+        build, _ = timed(vfs.get_meta_table)
+        print(f"Узлов: {nodes}; построение таблицы {build:.2f} с")
+
+        # chmod -R: поузловой обход против диапазона строк таблицы
+        paths = [vfs.get_path(node) for node in walk(vfs.resolve_path(root, '/d1'))]
+        per_node, _ = timed(lambda: [vfs.change_permissions(root, p, '750') for p in paths])
+        recursive, ok = timed(lambda: vfs.change_permissions(root, '/d1', '777', recursive=True))
+        assert ok
+        print(f"chmod 777 на {len(paths)} узлов: по узлу {per_node:.2f} с, chmod -R {recursive:.3f} с")
+
+        # find -perm: таблица против обхода
+        vfs.change_permissions(root, '/d2/d3', '700', recursive=True)
+        vfs.change_permissions(root, '/d4/f1.txt', '666')
+        table, found = timed(lambda: VfsIndex.find(vfs, root, perm='-002'))
+        brute, expected = timed(lambda: brute_select(vfs, root, perm='-002'))
+        assert [p for p, _ in found] == expected
+        print(f"find / -perm -002 ({len(found)} узлов): таблица {table:.3f} с, обход {brute:.2f} с")
+        table, found = timed(lambda: VfsIndex.find(vfs, root, kind='d', perm='700'))
+        assert [p for p, _ in found] == brute_select(vfs, root, 'd', '700')
+        print(f"find / -type d -perm 700 ({len(found)} узлов): таблица {table:.3f} с")
+
+        # Таблица согласована с узлами после изменений дерева
+        vfs.change_permissions(root, '/d3/f0.txt', '600')
+        vfs.remove(root, '/d1/d0', recursive=True)
+        check(vfs, root)
+        vfs.move(root, '/d2/d3', '/moved')
+        vfs.copy(root, '/moved', '/d0/copy', recursive=True)
+        vfs.write_file(root, '/d0/copy/f0.txt', ['changed'])
+        vfs.change_permissions(root, '/d0/copy', '755', recursive=True)
+        check(vfs, root)
+        check(vfs, vfs.resolve_path(root, '/moved'))
+        print("find -type/-perm/-maxdepth совпадает с обходом после изменений: OK")
+
+        # После mkdir таблица устарела: chmod -R маленького поддерева обходит
+        # его, а не перестраивает таблицу всего дерева
+        leaf = f"/d{fanout - 1}" + '/d0' * (depth - 1)
+        vfs.create_directory(root, '/fresh')
+        seconds, ok = timed(lambda: vfs.change_permissions(root, leaf, '700', recursive=True))
+        assert ok and vfs.meta_table.stale
+        check(vfs, vfs.resolve_path(root, leaf))
+        print(f"chmod -R {leaf} ({files + 1} узлов) после mkdir: {seconds * 1e3:.2f} мс "
+              f"(построение таблицы {build:.2f} с)")
+        # Обходы всего дерева окупают перестройку
+        check(vfs, root)
+        assert not vfs.meta_table.stale
+        print("Устаревшая таблица перестраивается после обходов: OK")
+
+        # chmod -R в слое сеанса без find не строит таблицу всего образа:
+        # память слоя растет с изменениями, а не с размером образа
+        session = OverlayFileSystem(vfs)
+        seconds, ok = timed(lambda: session.change_permissions(session.root, leaf, '750', recursive=True))
+        assert ok and session.meta_table is None
+        assert all(node.permissions == 0o750 for node in walk(session.resolve_path(session.root, leaf)))
+        assert vfs.resolve_path(root, leaf).permissions == 0o700
+        check(session, session.resolve_path(session.root, leaf))
+        print(f"chmod -R {leaf} в слое сеанса: {seconds * 1e3:.2f} мс, без таблицы всего образа: OK")
+
+        # chmod -R пишется в журнал одной записью и повторяется при загрузке
+        small = os.path.join(tmp, 'small.json')
+        generate(small, depth=2, fanout=3, files=2)
+        persistent = VirtualFileSystem(small, journal=True)
+        persistent.change_permissions(persistent.root, '/d1', '700', recursive=True)
+        persistent.change_permissions(persistent.root, '/d1/f0.txt', '640')
+        assert persistent.meta_table is None
+        expected = sorted((persistent.get_path(node), node.permissions) for node in walk(persistent.root))
+        persistent.close()
+        replayed = VirtualFileSystem(small)
+        assert sorted((replayed.get_path(node), node.permissions) for node in walk(replayed.root)) == expected
+        print("Журнал повторяет chmod -R: OK")
+
+        # chmod -R в слое сеанса не меняет базу до слияния
+        overlay = OverlayFileSystem(replayed)
+        overlay.change_permissions(overlay.root, '/d2', '711', recursive=True)
+        check(overlay, overlay.root)
+        assert replayed.resolve_path(replayed.root, '/d2/f0.txt').permissions == 0o644
+        overlay.merge()
+        assert replayed.resolve_path(replayed.root, '/d2/f0.txt').permissions == 0o711
+        check(replayed, replayed.root)
+        print("chmod -R в слое сеанса и слияние: OK")
+
+
+if __name__ == "__main__":
+    main()
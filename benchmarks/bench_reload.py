@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""reload: применение изменений нового образа против полной загрузки
+
+Генерирует образ, меняет в его копии несколько узлов и записывает ее на
+место исходного. Сравнивает reload живого дерева с загрузкой образа с нуля,
+по отдельности показывая разбор нового образа, его хэши и применение
+изменений. Затем сверяет дерево, индексы и счетчики блобов с обходом,
+проверяет, что сохраняется текущая директория, что изменения сеанса из
+журнала переживают reload и что --watch замечает новый образ.
+
+Запуск: python benchmarks/bench_reload.py [глубина] [ветвление] [файлов]
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import VfsIndex
+from bench_dedup import check_refcounts
+from bench_meta import check as check_meta
+from bench_search import brute_find
+from bench_sizes import check as check_sizes
+from bench_tree_ops import state, timed
+from generate_vfs import generate, sibling_dirs
+from OutputSink import CaptureSink
+from ShellEmulator import ShellEmulator
+from VirtualFileSystem import VirtualFileSystem
+
+
+def regenerate(path, changes):
+    """Меняет образ на диске так, как это сделал бы внешний генератор"""
+    upstream = VirtualFileSystem(path)
+    changes(upstream, upstream.root)
+    upstream.save_json(path + '.new')
+    os.replace(path + '.new', path)
+
+
+def with_indexes(vfs):
+    """Строит индексы, которые перезапуск потерял бы, а reload сохраняет"""
+    vfs.get_name_index()
+    vfs.get_size_index()
+    vfs.get_meta_table()
+    vfs.get_content_index()
+    return vfs
+
+
+def upstream_changes(vfs, root, dirs):
+    written, chmodded, grown, removed, replaced = dirs
+    vfs.write_file(root, written + '/f0.txt', ['regenerated'])
+    vfs.change_permissions(root, chmodded + '/f0.txt', '600')
+    vfs.create_directory(root, grown + '/new/deeper')
+    vfs.create_file(root, grown + '/new/deeper/file.txt')
+    vfs.remove(root, removed, recursive=True)
+    vfs.remove(root, replaced + '/f0.txt')
+    vfs.create_directory(root, replaced + '/f0.txt')
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    fanout = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    # Первая директория - текущая в сеансе и записывается в новом образе,
+    # последняя меняется во втором образе и удаляется в третьем
+    dirs = sibling_dirs(6, depth, fanout)
+    cwd, removed, later = dirs[0], dirs[3], dirs[5]
+    # Последний файл директории; при files=0 второй образ его создает, а не меняет
+    later_file = later + f'/f{max(files - 1, 0)}.txt'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tree.json')
+        nodes = generate(path, depth=depth, fanout=fanout, files=files)
+        vfs = VirtualFileSystem(path)
+        shell = ShellEmulator(path, vfs=vfs, output=CaptureSink())
+        shell.execute_line(f'cd {cwd}')
+        shell.out.take()
+        with_indexes(vfs)
+
+        regenerate(path, lambda upstream, root: upstream_changes(upstream, root, dirs[:5]))
+        load, _ = timed(lambda: with_indexes(VirtualFileSystem(path)))
+        first, changes = timed(vfs.reload)
+        print(f"Узлов: {nodes}; загрузка с нуля с построением индексов {load:.2f} с, "
+              f"первый reload {first:.2f} с (хэши живого дерева), изменения {changes}")
+
+        regenerate(path, lambda upstream, root: upstream.write_file(root, later_file, ['again']))
+        # Этапы reload по отдельности: разбор, хэши нового образа, применение отличий
+        parse, image = timed(lambda: VirtualFileSystem(path))
+        hashing, digests = timed(lambda: VfsIndex.tree_digests(image.root))
+        apply, changes = timed(lambda: vfs._apply_image(image.root, digests, vfs.get_digest_index()))
+        print(f"Второй reload: разбор образа {parse:.2f} с, хэши образа {hashing:.2f} с, "
+              f"применение {apply * 1e3:.1f} мс, изменения {changes}")
+        assert changes == ((0, 0, 1) if files else (1, 0, 0))
+        assert vfs.reload() == (0, 0, 0)
+
+        assert state(vfs) == state(VirtualFileSystem(path))
+        assert shell.current_path == cwd
+        check_refcounts(vfs)
+        check_meta(vfs, vfs.root)
+        if depth <= 4:
+            check_sizes(vfs)
+        for pattern in ('new', 'f0.txt', removed.rsplit('/', 1)[1], 'file.txt'):
+            assert [p for p, _ in VfsIndex.find(vfs, vfs.root, pattern)] == brute_find(vfs, vfs.root, pattern)
+        assert [p for p, _ in VfsIndex.grep(vfs, vfs.root, 'regenerated')] == [cwd + '/f0.txt']
+        print("Дерево, индексы и счетчики совпадают с новым образом, текущая директория сохранена: OK")
+
+        # Текущая директория удалена в новом образе - переход домой
+        shell.execute_line(f'cd {later}')
+        shell.out.take()
+        regenerate(path, lambda upstream, root: upstream.remove(root, later, recursive=True))
+        shell.execute_line('reload')
+        assert shell.out.take().startswith("Образ перезагружен: добавлено 0, удалено 1")
+        assert vfs.resolve_path(vfs.root, shell.current_path) is shell.cwd
+        assert vfs.resolve_path(vfs.root, later) is None
+
+        # Изменения сеанса из журнала переживают reload, как и перезапуск
+        small = os.path.join(tmp, 'small.json')
+        generate(small, depth=2, fanout=3, files=2)
+        persistent = VirtualFileSystem(small, journal=True)
+        persistent.write_file(persistent.root, '/d0/f0.txt', ['session'])
+        persistent.create_directory(persistent.root, '/mine')
+        regenerate(small, lambda upstream, root: upstream.remove(root, '/d1', recursive=True))
+        persistent.reload()
+        assert persistent.read_content(persistent.resolve_path(persistent.root, '/d0/f0.txt')) == 'session'
+        assert persistent.resolve_path(persistent.root, '/d1') is None
+        expected = state(persistent)
+        persistent.close()
+        assert state(VirtualFileSystem(small)) == expected
+
+        # Файл из журнала стал директорией в новом образе: запись пропускается
+        persistent = VirtualFileSystem(small, journal=True)
+        persistent.write_file(persistent.root, '/d2/f0.txt', ['session'])
+        persistent.write_file(persistent.root, '/d2/f1.txt', ['more'], append=True)
+        persistent.sync()
+
+        def files_to_dirs(upstream, root):
+            for name in ('f0.txt', 'f1.txt'):
+                upstream.remove(root, '/d2/' + name)
+                upstream.create_directory(root, '/d2/' + name)
+
+        regenerate(small, files_to_dirs)
+        persistent.reload()
+        expected = state(persistent)
+        persistent.close()
+        assert state(VirtualFileSystem(small)) == expected
+        assert all(VirtualFileSystem(small).resolve_path(None, '/d2/' + name).is_dir for name in ('f0.txt', 'f1.txt'))
+        print("Журнал сеанса переживает reload, удаленная текущая директория - переход домой: OK")
+
+        # --watch: образ перечитывается перед следующей командой
+        watched = ShellEmulator(small, vfs=VirtualFileSystem(small), output=CaptureSink(), watch=True)
+        regenerate(small, lambda upstream, root: upstream.create_file(root, '/watched.txt'))
+        watched.poll_image()
+        assert watched.out.take().startswith("Образ перезагружен: добавлено 1")
+        watched.poll_image()
+        assert watched.out.take() == ''
+        print("--watch применяет новый образ: OK")
+
+
+if __name__ == "__main__":
+    main()
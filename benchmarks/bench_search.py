@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""find/grep по индексам против полного обхода дерева
+
+Строит образ с файлами из случайных слов, сверяет результаты
+индексного поиска с обходом и выводит время построения индексов
+и среднее время запроса в обоих вариантах.
+
+Запуск: python benchmarks/bench_search.py [файлов] [запросов]
+"""
+
+import fnmatch
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import VfsIndex
+from OutputSink import CaptureSink
+from ShellEmulator import ShellEmulator
+from VfsNode import walk
+from VirtualFileSystem import VirtualFileSystem
+
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india",
+         "juliet", "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo"]
+
+
+def write_image(path, files, rng):
+    """Директории по 100 файлов; в каждом файле несколько строк случайных слов и
+    редкое слово с номером файла"""
+    dirs = {}
+    for i in range(files):
+        lines = [' '.join(rng.choice(WORDS) for _ in range(8)) for _ in range(4)]
+        lines.append(f"token{i:06d}")
+        content = dirs.setdefault(f"dir{i // 100}", {"type": "directory", "content": {}})["content"]
+        content[f"{rng.choice(WORDS)}_{i}.{rng.choice(['txt', 'log', 'md'])}"] = {
+            "type": "file", "content": '\n'.join(lines)}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"type": "directory", "content": dirs}, f)
+
+
+def brute_find(vfs, start, pattern):
+    return sorted(vfs.get_path(node) for node in walk(start) if fnmatch.fnmatchcase(node.name, pattern))
+
+
+def brute_grep(vfs, start, pattern):
+    regex = re.compile(pattern, re.MULTILINE)
+    matches = []
+    for path, node in sorted((vfs.get_path(node), node) for node in walk(start) if not node.is_dir):
+        matches.extend((path, line) for line in vfs.read_content(node).split('\n') if regex.search(line))
+    return matches
+
+
+def average(func, queries):
+    start = time.perf_counter()
+    results = [func(query) for query in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'search.json')
+        write_image(path, files, rng)
+        vfs = VirtualFileSystem(path)
+        root = vfs.root
+
+        start = time.perf_counter()
+        vfs.get_name_index()
+        name_build = time.perf_counter() - start
+        start = time.perf_counter()
+        vfs.get_content_index().candidates('')
+        content_build = time.perf_counter() - start
+        print(f"Файлов: {files}; построение индекса имен {name_build:.2f} с, "
+              f"индекса триграмм {content_build:.2f} с")
+
+        names = [f"{rng.choice(WORDS)}_{rng.randrange(files)}.*" for _ in range(count)]
+        indexed, found = average(lambda q: [p for p, _ in VfsIndex.find(vfs, root, q)], names)
+        brute, expected = average(lambda q: brute_find(vfs, root, q), names)
+        assert found == expected
+        print(f"find -name: индекс {indexed * 1e3:.3f} мс, обход {brute * 1e3:.2f} мс на запрос")
+
+        tokens = [f"token{rng.randrange(files):06d}" for _ in range(count)]
+        indexed, found = average(lambda q: VfsIndex.grep(vfs, root, q), tokens)
+        brute, expected = average(lambda q: brute_grep(vfs, root, q), tokens)
+        assert found == expected
+        print(f"grep редкого слова: индекс {indexed * 1e3:.3f} мс, обход {brute * 1e3:.2f} мс на запрос")
+
+        # После изменений индексы должны давать те же ответы, что и обход
+        vfs.create_file(root, '/dir0/fresh_file.txt')
+        vfs.write_file(root, '/dir0/fresh_file.txt', ['token000005 rewritten'])
+        vfs.write_file(root, vfs.get_path(next(iter(vfs.get_name_index().match('*_7.*')))), ['no tokens'])
+        vfs._detach(vfs.resolve_path(root, '/dir1'))  # удаление поддерева целиком
+        vfs.create_directory(root, '/new/nested')
+        for pattern in ('fresh*', '*_1.*', 'nested'):
+            assert [p for p, _ in VfsIndex.find(vfs, root, pattern)] == brute_find(vfs, root, pattern)
+        assert VfsIndex.grep(vfs, root, 'token00000[0-9]') == brute_grep(vfs, root, 'token00000[0-9]')
+        print("Индексы после изменений совпадают с обходом: OK")
+
+        # Флаги и другие конструкции '(?' меняют смысл литералов: индекс не должен отсекать файлы
+        vfs.write_file(root, '/new/upper.txt', ['TOKEN000005 UPPER', 'token00000 6'])
+        for pattern in ('(?i)token000005', '(?i:TOKEN)00000[0-9]', '(?x) token 00000 6',
+                        'token(?=000005)', '(?<=TOKEN)000005', '(?#comment)token000005'):
+            found = VfsIndex.grep(vfs, root, pattern)
+            assert found == brute_grep(vfs, root, pattern) and found, pattern
+        print("grep с флагами и (?...) совпадает с обходом: OK")
+
+        # ']' в начале класса и '\]' внутри него не закрывают класс: его члены не литералы
+        vfs.write_file(root, '/new/class.txt', ['zq', 'cq', 'a]b'])
+        for pattern in ('[^]abc]q', r'[\]abc]q', '[]abc]q', r'a[\]x]b', '[^]token]q'):
+            found = VfsIndex.grep(vfs, root, pattern)
+            assert found == brute_grep(vfs, root, pattern) and found, pattern
+        print("grep с ']' и '\\]' внутри класса совпадает с обходом: OK")
+
+        # '|', '>' и '>>' в кавычках или после '\\' - часть слова, а не оператор
+        shell = ShellEmulator(path, vfs=vfs, output=CaptureSink())
+        for line, output in (('echo "|"', '|'),
+                             ("echo 'a > b' > /new/quoted.txt", ''),
+                             ('echo "x >> y" ">" >> /new/quoted.txt', ''),
+                             ('cat /new/quoted.txt | grep ">"', 'a > b\nx >> y >'),
+                             ('echo a\\|b | rev', 'b|a'),
+                             # Как у shlex: в кавычках экранируются только '\\' и '"',
+                             # слова разделяют только пробел, табуляция и переводы строк
+                             ('echo "a\\$b" "c\\"d"', 'a\\$b c"d'),
+                             ('echo a\u00a0b', 'a\u00a0b'),
+                             ('echo hi | nosuch', 'nosuch: команда не найдена')):
+            shell.execute_line(line)
+            assert shell.out.take() == output + '\n' * (2 if output else 1), line
+        assert VfsIndex.grep(vfs, root, '>>') == brute_grep(vfs, root, '>>') == [('/new/quoted.txt', 'x >> y >')]
+        print("Операторы в кавычках - текст, экранирование и разделители как у shlex: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Нагрузочный клиент для сервера сеансов (main.py --serve)
+
+Открывает много одновременных сеансов, в каждом выполняет набор команд
+и выводит число сеансов в секунду и задержки команд (p50/p99). Затем
+проверяет, что транзакции в сеансе на общем образе отклоняются.
+Без --unix/--port сам поднимает сервер в отдельном процессе.
+
+Запуск: python benchmarks/bench_server.py [--sessions N] [--concurrency C]
+        [--commands M] [--unix путь | --port N] [--vfs путь]
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = ["pwd", "ls", "cd documents", "cat file1.txt", "cd ..", "ls /var/log"]
+PROMPT_END = b'$ '
+
+
+async def open_session(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+
+async def run_session(args, latencies):
+    reader, writer = await open_session(args)
+    await reader.readuntil(PROMPT_END)
+    for i in range(args.commands):
+        start = time.perf_counter()
+        writer.write((COMMANDS[i % len(COMMANDS)] + '\n').encode('utf-8'))
+        await writer.drain()
+        await reader.readuntil(PROMPT_END)
+        latencies.append(time.perf_counter() - start)
+    writer.write(b'exit\n')
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+
+async def check_transactions(args):
+    """begin в сеансе отклоняется: журнал отмены общего образа затронул бы другие сеансы"""
+    reader, writer = await open_session(args)
+    await reader.readuntil(PROMPT_END)
+    writer.write(b'begin\nmkdir /in_session\nrollback\nexit\n')
+    await writer.drain()
+    output = (await reader.read()).decode('utf-8')
+    writer.close()
+    assert output.count("Транзакции недоступны в сеансе сервера") == 2, output
+
+
+async def run_load(args):
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited():
+        async with semaphore:
+            await run_session(args, latencies)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(args.sessions)))
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def start_server(args, tmp):
+    args.unix = os.path.join(tmp, 'shell.sock')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py'), '--serve', args.vfs,
+                                '--unix', args.unix], stdout=subprocess.DEVNULL)
+    for _ in range(200):
+        if os.path.exists(args.unix):
+            return process
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("сервер не запустился")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--commands', type=int, default=20)
+    parser.add_argument('--unix')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--vfs', default=os.path.join(ROOT, 'utils', 'vfs_structure.json'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        process = None
+        if args.unix is None and args.port is None:
+            process = start_server(args, tmp)
+        try:
+            elapsed, latencies = asyncio.run(run_load(args))
+            asyncio.run(check_transactions(args))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print(f"Сеансов: {args.sessions} (одновременно до {args.concurrency}), команд в сеансе: {args.commands}")
+    print(f"Сеансов в секунду: {args.sessions / elapsed:.0f}")
+    print(f"Задержка команды: p50 {percentile(latencies, 0.5) * 1000:.2f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} мс")
+    print("Транзакции в сеансе на общем образе отклоняются: OK")
+
+
+if __name__ == "__main__":
+    main()
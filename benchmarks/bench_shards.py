@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Время до первой команды: JSON-образ против шардированного
+
+Для образов растущего размера замеряет загрузку VFS и первую команду
+(ls глубокой директории), сверяет вывод обоих вариантов и показывает,
+сколько шардов пришлось прочитать.
+
+Запуск: python benchmarks/bench_shards.py [максимальная_глубина]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_vfs import generate
+from OutputSink import CaptureSink
+from ShellEmulator import ShellEmulator
+from VirtualFileSystem import VirtualFileSystem
+
+
+def first_command(path):
+    """Секунды от загрузки образа до вывода первой команды, вывод и сама VFS"""
+    start = time.perf_counter()
+    vfs = VirtualFileSystem(path)
+    shell = ShellEmulator(path, vfs=vfs, output=CaptureSink())
+    shell.ls_command(['/d1/d2/d3'])
+    return time.perf_counter() - start, shell.out.take(), vfs
+
+
+def main():
+    max_depth = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for depth in range(3, max_depth + 1):
+            json_path = os.path.join(tmp, f"tree{depth}.json")
+            shards_path = os.path.join(tmp, f"tree{depth}.vfsd")
+            nodes = generate(json_path, depth=depth, fanout=10, files=10)
+            index = VirtualFileSystem(json_path).save_shards(shards_path)
+
+            json_time, expected, _ = first_command(json_path)
+            shards_time, output, vfs = first_command(shards_path)
+            assert output == expected
+            print(f"Узлов {nodes:>9}: JSON {json_time:.3f} с, шарды {shards_time * 1e3:.1f} мс "
+                  f"(прочитано шардов {vfs.shards.loaded} из {index['shards']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""du -s по индексу размеров против обхода дерева
+
+Строит синтетический образ, замеряет построение индекса размеров,
+du -s корня по индексу и подсчет полным обходом, затем меняет дерево
+(touch, mkdir, запись, rmdir, удаление поддерева) и сверяет итоги всех
+директорий с обходом.
+
+Запуск: python benchmarks/bench_sizes.py [глубина] [ветвление] [файлов]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_vfs import generate, sibling_dirs
+from OutputSink import CaptureSink
+from ShellEmulator import ShellEmulator
+from VfsContent import content_size
+from VfsNode import walk
+from VirtualFileSystem import VirtualFileSystem
+
+
+def brute_totals(node):
+    """(байт, файлов, директорий) поддерева полным обходом"""
+    size = files = dirs = 0
+    for child in walk(node):
+        if child is node:
+            continue
+        if child.is_dir:
+            dirs += 1
+        else:
+            files += 1
+            size += content_size(child.content)
+    return size, files, dirs
+
+
+def check(vfs):
+    sizes = vfs.get_size_index()
+    for node in walk(vfs.root):
+        if node.is_dir:
+            assert sizes.get(node) == brute_totals(node), vfs.get_path(node)
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    fanout = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    # Запись в самую глубокую директорию, дописывание, mkdir/rmdir и удаление - в разных поддеревьях
+    changed, appended, created, removed = sibling_dirs(4, depth, fanout)
+    changed += '/d0' * (depth - changed.count('/'))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tree.json')
+        nodes = generate(path, depth=depth, fanout=fanout, files=files)
+        vfs = VirtualFileSystem(path)
+        shell = ShellEmulator(path, vfs=vfs, output=CaptureSink())
+
+        start = time.perf_counter()
+        vfs.get_size_index()
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        shell.du_command(['-s', '/'])
+        du = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = brute_totals(vfs.root)
+        brute = time.perf_counter() - start
+        assert shell.out.take() == f"{expected[0]}\t/\n"
+        print(f"Узлов: {nodes}; построение индекса {build:.2f} с, du -s / {du * 1e6:.0f} мкс, "
+              f"обход {brute:.2f} с")
+
+        # Изменения поднимаются к корню за O(глубины)
+        root = vfs.root
+        start = time.perf_counter()
+        vfs.create_file(root, changed + '/new.txt')
+        vfs.write_file(root, changed + '/new.txt', ['x' * 1000])
+        vfs.write_file(root, changed + '/f0.txt', ['shorter'])
+        vfs.write_file(root, appended + '/f1.txt', ['tail'], append=True)
+        vfs.create_directory(root, created + '/a/b/c')
+        vfs.remove_directory(root, created + '/a/b/c')
+        updates = time.perf_counter() - start
+        vfs._detach(vfs.resolve_path(root, removed))
+        if depth <= 4:
+            check(vfs)
+        else:
+            # Измененные директории и все их предки
+            directories = {'/'}
+            for directory in (changed, appended, created):
+                while directory:
+                    directories.add(directory)
+                    directory = directory.rsplit('/', 1)[0]
+            for directory in sorted(directories):
+                assert vfs.get_size_index().get(vfs.resolve_path(root, directory)) == \
+                    brute_totals(vfs.resolve_path(root, directory)), directory
+        print(f"6 изменений с обновлением индекса: {updates * 1e3:.2f} мс; итоги совпадают с обходом: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Время запуска main.py: JSON-образ против бинарного снимка
+
+Затем проверяет, что снимок открывается без разбора дерева (директории
+читаются при первом обращении) и дает то же дерево, что и JSON.
+
+Запуск: python benchmarks/bench_startup.py [узлов] [повторов]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_loader import write_wide
+from bench_tree_ops import state
+from VirtualFileSystem import VirtualFileSystem
+
+
+def run(vfs_path, script_path, repeats):
+    """Среднее время полного запуска `python main.py <vfs> <script>`"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), vfs_path, script_path],
+                       stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return sum(times) / len(times)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'vfs.json')
+        snapshot_path = os.path.join(tmp, 'vfs.vfsb')
+        script_path = os.path.join(tmp, 'script.txt')
+        nodes = write_wide(json_path, total)
+        with open(script_path, 'w', encoding='utf-8') as f:
+            f.write("cat /dir0/f0.txt\nls /dir1\n")
+
+        subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--snapshot', json_path, snapshot_path],
+                       stdout=subprocess.DEVNULL, check=True)
+
+        json_time = run(json_path, script_path, repeats)
+        snapshot_time = run(snapshot_path, script_path, repeats)
+        print(f"Узлов: {nodes}, повторов: {repeats}")
+        print(f"JSON:   {json_time:.3f} с ({os.path.getsize(json_path) / 2 ** 20:.1f} МБ)")
+        print(f"Снимок: {snapshot_time:.3f} с ({os.path.getsize(snapshot_path) / 2 ** 20:.1f} МБ)")
+        print(f"Ускорение: {json_time / snapshot_time:.1f}x")
+
+        snapshot = VirtualFileSystem(snapshot_path)
+        assert snapshot.snapshot.loaded == 0
+        assert snapshot.read_content(snapshot.resolve_path(snapshot.root, '/dir0/f0.txt')) == 'hello'
+        # Корень и /dir0
+        assert snapshot.snapshot.loaded == 2
+        assert state(snapshot) == state(VirtualFileSystem(json_path))
+        print("Снимок читает только нужные директории и совпадает с JSON: OK")
+
+
+if __name__ == "__main__":
+    main()
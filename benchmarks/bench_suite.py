@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Набор бенчмарков эмулятора на синтетических образах VFS
+
+Замеры: загрузка образа, задержка resolve_path (холодный и теплый кэш),
+ls на широкой директории, cat большого файла (перед ним - проверка
+вывода head/tail и сохранения байт не в UTF-8), mkdir глубокого пути и
+полный прогон скрипта. Результаты пишутся в JSON, чтобы сравнивать
+коммиты между собой: --compare выводит отношение к прошлому файлу.
+
+Запуск: python benchmarks/bench_suite.py [--out results.json] [--compare old.json]
+        [--scale 0.1] [--only load,ls_wide]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_vfs import generate
+from OutputSink import CaptureSink, terminal_bytes
+from ShellEmulator import ShellEmulator
+from VirtualFileSystem import VirtualFileSystem
+
+
+def timed(func, repeats=1):
+    """Лучшее время из repeats запусков func, в секундах"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def latencies(func, args):
+    """Задержки func(arg) по каждому аргументу: среднее и p99 в микросекундах"""
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'mean_us': sum(samples) / len(samples) * 1e6,
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6,
+    }
+
+
+def make_shell(vfs):
+    return ShellEmulator(vfs.vfs_path, vfs=vfs, output=CaptureSink())
+
+
+def bench_load(tmp, scale):
+    path = os.path.join(tmp, 'tree.json')
+    nodes = generate(path, depth=4, fanout=max(2, int(10 * scale ** 0.25)), files=10)
+    return {'nodes': nodes, 'seconds': timed(lambda: VirtualFileSystem(path), 3)}
+
+
+def bench_resolve(tmp, scale):
+    path = os.path.join(tmp, 'tree.json')
+    fanout = max(2, int(10 * scale ** 0.25))
+    generate(path, depth=4, fanout=fanout, files=10)
+    vfs = VirtualFileSystem(path)
+    rng = random.Random(0)
+    targets = ['/' + '/'.join(f"d{rng.randrange(fanout)}" for _ in range(rng.randint(1, 4)))
+               + f"/f{rng.randrange(10)}.txt" for _ in range(int(20_000 * scale) or 1)]
+    root = vfs.root
+
+    cold = latencies(lambda target: vfs.resolve_path(root, target), targets)
+    warm = latencies(lambda target: vfs.resolve_path(root, target), targets)
+    return {'paths': len(targets), 'cold': cold, 'warm': warm}
+
+
+def bench_ls_wide(tmp, scale):
+    path = os.path.join(tmp, 'wide.json')
+    entries = int(100_000 * scale) or 1
+    generate(path, depth=0, fanout=0, files=entries)
+    shell = make_shell(VirtualFileSystem(path))
+
+    def ls():
+        shell.ls_command(['/'])
+        shell.out.take()
+
+    def ls_page():
+        shell.ls_command(['-n', '100', '--offset', str(entries // 2), '/'])
+        shell.out.take()
+
+    return {'entries': entries, 'seconds': timed(ls, 3), 'page_seconds': timed(ls_page, 3)}
+
+
+def check_binary_round_trip(shell):
+    """cat, head и tail с перенаправлением, через конвейер и в вывод сеанса
+    сохраняют байты не в UTF-8 как есть"""
+    vfs = shell.vfs
+    data = b'\xff\xfe binary \xc3\n\x80 tail'
+    vfs.write_file(vfs.root, '/binary.bin', data.decode('utf-8', 'surrogateescape').split('\n'))
+    first, last = data.split(b'\n')
+    for line, copy, expected in (('cat /binary.bin > /copy.bin', '/copy.bin', data),
+                                 ('cat /binary.bin | rev | rev > /piped.bin', '/piped.bin', data),
+                                 ('head -n 1 /binary.bin > /head.bin', '/head.bin', first),
+                                 ('tail -n 1 /binary.bin > /tail.bin', '/tail.bin', last),
+                                 ('tail -n 2 /binary.bin > /tail2.bin', '/tail2.bin', data),
+                                 ('cat /binary.bin | head -n 1 > /piped_head.bin', '/piped_head.bin', first)):
+        shell.execute_line(line)
+        assert b''.join(bytes(chunk) for chunk in vfs.get_file_chunks(vfs.root, copy)) == expected, line
+    shell.out.take()
+    shell.execute_line('cat /binary.bin')
+    assert data in terminal_bytes(shell.out.take())
+
+
+def check_head_tail(shell):
+    """head/tail: перевод строки в конце файла не дает лишней пустой строки"""
+    vfs = shell.vfs
+    vfs.write_file(vfs.root, '/lines.txt', ['l1', 'l2', 'l3', ''])
+    for line, output in (('tail -n 1 /lines.txt', 'l3\n'),
+                         ('tail -n 2 /lines.txt', 'l2\nl3\n'),
+                         ('tail -n 5 /lines.txt', 'l1\nl2\nl3\n'),
+                         ('head -n 5 /lines.txt', 'l1\nl2\nl3\n'),
+                         ('head -n 1 /lines.txt', 'l1\n')):
+        shell.execute_line(line)
+        assert shell.out.take() == output + '\n', line
+
+
+def bench_cat_large(tmp, scale):
+    path = os.path.join(tmp, 'large.json')
+    size = int(16 * 2 ** 20 * scale) or 1
+    generate(path, depth=0, fanout=0, files=1, content_size=size)
+    shell = make_shell(VirtualFileSystem(path))
+    check_binary_round_trip(shell)
+    check_head_tail(shell)
+
+    def cat():
+        shell.cat_command(['/f0.txt'])
+        shell.out.take()
+
+    first = timed(cat)
+    return {'bytes': size, 'first_seconds': first, 'cached_seconds': timed(cat, 3)}
+
+
+def bench_mkdir_deep(tmp, scale):
+    path = os.path.join(tmp, 'empty.json')
+    generate(path, depth=0, fanout=0, files=0)
+    depth = int(1000 * scale) or 1
+    count = int(200 * scale) or 1
+
+    def mkdir():
+        vfs = VirtualFileSystem(path)
+        for i in range(count):
+            if not vfs.create_directory(vfs.root, f"/t{i}/" + '/'.join(f"p{j}" for j in range(depth))):
+                raise RuntimeError("mkdir не удался")
+
+    return {'paths': count, 'depth': depth, 'seconds': timed(mkdir)}
+
+
+def bench_script(tmp, scale):
+    path = os.path.join(tmp, 'tree.json')
+    generate(path, depth=3, fanout=5, files=5)
+    script_path = os.path.join(tmp, 'script.txt')
+    lines = int(50_000 * scale) or 1
+    commands = ['cd /d1/d2', 'ls', 'cat f0.txt', 'pwd', 'cd ..', 'echo hello world',
+                'mkdir new', 'touch new/x.txt', 'rev abc', 'cd /']
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(commands[i % len(commands)] for i in range(lines)) + '\n')
+    vfs = VirtualFileSystem(path)
+
+    def run():
+        shell = ShellEmulator(path, script_path, vfs=vfs, output=CaptureSink())
+        shell.run()
+
+    first = timed(run)
+    return {'lines': lines, 'first_seconds': first, 'cached_seconds': timed(run, 3)}
+
+
+BENCHMARKS = {
+    'load': bench_load,
+    'resolve': bench_resolve,
+    'ls_wide': bench_ls_wide,
+    'cat_large': bench_cat_large,
+    'mkdir_deep': bench_mkdir_deep,
+    'script': bench_script,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(old, new):
+    """Печатает отношение новых замеров времени к старым"""
+    old_flat = flatten(old['results'])
+    for key, value in flatten(new['results']).items():
+        if key in old_flat and ('seconds' in key or key.endswith('_us')) and old_flat[key]:
+            print(f"  {key}: {old_flat[key]:.6g} -> {value:.6g} (x{value / old_flat[key]:.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare')
+    parser.add_argument('--scale', type=float, default=1.0, help="множитель размеров образов")
+    parser.add_argument('--only', help="список замеров через запятую: " + ','.join(BENCHMARKS))
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            results[name] = BENCHMARKS[name](tmp, args.scale)
+            print(f"{name}: {json.dumps(results[name])}")
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'scale': args.scale,
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Результаты записаны в '{args.out}'")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            old = json.load(f)
+        print(f"Сравнение с {old.get('commit')}:")
+        compare(old, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Откат транзакции по журналу отмены против перезагрузки образа
+
+Один и тот же скрипт изменений (mkdir, touch, rmdir, запись, chmod, rm -r
+и mv больших поддеревьев, chmod -R и cp -r поддеревьев постоянного размера)
+выполняется в транзакции на образах разного размера: время отката зависит
+от числа изменений, а не от размера дерева. Затем проверяется, что после
+отката дерево, индексы и счетчики блобов совпадают с исходными, что работают
+вложенные транзакции и точки сохранения, что discard/merge слоя сеанса
+закрывают его транзакцию и что один загруженный образ переиспользуется
+между скриптами с --atomic.
+
+Запуск: python benchmarks/bench_transactions.py [глубина] [ветвление] [файлов]
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import VfsIndex
+from bench_dedup import check_refcounts
+from bench_meta import check as check_meta
+from bench_search import brute_find
+from bench_sizes import check as check_sizes
+from bench_tree_ops import state, timed
+from generate_vfs import generate
+from OutputSink import CaptureSink
+from ShellEmulator import ShellEmulator
+from VfsOverlay import OverlayFileSystem
+from VfsUndo import UndoLog
+from VirtualFileSystem import VirtualFileSystem
+
+
+# {deep} - путь от d4/d5 к директории предпоследнего уровня: ее поддерево одного
+# размера при любой глубине образа
+SCRIPT = """mkdir /work
+touch /work/a.txt
+mkdir /work/empty
+rmdir /work/empty
+echo changed > /d1/f0.txt
+echo more >> /d2/f1.txt
+chmod 600 /d3/f0.txt
+chmod -R 700 /d4{deep}
+rm -r /d0
+mv /d2 /work/moved
+cp -r /d5{deep} /work/copy
+rm -r /work/copy/d0
+"""
+
+
+def script(depth):
+    return SCRIPT.format(deep='/d0' * (depth - 2))
+
+
+def run(vfs, text):
+    shell = ShellEmulator(vfs.vfs_path, vfs=vfs, output=CaptureSink())
+    for line in text.splitlines():
+        shell.execute_line(line)
+    return shell
+
+
+def check_all(vfs):
+    if vfs.transaction_depth() == 0:
+        # В транзакции удаленные поддеревья держат свои блобы до commit
+        check_refcounts(vfs)
+    check_meta(vfs, vfs.root)
+    check_sizes(vfs)
+    for pattern in ('work', 'f0.txt', 'd0', 'moved'):
+        assert [p for p, _ in VfsIndex.find(vfs, vfs.root, pattern)] == brute_find(vfs, vfs.root, pattern)
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    fanout = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Время отката не растет с размером дерева
+        for level in range(max(depth - 2, 2), depth + 1):
+            path = os.path.join(tmp, f'tree{level}.json')
+            nodes = generate(path, depth=level, fanout=fanout, files=files)
+            load, vfs = timed(lambda: VirtualFileSystem(path))
+            vfs.begin()
+            run(vfs, script(level))
+            seconds, undone = timed(vfs.rollback)
+            print(f"Узлов: {nodes}; откат {undone} изменений {seconds * 1e3:.2f} мс, "
+                  f"перезагрузка образа {load:.2f} с")
+
+        # После отката дерево, индексы и счетчики как до транзакции
+        small = os.path.join(tmp, 'small.json')
+        generate(small, depth=3, fanout=fanout, files=files)
+        vfs = VirtualFileSystem(small)
+        for build in (vfs.get_name_index, vfs.get_size_index, vfs.get_meta_table, vfs.get_content_index):
+            build()
+        expected = state(vfs)
+        vfs.begin()
+        run(vfs, script(3))
+        check_all(vfs)
+        vfs.rollback()
+        assert vfs.undo_log is None and state(vfs) == expected
+        check_all(vfs)
+        assert [p for p, _ in VfsIndex.grep(vfs, vfs.root, 'changed')] == []
+        print("После отката дерево, индексы и счетчики блобов совпадают с исходными: OK")
+
+        # Вложенные транзакции и точки сохранения
+        root = vfs.root
+        vfs.begin()
+        vfs.create_directory(root, '/outer')
+        vfs.savepoint('s1')
+        vfs.create_file(root, '/outer/a.txt')
+        vfs.begin()
+        vfs.write_file(root, '/outer/a.txt', ['inner'])
+        vfs.savepoint('s2')
+        vfs.remove(root, '/d1', recursive=True)
+        assert vfs.rollback('s2') == 1 and vfs.transaction_depth() == 2
+        vfs.commit()
+        assert vfs.read_content(vfs.resolve_path(root, '/outer/a.txt')) == 'inner'
+        assert vfs.rollback('s1') == 2
+        assert vfs.resolve_path(root, '/outer/a.txt') is None and vfs.resolve_path(root, '/outer') is not None
+        vfs.commit()
+        assert vfs.transaction_depth() == 0 and vfs.resolve_path(root, '/outer') is not None
+        vfs.remove_directory(root, '/outer')
+        assert state(vfs) == expected
+        print("Вложенные транзакции и точки сохранения: OK")
+
+        # discard и merge слоя сеанса закрывают его транзакцию: журнал отмены
+        # больше не подписан и не записывает следующие изменения
+        for finish in ('discard', 'merge'):
+            overlay = OverlayFileSystem(vfs)
+            overlay.begin()
+            overlay.create_directory(overlay.root, '/session')
+            # Изменения слияния в базе откатываются ее собственной транзакцией
+            vfs.begin()
+            getattr(overlay, finish)()
+            assert overlay.undo_log is None and overlay.transaction_depth() == 0
+            assert not any(isinstance(listener, UndoLog) for listener in overlay.listeners)
+            overlay.create_directory(overlay.root, '/after')
+            assert overlay.resolve_path(overlay.root, '/after') is not None
+            vfs.rollback()
+            assert state(vfs) == expected
+        check_all(vfs)
+        print("discard/merge слоя сеанса в открытой транзакции: OK")
+
+        # Один образ на много скриптов: --atomic откатывает упавший скрипт
+        script_path = os.path.join(tmp, 'failing.txt')
+        with open(script_path, 'w', encoding='utf-8') as f:
+            f.write(script(3) + "begin\nmkdir /inner\ncat /missing.txt\n")
+        runs = 20
+        total = 0
+        for _ in range(runs):
+            shell = ShellEmulator(small, script_path, vfs=vfs, output=CaptureSink(), atomic=True)
+            seconds, _ = timed(lambda: _expect_failure(shell))
+            total += seconds
+            assert vfs.transaction_depth() == 0
+        assert state(vfs) == expected
+        check_all(vfs)
+        print(f"{runs} упавших скриптов с --atomic на одном образе: {total / runs * 1e3:.1f} мс на скрипт, "
+              f"образ не изменился: OK")
+
+
+def _expect_failure(shell):
+    try:
+        shell.run()
+    except RuntimeError:
+        return
+    raise AssertionError("скрипт должен был упасть")
+
+
+if __name__ == "__main__":
+    main()
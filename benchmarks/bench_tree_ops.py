@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""rm -r, mv и cp -r больших поддеревьев
+
+Замеряет время удаления и переноса поддерева (не зависит от его размера)
+и копирования (память растет на узлы, а не на байты содержимого). Затем
+сверяет с полным обходом счетчики блобов, индекс размеров и индекс имен,
+проверяет, что журнал после rm/mv/cp воспроизводит то же дерево, что
+пачка журнала сбрасывается на границе команды, что >> пишет в журнал
+только дописанное и что перенос в слое сеанса корректно вливается в базу.
+
+Запуск: python benchmarks/bench_tree_ops.py [глубина] [ветвление] [файлов]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import VfsIndex
+from bench_dedup import check_refcounts
+from bench_search import brute_find
+from bench_sizes import check as check_sizes
+from generate_vfs import generate, sibling_dirs
+from OutputSink import CaptureSink
+from ShellEmulator import ShellEmulator
+from VfsJournal import BATCH_INTERVAL, aside_path, journal_path, set_aside
+from VfsNode import walk
+from VfsOverlay import OverlayFileSystem
+from VirtualFileSystem import VirtualFileSystem
+
+
+def state(vfs):
+    """Дерево как отсортированный список (путь, права, байты); порядок детей и
+    форма хранения содержимого (текст или base64) не важны"""
+    return sorted((vfs.get_path(node), node.permissions,
+                   None if node.is_dir else b''.join(vfs.read_chunks(node)))
+                  for node in walk(vfs.root))
+
+
+def crash_in_compact(path, replaced):
+    """Оставляет на диске то, что оставил бы сбой в compact: журнал отложен,
+    а образ уже заменен новым (replaced) или еще прежний"""
+    vfs = VirtualFileSystem(path)
+    stamp = vfs.image_stamp()
+    if replaced:
+        with open(journal_path(path), 'rb') as f:
+            journal = f.read()
+        vfs.compact()
+        with open(journal_path(path), 'wb') as f:
+            f.write(journal)
+    set_aside(path, stamp)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    fanout = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    # Переносимое поддерево, место переноса, источник и место копии, перенос в слое сеанса
+    source, target, copy_source, copy_target, overlaid = sibling_dirs(5, depth, fanout)
+    moved = target + '/moved'
+    # Последний файл директории (при files=0 - отсутствующий: mv и rm просто не выполнятся)
+    last_file = f'f{max(files - 1, 0)}.txt'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tree.json')
+        nodes = generate(path, depth=depth, fanout=fanout, files=files, content_size=1024)
+        vfs = VirtualFileSystem(path)
+        root = vfs.root
+        subtree = sum(1 for _ in walk(vfs.resolve_path(root, source)))
+        print(f"Узлов: {nodes}, в поддереве {source}: {subtree}")
+
+        seconds, ok = timed(lambda: vfs.move(root, source, moved))
+        assert ok
+        print(f"mv {source} {moved}: {seconds * 1e6:.0f} мкс")
+
+        tracemalloc.start()
+        seconds, ok = timed(lambda: vfs.copy(root, moved, '/copy', recursive=True))
+        copied = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert ok
+        content = sum(len(b''.join(vfs.read_chunks(node))) for node in walk(vfs.resolve_path(root, '/copy'))
+                      if not node.is_dir)
+        print(f"cp -r: {seconds:.3f} с, память {copied / 2 ** 20:.1f} МБ при {content / 2 ** 20:.1f} МБ содержимого")
+
+        seconds, ok = timed(lambda: vfs.remove(root, '/copy', recursive=True))
+        assert ok
+        print(f"rm -r /copy: {seconds * 1e6:.0f} мкс (блобы отпускаются позже порциями)")
+
+        # Индексы и счетчики после операций совпадают с обходом
+        vfs.get_size_index()
+        vfs.get_name_index()
+        vfs.get_content_index().candidates('')
+        vfs.get_digest_index().digest(root)
+        # Индексы забывают узлы удаленного поддерева порциями позже, а не в rm -r
+        vfs.copy(root, moved, '/copy', recursive=True)
+        vfs.blob_stats()
+        seconds, ok = timed(lambda: vfs.remove(root, '/copy', recursive=True))
+        assert ok
+        print(f"rm -r /copy при построенных индексах: {seconds * 1e6:.0f} мкс")
+        vfs.copy(root, copy_source, copy_target + '/c2', recursive=True)
+        vfs.write_file(root, copy_target + '/c2/f0.txt', ['copy changed'])
+        if files:
+            assert vfs.read_content(vfs.resolve_path(root, copy_source + '/f0.txt')) != 'copy changed'
+        vfs.move(root, copy_target + '/c2', '/renamed')
+        vfs.move(root, '/renamed/' + last_file, overlaid + '/f0.txt')
+        vfs.remove(root, moved, recursive=True)
+        vfs.remove(root, '/' + last_file)
+        check_refcounts(vfs)
+        if depth <= 4:
+            check_sizes(vfs)
+        for pattern in ('renamed', 'f0.txt', 'c2', 'moved', 'copy'):
+            assert [p for p, _ in VfsIndex.find(vfs, root, pattern)] == brute_find(vfs, root, pattern), pattern
+        assert VfsIndex.grep(vfs, root, 'copy changed') == [('/renamed/f0.txt', 'copy changed')]
+        print("Счетчики блобов, индексы размеров и имен совпадают с обходом: OK")
+
+        # Журнал воспроизводит дерево после rm/mv/cp
+        small = os.path.join(tmp, 'small.json')
+        generate(small, depth=2, fanout=3, files=2)
+        persistent = VirtualFileSystem(small, journal=True)
+        base = persistent.root
+        persistent.copy(base, '/d0', '/d1/copy', recursive=True)
+        persistent.change_permissions(base, '/d1/copy/f0.txt', '600')
+        persistent.sync()
+        before = os.path.getsize(journal_path(small))
+        persistent.move(base, '/d1/copy', '/moved')
+        persistent.sync()
+        # mv директории - одна запись, без содержимого поддерева
+        assert os.path.getsize(journal_path(small)) - before < 100
+        persistent.move(base, '/d2/f0.txt', '/moved/f1.txt')
+        persistent.remove(base, '/d0', recursive=True)
+        persistent.create_directory(base, '/d0/again')
+        persistent.move(base, '/d0', '/d1/d0')
+        expected = state(persistent)
+        persistent.close()
+        assert state(VirtualFileSystem(small)) == expected
+        for replaced in (False, True):
+            crash_in_compact(small, replaced)
+            assert state(VirtualFileSystem(small)) == expected
+            assert not os.path.exists(aside_path(small))
+        print("Журнал после rm/mv/cp воспроизводит дерево, в том числе после сбоя в compact: OK")
+
+        # Срок пачки журнала истекает и без новых записей: сброс на границе следующей команды
+        persistent = VirtualFileSystem(small, journal=True)
+        shell = ShellEmulator(small, vfs=persistent, output=CaptureSink())
+        shell.execute_line('mkdir /flushed')
+        time.sleep(BATCH_INTERVAL)
+        shell.execute_line('pwd')
+        assert VirtualFileSystem(small).resolve_path(None, '/flushed') is not None
+        persistent.close()
+        print("Пачка журнала сбрасывается на границе команды: OK")
+
+        # >> пишет в журнал только дописанные байты; сбой в compact ничего не удваивает
+        persistent = VirtualFileSystem(small, journal=True)
+        persistent.write_file(persistent.root, '/log.txt', ['x' * 10_000])
+        persistent.sync()
+        before = os.path.getsize(journal_path(small))
+        for i in range(100):
+            persistent.write_file(persistent.root, '/log.txt', [f'line {i}'], append=True)
+        persistent.sync()
+        growth = os.path.getsize(journal_path(small)) - before
+        assert growth < 100 * 100
+        expected = state(persistent)
+        persistent.close()
+        assert state(VirtualFileSystem(small)) == expected
+        for replaced in (False, True):
+            crash_in_compact(small, replaced)
+            assert state(VirtualFileSystem(small)) == expected
+        print(f"100 дописываний >> к файлу в 10 КБ: журнал +{growth} байт, повтор и повтор после сбоя в compact: OK")
+
+        # Перенос базового узла в слое сеанса и слияние
+        overlay = OverlayFileSystem(vfs)
+        overlay.move(overlay.root, overlaid, '/moved_base')
+        overlay.write_file(overlay.root, '/moved_base/f0.txt', ['session'])
+        assert vfs.resolve_path(root, overlaid) is not None
+        overlay.merge()
+        assert vfs.resolve_path(root, overlaid) is None
+        assert vfs.read_content(vfs.resolve_path(root, '/moved_base/f0.txt')) == 'session'
+        check_refcounts(vfs)
+        if depth <= 4:
+            check_sizes(vfs)
+        print("Перенос в слое сеанса и слияние: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Генератор синтетических образов vfs_structure.json заданной формы
+
+Дерево глубины depth: в каждой директории fanout поддиректорий d<i> и
+files файлов f<i>.txt с содержимым длины content_size. Образ пишется
+потоково, без построения дерева в памяти.
+
+Запуск: python benchmarks/generate_vfs.py <выходной_json> [--depth N] [--fanout N]
+        [--files N] [--content-size N] [--plain]
+"""
+
+import argparse
+import base64
+import json
+
+
+def make_content(size, seed=0):
+    """Детерминированный текст длины size"""
+    line = f"line {seed} " + "abcdefghijklmnopqrstuvwxyz" * 3 + "\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+def count_nodes(depth, fanout, files):
+    """Число узлов в образе такой формы, включая корень"""
+    dirs = sum(fanout ** level for level in range(depth + 1))
+    return dirs + dirs * files
+
+
+def generate(path, depth=3, fanout=10, files=10, content_size=64, encoded=True):
+    """Пишет образ в path и возвращает число узлов"""
+    content = make_content(content_size)
+    if encoded:
+        body = '"content_b64": %s' % json.dumps(base64.b64encode(content.encode('utf-8')).decode('ascii'))
+    else:
+        body = '"content": %s' % json.dumps(content, ensure_ascii=False)
+    file_entries = ', '.join('"f%d.txt": {"type": "file", "permissions": "644", %s}' % (i, body)
+                             for i in range(files))
+
+    with open(path, 'w', encoding='utf-8') as f:
+        # Стек: сколько поддиректорий еще осталось выписать на каждом уровне
+        f.write('{"type": "directory", "permissions": "755", "content": {')
+        f.write(file_entries)
+        stack = [0]
+        while stack:
+            level = len(stack) - 1
+            index = stack[-1]
+            if level == depth or index == fanout:
+                stack.pop()
+                f.write('}}')
+                continue
+            stack[-1] += 1
+            if files or index:
+                f.write(', ')
+            f.write('"d%d": {"type": "directory", "permissions": "755", "content": {' % index)
+            f.write(file_entries)
+            stack.append(0)
+    return count_nodes(depth, fanout, files)
+
+
+def sibling_dirs(count, depth, fanout):
+    """count путей директорий образа такой формы, не вложенных друг в друга:
+    с самого верхнего уровня, на котором их не меньше count"""
+    for level in range(1, depth + 1):
+        if fanout ** level >= count:
+            return [''.join(f"/d{index // fanout ** power % fanout}" for power in range(level - 1, -1, -1))
+                    for index in range(count)]
+    raise SystemExit(f"Образ глубины {depth} с ветвлением {fanout} мал для сценария: "
+                     f"нужно {count} директорий одного уровня")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--content-size', type=int, default=64)
+    parser.add_argument('--plain', action='store_true', help="содержимое в content, а не в content_b64")
+    args = parser.parse_args()
+
+    nodes = generate(args.path, args.depth, args.fanout, args.files, args.content_size, not args.plain)
+    print(f"Записан образ '{args.path}': {nodes} узлов")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,173 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import sys
 import os
 from ShellEmulator import ShellEmulator
+from VirtualFileSystem import VirtualFileSystem
+import BatchRunner
+from ShellServer import ShellServer
+from OutputSink import BufferedSink
+
+
+def make_snapshot(vfs_path, snapshot_path):
+    """Конвертирует JSON-образ VFS в бинарный снимок"""
+    try:
+        VirtualFileSystem(vfs_path).save_snapshot(snapshot_path)
+    except Exception as e:
+        print(f"ОШИБКА: {e}")
+        sys.exit(1)
+    print(f"Снимок VFS записан в '{snapshot_path}'")
+
+
+def make_shards(vfs_path, shards_path):
+    """Конвертирует образ VFS в шардированный (директория с index.json)"""
+    try:
+        index = VirtualFileSystem(vfs_path).save_shards(shards_path)
+    except Exception as e:
+        print(f"ОШИБКА: {e}")
+        sys.exit(1)
+    print(f"Шардированный образ записан в '{shards_path}': узлов {index['nodes']}, шардов {index['shards']}")
+
+
+def compact(vfs_path):
+    """Сворачивает журнал изменений в новый образ VFS"""
+    try:
+        VirtualFileSystem(vfs_path).compact()
+    except Exception as e:
+        print(f"ОШИБКА: {e}")
+        sys.exit(1)
+    print(f"Журнал свернут в '{vfs_path}'")
+
+
+def batch(args):
+    """Пакетный режим: один образ VFS, много скриптов в параллельных процессах"""
+    jobs = pop_option(args, '--jobs')
+    if len(args) < 2:
+        print("Использование: python main.py --batch [--jobs N] <путь_к_VFS> <скрипт_или_директория>...")
+        sys.exit(1)
+
+    try:
+        vfs = VirtualFileSystem(args[0])
+        scripts = BatchRunner.collect_scripts(args[1:])
+        results = BatchRunner.run_batch(vfs, scripts, int(jobs) if jobs else None)
+    except Exception as e:
+        print(f"ОШИБКА: {e}")
+        sys.exit(1)
+
+    failed = 0
+    # Вывод скриптов может содержать байты не в UTF-8 из файлов: их пишет sink
+    out = BufferedSink()
+    for script_path, status, output in results:
+        out.write_line("=" * 50)
+        out.write_line(f"{script_path} (код выхода {status})")
+        out.write_line("=" * 50)
+        out.write(output)
+        if status != 0:
+            failed += 1
+    out.write_line(f"Скриптов: {len(results)}, успешно: {len(results) - failed}, с ошибками: {failed}")
+    out.flush()
+    if failed:
+        sys.exit(1)
+
+
+def serve(args):
+    """Режим сервера: сеансы эмулятора через Unix- или TCP-сокет над одним образом VFS"""
+    unix_path = pop_option(args, '--unix')
+    port = pop_option(args, '--port')
+    host = pop_option(args, '--host') or '127.0.0.1'
+    if len(args) != 1 or (unix_path is None) == (port is None):
+        print("Использование: python main.py --serve <путь_к_VFS> (--unix <путь_к_сокету> | --port N [--host H])")
+        sys.exit(1)
+
+    try:
+        server = ShellServer(VirtualFileSystem(args[0]))
+    except Exception as e:
+        print(f"ОШИБКА: {e}")
+        sys.exit(1)
+
+    address = unix_path if unix_path is not None else f"{host}:{port}"
+    print(f"Сервер эмулятора слушает {address}", flush=True)
+    try:
+        asyncio.run(server.serve(unix_path, host, int(port) if port else None))
+    except KeyboardInterrupt:
+        print("Сервер остановлен")
+
+
+def pop_option(args, option):
+    """Убирает из списка аргументов опцию со значением, возвращает значение или None"""
+    if option not in args:
+        return None
+    index = args.index(option)
+    if index + 1 >= len(args):
+        print(f"ОШИБКА: для '{option}' не указано значение")
+        sys.exit(1)
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
+
+def pop_flag(args, flag):
+    """Убирает флаг из списка аргументов, возвращает True если он был"""
+    if flag in args:
+        args.remove(flag)
+        return True
+    return False
+
+
 def main():
     """Точка входа в приложение"""
+    args = sys.argv[1:]
+    if len(args) == 3 and args[0] == '--snapshot':
+        make_snapshot(args[1], args[2])
+        return
+    if len(args) == 3 and args[0] == '--shards':
+        make_shards(args[1], args[2])
+        return
+    if len(args) == 2 and args[0] == '--compact':
+        compact(args[1])
+        return
+    if args and args[0] == '--batch':
+        batch(args[1:])
+        return
+    if args and args[0] == '--serve':
+        serve(args[1:])
+        return
+
+    persist = pop_flag(args, '--persist')
+    watch = pop_flag(args, '--watch')
+    atomic = pop_flag(args, '--atomic')
+    profile_path = pop_option(args, '--profile')
+
     # Обработка параметров командной строки
-    if len(sys.argv) not in [1, 3]:
+    if len(args) not in [0, 2]:
         print("Использование:")
-        print("  Интерактивный режим: python main.py")
-        print("  Режим скрипта: python main.py <путь_к_VFS> <путь_к_скрипту>")
+        print("  Интерактивный режим: python main.py [--persist] [--watch] [--profile <файл.json>]")
+        print("  Режим скрипта: python main.py [--persist] [--watch] [--atomic] [--profile <файл.json>] "
+              "<путь_к_VFS> <путь_к_скрипту>")
+        print("  Создание снимка VFS: python main.py --snapshot <путь_к_JSON> <путь_к_снимку>")
+        print("  Шардированный образ: python main.py --shards <путь_к_VFS> <директория_образа>")
+        print("  Свертка журнала изменений в образ: python main.py --compact <путь_к_VFS>")
+        print("  Пакетный режим: python main.py --batch [--jobs N] <путь_к_VFS> <скрипт_или_директория>...")
+        print("  Сервер сеансов: python main.py --serve <путь_к_VFS> (--unix <путь_к_сокету> | --port N [--host H])")
         print("Пример: python main.py utils/vfs_structure.json scripts/test_script.txt")
+        print("Вместо JSON можно передать снимок (--snapshot) или директорию шардированного образа (--shards)")
+        print("--persist сохраняет изменения VFS в журнал <путь_к_VFS>.journal")
+        print("--watch перед каждой командой применяет изменения образа на диске (как команда reload)")
+        print("--atomic при ошибке в скрипте отменяет все его изменения VFS")
+        print("--profile записывает при выходе время команд и счетчики VFS в JSON")
         sys.exit(1)
 
     # Режим работы
-    if len(sys.argv) == 1:
+    if not args:
         # Интерактивный режим
         vfs_path = "utils/vfs_structure.json"  # путь по умолчанию
         script_path = None
     else:
         # Режим скрипта
-        vfs_path = sys.argv[1]
-        script_path = sys.argv[2]
+        vfs_path = args[0]
+        script_path = args[1]
 
     # Проверка существования файла VFS
     if not os.path.exists(vfs_path):
@@ -44,14 +189,22 @@ def main():
         print("=" * 50)
         print()
 
+    shell = None
     try:
-        shell = ShellEmulator(vfs_path, script_path)
+        shell = ShellEmulator(vfs_path, script_path, persist=persist, watch=watch, atomic=atomic)
+        if profile_path:
+            shell.enable_profiling()
         success = shell.run()
         if not success:
             sys.exit(1)
     except Exception as e:
         print(f"ОШИБКА: {e}")
         sys.exit(1)
+    finally:
+        if shell is not None:
+            if profile_path and shell.profiler is not None:
+                shell.profiler.dump(profile_path)
+            shell.vfs.close()
 
 
 if __name__ == "__main__":